@@ -0,0 +1,238 @@
+import asyncio
+from collections import OrderedDict
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Literal
+import logging
+
+from pydantic import BaseModel, Field
+
+from . import env
+
+logger = logging.getLogger(__name__)
+
+# Rate limiting and admission control, as ASGI middleware in front of the
+# whole app, so rejected requests cost no routing, body parsing or auth
+# beyond a cached token lookup.
+#
+# Rate limits are token buckets per client: one per user (the JWT's `sub`)
+# and one per IP address, refilled at `rate` tokens per second up to `burst`.
+# A request takes its route's cost (1 by default) from both, and is rejected
+# with 429 and the seconds until it would fit as Retry-After. Buckets live in
+# the worker ('local'), so each worker grants the full rate, or in Couchbase
+# ('couchbase'), shared by every worker and instance at the price of a KV
+# round trip per bucket and request. A failing shared backend lets requests
+# through rather than rejecting everything.
+#
+# Admission control protects the worker itself: once `max_in_flight`
+# requests are being handled, or the event loop runs more than
+# `max_loop_lag_s` behind (see start_loop_lag_monitor), new requests get 503
+# straight away instead of queueing behind the ones it cannot keep up with.
+
+# Seconds between event loop lag measurements.
+_LAG_INTERVAL_S = 0.1
+
+# Retry-After of requests shed by admission control.
+_SHED_RETRY_AFTER_S = 1
+
+COLLECTION = 'rate_limits'
+
+class AdmissionConf(BaseModel):
+    backend: Literal['local', 'couchbase'] = 'local'
+    # Tokens per second; 0 disables the limit.
+    user_rate: float = Field(0, ge=0)
+    user_burst: int = Field(1, ge=1)
+    ip_rate: float = Field(0, ge=0)
+    ip_burst: int = Field(1, ge=1)
+    # Tokens taken by requests to a path, for paths costing more than 1.
+    costs: Dict[str, int] = {}
+    # Proxies in front of the app whose X-Forwarded-For entries are trusted.
+    trusted_proxies: int = Field(0, ge=0)
+    # Buckets kept per limit by the local backend; the least recently used
+    # bucket is dropped beyond that, which refills it.
+    max_keys: int = Field(100000, gt=0)
+    # 0 disables each check.
+    max_in_flight: int = Field(0, ge=0)
+    max_loop_lag_s: float = Field(0, ge=0)
+    exempt_paths: List[str] = ['/metrics']
+
+#### Load ####
+
+_stats = {'in_flight': 0, 'admitted': 0, 'shed_in_flight': 0, 'shed_loop_lag': 0,
+          'rate_limited_user': 0, 'rate_limited_ip': 0, 'backend_errors': 0}
+_loop_lag_s = 0.0
+
+async def _monitor_loop_lag() -> None:
+    global _loop_lag_s
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(_LAG_INTERVAL_S)
+        _loop_lag_s = max(0.0, time.perf_counter() - started - _LAG_INTERVAL_S)
+
+def start_loop_lag_monitor() -> asyncio.Task:
+    """Starts measuring how late the event loop runs a sleeping task. Must be called from the event loop."""
+    return asyncio.create_task(_monitor_loop_lag())
+
+def get_stats() -> Dict[str, float]:
+    return dict(_stats, loop_lag_ms=round(_loop_lag_s * 1000, 3))
+
+#### Token buckets ####
+
+def _take(tokens: float, updated: float, now: float, rate: float, burst: int, cost: int) -> tuple[float, float]:
+    """Refills a bucket and takes `cost` tokens from it.
+
+    Returns the tokens left and 0, or, if there are not enough, the tokens
+    left untouched and the seconds until there will be.
+    """
+    # A request costing more than the burst would never fit otherwise.
+    cost = min(cost, burst)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+class LocalBuckets:
+    """Token buckets by key in this worker. Only used from the event loop."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self._rate = rate
+        self._burst = burst
+        self._max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, cost: int) -> float:
+        "Takes `cost` tokens and returns 0, or the seconds until they are available."
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self._burst, now))
+        tokens, wait_s = _take(tokens, updated, now, self._rate, self._burst, cost)
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+        return wait_s
+
+class CouchbaseBuckets:
+    """Token buckets by key in Couchbase, shared by every process using the same bucket.
+
+    Each is a document of the tokens left and when they were counted,
+    updated under optimistic locking and expiring once it would be full.
+    """
+
+    def __init__(self, rate: float, burst: int, prefix: str):
+        self._rate = rate
+        self._burst = burst
+        self._prefix = prefix
+        self._expiry_s = math.ceil(burst / rate) + 1
+
+    def _take_sync(self, key: str, cost: int) -> float:
+        # Imported here so the local backend never loads the SDK.
+        from . import couchbase as cb
+        wait_s = 0.0
+
+        def update(doc: Dict[str, float] | None) -> Dict[str, float] | None:
+            nonlocal wait_s
+            now = time.time()
+            tokens, wait_s = _take(doc['tokens'], doc['updated'], now, self._rate, self._burst, cost) if doc \
+                else _take(self._burst, now, now, self._rate, self._burst, cost)
+            return None if wait_s else {'tokens': tokens, 'updated': now}
+
+        cb.update(env.get_couchbase_conf(),
+                  cb.DocRef(bucket=env.get_couchbase_bucket(), collection=COLLECTION, key=f"{self._prefix}:{key}"),
+                  update, self._expiry_s)
+        return wait_s
+
+    async def take(self, key: str, cost: int) -> float:
+        "Takes `cost` tokens and returns 0, or the seconds until they are available."
+        from couchbase.exceptions import CouchbaseException
+        try:
+            return await asyncio.to_thread(self._take_sync, key, cost)
+        except CouchbaseException as e:
+            if not _stats['backend_errors']:
+                logger.warning(f"Rate limit backend failing, letting requests through: {e}")
+            _stats['backend_errors'] += 1
+            return 0.0
+
+def _buckets(conf: AdmissionConf, rate: float, burst: int, prefix: str) -> LocalBuckets | CouchbaseBuckets | None:
+    if not rate:
+        return None
+    if conf.backend == 'couchbase':
+        return CouchbaseBuckets(rate, burst, prefix)
+    return LocalBuckets(rate, burst, conf.max_keys)
+
+#### Middleware ####
+
+def _header(scope: Dict[str, Any], name: bytes) -> str | None:
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+class AdmissionMiddleware:
+    """Rejects requests over their client's rate limits or arriving while the worker is overloaded.
+
+    `identify` returns the user of a bearer token, or None if the token is
+    invalid. Only HTTP requests are checked; WebSocket connections and
+    lifespan events pass straight through.
+    """
+
+    def __init__(self, app: Callable, conf: AdmissionConf, identify: Callable[[str], str | None]):
+        self._app = app
+        self._conf = conf
+        self._identify = identify
+        self._user_buckets = _buckets(conf, conf.user_rate, conf.user_burst, 'user')
+        self._ip_buckets = _buckets(conf, conf.ip_rate, conf.ip_burst, 'ip')
+        self._exempt = frozenset(conf.exempt_paths)
+
+    def _client_ip(self, scope: Dict[str, Any]) -> str:
+        if self._conf.trusted_proxies and (forwarded := _header(scope, b'x-forwarded-for')):
+            hops = [hop.strip() for hop in forwarded.split(',')]
+            return hops[max(0, len(hops) - self._conf.trusted_proxies)]
+        return scope['client'][0] if scope.get('client') else ''
+
+    def _user(self, scope: Dict[str, Any]) -> str | None:
+        method, _, token = (_header(scope, b'authorization') or '').partition(' ')
+        return self._identify(token) if method == 'Bearer' and token else None
+
+    def _shed(self) -> str | None:
+        "Returns the stat counting the reason to shed a new request, if any."
+        if self._conf.max_in_flight and _stats['in_flight'] >= self._conf.max_in_flight:
+            return 'shed_in_flight'
+        if self._conf.max_loop_lag_s and _loop_lag_s > self._conf.max_loop_lag_s:
+            return 'shed_loop_lag'
+        return None
+
+    async def _rate_limit(self, scope: Dict[str, Any]) -> tuple[str, float] | None:
+        "Returns the stat counting the exceeded limit and the seconds to wait, if any."
+        cost = self._conf.costs.get(scope['path'], 1)
+        if self._user_buckets and (user := self._user(scope)):
+            if wait_s := await self._user_buckets.take(user, cost):
+                return 'rate_limited_user', wait_s
+        if self._ip_buckets:
+            if wait_s := await self._ip_buckets.take(self._client_ip(scope), cost):
+                return 'rate_limited_ip', wait_s
+        return None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Any]],
+                       send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        if scope['type'] != 'http' or scope['path'] in self._exempt:
+            return await self._app(scope, receive, send)
+        if reason := self._shed():
+            _stats[reason] += 1
+            return await _reject(send, 503, _SHED_RETRY_AFTER_S, "Server is overloaded")
+        _stats['in_flight'] += 1
+        try:
+            if limited := await self._rate_limit(scope):
+                _stats[limited[0]] += 1
+                return await _reject(send, 429, limited[1], "Rate limit exceeded")
+            _stats['admitted'] += 1
+            await self._app(scope, receive, send)
+        finally:
+            _stats['in_flight'] -= 1
+
+async def _reject(send: Callable[[Dict[str, Any]], Awaitable[None]], status: int, retry_after_s: float,
+                  detail: str) -> None:
+    body = f'{{"detail":"{detail}"}}'.encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            (b'retry-after', str(max(1, math.ceil(retry_after_s))).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
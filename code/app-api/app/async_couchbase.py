@@ -0,0 +1,66 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List
+import logging
+
+from . import couchbase as cb
+
+logger = logging.getLogger(__name__)
+
+# The Couchbase SDK releases the GIL while waiting on the network, so running
+# the pooled synchronous operations on a bounded thread pool keeps the event
+# loop free without opening a second set of connections.
+
+_DEFAULT_MAX_WORKERS = 16
+
+_executor: ThreadPoolExecutor | None = None
+
+#### Executor ####
+
+def configure(max_workers: int = _DEFAULT_MAX_WORKERS) -> None:
+    """Sets up the executor used for Couchbase operations."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='couchbase')
+    logger.info(f"Couchbase executor running with {max_workers} workers")
+
+def shutdown() -> None:
+    """Stops the executor, waiting for in-flight operations to finish."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    if _executor is None:
+        configure()
+    return _executor
+
+async def _run(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+#### Operations ####
+
+async def exec(conf: cb.ConnectionConf, query: str, *args, **kwargs) -> Dict[str, Any]:
+    return await _run(cb.exec, conf, query, *args, **kwargs)
+
+async def insert(config: cb.ConnectionConf, spec: cb.DocSpec) -> Dict[str, Any]:
+    return await _run(cb.insert, config, spec)
+
+async def remove(config: cb.ConnectionConf, ref: cb.DocRef) -> Dict[str, Any]:
+    return await _run(cb.remove, config, ref)
+
+async def get(config: cb.ConnectionConf, ref: cb.DocRef) -> Dict[str, Any]:
+    return await _run(cb.get, config, ref)
+
+async def insert_multi(config: cb.ConnectionConf, specs: List[cb.DocSpec]) -> List[Any]:
+    return await _run(cb.insert_multi, config, specs)
+
+async def remove_multi(config: cb.ConnectionConf, refs: List[cb.DocRef]) -> List[Any]:
+    return await _run(cb.remove_multi, config, refs)
+
+async def get_multi(config: cb.ConnectionConf, refs: List[cb.DocRef]) -> List[Any]:
+    return await _run(cb.get_multi, config, refs)
@@ -0,0 +1,254 @@
+import asyncio
+import base64
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+import logging
+
+from pydantic import BaseModel, Field
+
+from . import events, loadgen, serialization, standins
+from .couchbase_standin import CouchbaseStandin
+
+logger = logging.getLogger(__name__)
+
+# Benchmarks the real app in-process against local stand-ins for Couchbase,
+# the JWKS endpoint and Kafka (see standins.py and couchbase_standin.py).
+# Each scenario seeds the data it needs, warms up, then runs a timed pass at
+# the configured concurrency and a sequential allocation pass.
+
+class BenchmarkConf(BaseModel):
+    requests: int = Field(1000, gt=0)
+    concurrency: int = Field(32, gt=0)
+    warmup_requests: int = Field(20, ge=0)
+    allocation_requests: int = Field(50, ge=0)
+    kv_latency_ms: float = Field(0.5, ge=0)
+    query_latency_ms: float = Field(2.0, ge=0)
+    subscribers: int = Field(50, gt=0)
+
+class BenchmarkError(Exception):
+    pass
+
+_AUDIENCE = 'benchmark'
+
+class _Harness:
+    def __init__(self, conf: BenchmarkConf, client: loadgen.AsgiClient, couchbase: CouchbaseStandin,
+                 kafka: standins.Kafka, jwks: standins.JwksServer, max_page_size: int, subscription_queue_size: int):
+        self.conf = conf
+        self.client = client
+        self.couchbase = couchbase
+        self.kafka = kafka
+        self.jwks = jwks
+        self.max_page_size = max_page_size
+        self.subscription_queue_size = subscription_queue_size
+
+    async def graphql(self, query: str, variables: Dict[str, Any] | None = None,
+                      headers: Dict[str, str] | None = None) -> Dict[str, Any]:
+        status, body = await self.client.post_json('/api', {'query': query, 'variables': variables or {}}, headers)
+        if status != 200 or body.get('errors'):
+            raise BenchmarkError(f"GraphQL request failed with {status}: {body}")
+        return body['data']
+
+    async def measure(self, request: Callable[[int], Awaitable[Any]], concurrency: int | None = None) -> Dict[str, Any]:
+        for index in range(self.conf.warmup_requests):
+            await request(index)
+        result = await loadgen.run_load(request, self.conf.requests, concurrency or self.conf.concurrency)
+        result['allocations'] = await loadgen.measure_allocations(request, self.conf.allocation_requests)
+        return result
+
+#### Scenarios ####
+
+_LIST_DOCUMENTS = '''
+query ListDocuments($first: Int, $after: String) {
+  documents(first: $first, after: $after) {
+    edges { node { id name email } }
+    pageInfo { hasNextPage endCursor }
+  }
+}
+'''
+
+_SIGNATURES_WITH_DOCUMENTS = '''
+query SignaturesWithDocuments($first: Int) {
+  signatures(first: $first) {
+    edges { node { id signedTs signedContent document { id name content } } }
+  }
+}
+'''
+
+_HELLO = 'query Hello { hello { message } }'
+
+_PRODUCT_ADDED = 'subscription ProductAdded { productAdded { id name } }'
+
+def _cursor(id: str) -> str:
+    return base64.urlsafe_b64encode(id.encode()).decode()
+
+def _list_documents(rows: int) -> Callable[[_Harness], Awaitable[Dict[str, Any]]]:
+    """One page per request, cycling through every page of a `rows` collection."""
+    async def scenario(h: _Harness) -> Dict[str, Any]:
+        ids = [f"document-{i:07d}" for i in range(rows)]
+        h.couchbase.seed('documents', {id: {'name': f"Document {id}", 'checksum': '', 'first_name': 'Ada',
+                                            'last_name': 'Lovelace', 'email': 'ada@example.com'} for id in ids})
+        page_size = min(rows, h.max_page_size)
+        cursors = [None, *(_cursor(ids[i - 1]) for i in range(page_size, rows, page_size))]
+
+        async def request(index: int) -> None:
+            data = await h.graphql(_LIST_DOCUMENTS, {'first': page_size, 'after': cursors[index % len(cursors)]})
+            if not data['documents']['edges']:
+                raise BenchmarkError("Empty page")
+
+        return {**await h.measure(request), 'rows': rows, 'rows_per_request': page_size}
+    return scenario
+
+async def _signatures_fanout(h: _Harness) -> Dict[str, Any]:
+    """A page of signatures resolving each one's document and both bodies."""
+    from . import db
+    page_size = h.max_page_size
+    for collection in ('documents', 'signatures', 'blobs'):
+        h.couchbase.seed(collection, {})
+    documents = await db.create_documents([
+        {'name': f"Document {i}", 'content': f"Body of document {i}. " * 50,
+         'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com'} for i in range(page_size)
+    ])
+    await db.create_signatures([
+        {'document_id': d.id, 'signed_by_email': 'ada@example.com', 'signed_content': f"Signed: {d.name}"}
+        for d in documents
+    ])
+
+    async def request(index: int) -> None:
+        data = await h.graphql(_SIGNATURES_WITH_DOCUMENTS, {'first': page_size})
+        if len(data['signatures']['edges']) != page_size:
+            raise BenchmarkError("Missing signatures")
+
+    return {**await h.measure(request), 'signatures_per_request': page_size}
+
+async def _auth_cached(h: _Harness) -> Dict[str, Any]:
+    """Authenticated requests all carrying the same token."""
+    headers = {'authorization': f"Bearer {h.jwks.issue_token('benchmark-user')}"}
+
+    async def request(index: int) -> None:
+        await h.graphql(_HELLO, headers=headers)
+
+    return await h.measure(request)
+
+async def _auth_distinct(h: _Harness) -> Dict[str, Any]:
+    """Authenticated requests each carrying a token the app has not seen."""
+    count = h.conf.warmup_requests + h.conf.requests + h.conf.allocation_requests
+    tokens = iter([h.jwks.issue_token(f"benchmark-user-{i}") for i in range(count)])
+
+    async def request(index: int) -> None:
+        await h.graphql(_HELLO, headers={'authorization': f"Bearer {next(tokens)}"})
+
+    return await h.measure(request)
+
+async def _subscriptions(h: _Harness) -> Dict[str, Any]:
+    """Products published to Kafka and fanned out to `subscribers` WebSockets.
+
+    A request publishes one product and completes when every subscriber has
+    received it; `delivery_latency_ms` covers each individual delivery.
+    """
+    subscribers = h.conf.subscribers
+    sent: Dict[str, float] = {}
+    received: Dict[str, int] = {}
+    complete: Dict[str, asyncio.Event] = {}
+    deliveries: List[float] = []
+
+    async def receive(socket: loadgen.WebSocket) -> None:
+        while True:
+            message = await socket.receive_json()
+            if message['type'] != 'next':
+                raise BenchmarkError(f"Unexpected subscription message: {message}")
+            id = message['payload']['data']['productAdded']['id']
+            deliveries.append(time.perf_counter() - sent[id])
+            received[id] += 1
+            if received[id] == subscribers:
+                complete.pop(id).set()
+
+    sockets = []
+    for i in range(subscribers):
+        socket = h.client.websocket('/api', ['graphql-transport-ws'])
+        await socket.connect()
+        await socket.send_json({'type': 'connection_init'})
+        if (ack := await socket.receive_json())['type'] != 'connection_ack':
+            raise BenchmarkError(f"Subscription not acknowledged: {ack}")
+        await socket.send_json({'id': '1', 'type': 'subscribe', 'payload': {'query': _PRODUCT_ADDED}})
+        sockets.append(socket)
+    receivers = [asyncio.create_task(receive(socket)) for socket in sockets]
+    while events.get_stats()['products']['subscribers'] < subscribers:
+        await asyncio.sleep(0.01)
+
+    producer = h.kafka.producer({})
+    counter = iter(range(1 << 62))
+
+    async def request(index: int) -> None:
+        id = f"product-{next(counter)}"
+        complete[id] = done = asyncio.Event()
+        received[id] = 0
+        sent[id] = time.perf_counter()
+        producer.produce('products', serialization.encode('products', {'id': id, 'name': 'Benchmark product'}), id)
+        await done.wait()
+
+    try:
+        # Stay well inside the per-subscriber queue so no one is dropped.
+        result = await h.measure(request, min(h.conf.concurrency, h.subscription_queue_size // 2))
+    finally:
+        for receiver in receivers:
+            receiver.cancel()
+        for socket in sockets:
+            await socket.close()
+    return {**result, 'subscribers': subscribers, 'delivery_latency_ms': loadgen.summarize_latencies(deliveries)}
+
+SCENARIOS: Dict[str, Callable[[_Harness], Awaitable[Dict[str, Any]]]] = {
+    'list_documents_10': _list_documents(10),
+    'list_documents_1k': _list_documents(1000),
+    'list_documents_100k': _list_documents(100000),
+    'signatures_fanout': _signatures_fanout,
+    'auth_cached': _auth_cached,
+    'auth_distinct': _auth_distinct,
+    'subscriptions': _subscriptions,
+}
+
+#### Running ####
+
+def _configure_environment(jwks: standins.JwksServer) -> None:
+    os.environ.update({
+        'AUTH_OIDC_AUDIENCE': _AUDIENCE,
+        'AUTH_OIDC_JWK_URL': jwks.url,
+        'HTTP_PORT': os.environ.get('HTTP_PORT') or '8080',
+        'KAFKA_BROKER': 'standin:9092',
+        'COUCHBASE_USERNAME': 'benchmark',
+        'COUCHBASE_PASSWORD': 'benchmark',
+    })
+    # Features that need real infrastructure or would skew the numbers.
+    for name in ('CACHE_INVALIDATION_TOPIC', 'WRITE_BEHIND', 'METRICS_DIR', 'HTTP_GRAPHQL_PERSISTED_QUERY_ALLOWLIST',
+                 'RATE_LIMIT_USER_RATE', 'RATE_LIMIT_IP_RATE', 'ADMISSION_MAX_IN_FLIGHT', 'ADMISSION_MAX_LOOP_LAG'):
+        os.environ.pop(name, None)
+
+async def _run(conf: BenchmarkConf, scenarios: List[str]) -> Dict[str, Any]:
+    jwks = standins.JwksServer(_AUDIENCE)
+    jwks.start()
+    try:
+        _configure_environment(jwks)
+        couchbase = CouchbaseStandin(conf.kv_latency_ms / 1000, conf.query_latency_ms / 1000)
+        couchbase.install()
+        kafka = standins.Kafka()
+        kafka.install(events)
+        # Imported last: building the app reads the environment set above.
+        from . import env, routes
+        results = {}
+        async with loadgen.lifespan(routes.app):
+            harness = _Harness(conf, loadgen.AsgiClient(routes.app), couchbase, kafka, jwks,
+                               env.get_http_graphql_max_page_size(), env.get_subscription_queue_size())
+            for name in scenarios:
+                logger.info(f"Running benchmark {name}")
+                results[name] = await SCENARIOS[name](harness)
+        return loadgen.report('app-api', conf.model_dump(), results)
+    finally:
+        jwks.stop()
+
+def run(conf: BenchmarkConf, scenarios: List[str]) -> Dict[str, Any]:
+    """Runs the named scenarios and returns the report.
+
+    Replaces the Couchbase and Kafka clients for the rest of the process, so
+    it must run in a process of its own.
+    """
+    return asyncio.run(_run(conf, scenarios))
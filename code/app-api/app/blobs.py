@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import uuid
+import logging
+
+from couchbase.exceptions import DocumentExistsException, DocumentNotFoundException
+import zstandard
+
+from . import async_couchbase as acb, couchbase as cb, env
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed store for document and signature bodies. Each body is kept
+# once, zstd-compressed, under the hex SHA-256 of its UTF-8 encoding, which is
+# the same value db.py stores as `checksum`/`signed_checksum`.
+#
+# The value under the checksum is tagged: small bodies are stored inline,
+# larger ones as a manifest pointing at fixed-size chunks of the compressed
+# stream. Chunks are written while the body is still arriving, before its
+# checksum is known, so they are keyed by an upload id instead.
+
+COLLECTION = 'blobs'
+
+CHUNK_SIZE = 1 << 20
+
+# Largest body (UTF-8 bytes) a Kafka event carries inline; larger ones are
+# stored here first and the event carries only the checksum. Well under the
+# producers' 1 MB message limit, and small enough that the consumer can store
+# an inline body as a single chunk.
+MAX_EVENT_BODY_SIZE = 256 << 10
+
+_COMPRESSION_LEVEL = 3
+
+# Larger bodies (or writes, or compressed bodies when reading) are hashed,
+# compressed and decompressed in a thread rather than on the event loop; for
+# small ones the hop costs more than it saves.
+MAX_LOOP_WORK_SIZE = 64 << 10
+
+_INLINE = b'z'
+_MANIFEST = b'm'
+
+def _chunk_key(upload_id: str, index: int) -> str:
+    return f"chunk::{upload_id}::{index}"
+
+#### Storage ####
+
+async def _insert(key: str, value: bytes) -> None:
+    await acb.insert(env.get_couchbase_conf(),
+                     cb.DocSpec(bucket=env.get_couchbase_bucket(),
+                                collection=COLLECTION,
+                                key=key,
+                                data=value,
+                                binary=True))
+
+async def _get(key: str) -> bytes | None:
+    try:
+        result = await acb.get(env.get_couchbase_conf(),
+                               cb.DocRef(bucket=env.get_couchbase_bucket(),
+                                         collection=COLLECTION,
+                                         key=key,
+                                         binary=True))
+    except DocumentNotFoundException:
+        return None
+    return result.value
+
+async def _get_many(keys: list[str]) -> list[bytes]:
+    results = await acb.get_multi(env.get_couchbase_conf(),
+                                  [cb.DocRef(bucket=env.get_couchbase_bucket(),
+                                             collection=COLLECTION,
+                                             key=key,
+                                             binary=True) for key in keys])
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return [result.value for result in results]
+
+async def _remove(key: str) -> None:
+    try:
+        await acb.remove(env.get_couchbase_conf(),
+                         cb.DocRef(bucket=env.get_couchbase_bucket(),
+                                   collection=COLLECTION,
+                                   key=key))
+    except DocumentNotFoundException:
+        pass
+
+#### Writing ####
+
+class BlobWriter:
+    """Stores a body as it is written, hashing and compressing incrementally.
+
+    Memory use is bounded by CHUNK_SIZE regardless of the size of the body.
+    """
+
+    def __init__(self):
+        self._upload_id = str(uuid.uuid4())
+        self._hash = hashlib.sha256()
+        self._compressor = zstandard.ZstdCompressor(level=_COMPRESSION_LEVEL).compressobj()
+        self._buffer = bytearray()
+        self._chunks = 0
+        self.size = 0
+
+    async def _write_chunk(self, data: bytes) -> None:
+        await _insert(_chunk_key(self._upload_id, self._chunks), data)
+        self._chunks += 1
+
+    def _digest(self, data: bytes) -> bytes:
+        self._hash.update(data)
+        return self._compressor.compress(data)
+
+    async def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if len(data) <= MAX_LOOP_WORK_SIZE:
+            self._buffer += self._digest(data)
+        else:
+            self._buffer += await asyncio.to_thread(self._digest, data)
+        while len(self._buffer) >= CHUNK_SIZE:
+            await self._write_chunk(bytes(self._buffer[:CHUNK_SIZE]))
+            del self._buffer[:CHUNK_SIZE]
+
+    async def close(self) -> str:
+        """Finishes the body and returns its checksum."""
+        self._buffer += self._compressor.flush()
+        checksum = self._hash.hexdigest()
+        if self._chunks == 0:
+            value = _INLINE + bytes(self._buffer)
+        else:
+            if self._buffer:
+                await self._write_chunk(bytes(self._buffer))
+            value = _MANIFEST + json.dumps({'upload': self._upload_id, 'chunks': self._chunks}).encode()
+        self._buffer.clear()
+        try:
+            await _insert(checksum, value)
+        except DocumentExistsException:
+            logger.debug(f"Blob {checksum} already stored")
+            await self.abort()
+        return checksum
+
+    async def abort(self) -> None:
+        """Removes any chunks written so far."""
+        await asyncio.gather(*(_remove(_chunk_key(self._upload_id, i)) for i in range(self._chunks)))
+        self._chunks = 0
+
+#### Operations ####
+
+def _decompress(chunks: list[bytes]) -> str:
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    return b''.join(decompressor.decompress(chunk) for chunk in chunks).decode()
+
+async def put(content: bytes) -> str:
+    """Stores `content` unless an identical body exists and returns its checksum."""
+    writer = BlobWriter()
+    await writer.write(content)
+    return await writer.close()
+
+async def get(checksum: str) -> str | None:
+    if (value := await _get(checksum)) is None:
+        return None
+    tag, payload = value[:1], value[1:]
+    if tag == _INLINE:
+        chunks = [payload]
+    else:
+        manifest = json.loads(payload)
+        chunks = await _get_many([_chunk_key(manifest['upload'], i) for i in range(manifest['chunks'])])
+    if sum(len(chunk) for chunk in chunks) <= MAX_LOOP_WORK_SIZE:
+        return _decompress(chunks)
+    return await asyncio.to_thread(_decompress, chunks)
+
+async def load(checksums: list[str]) -> list[str | None]:
+    "Batch function for the per-request blob DataLoader."
+    return await asyncio.gather(*(get(checksum) for checksum in checksums))
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable
+import logging
+
+from . import env
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache for the small, rarely changing reference collections.
+# Each collection has one cache of items by id and one of list pages by query.
+# Local mutations invalidate immediately; other workers are told through the
+# publisher set by events.py, and entries expire after a TTL regardless.
+
+CACHED_COLLECTIONS = ('fields', 'templates')
+
+#### Cache ####
+
+class TTLCache:
+    """Bounded LRU whose entries expire `ttl_s` seconds after being stored."""
+
+    def __init__(self, max_size: int, ttl_s: float):
+        self._max_size = max_size
+        self._ttl_s = ttl_s
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        "Returns (found, value)."
+        with self._lock:
+            if entry := self._entries.get(key):
+                value, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return True, value
+                del self._entries[key]
+            self.stats['misses'] += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl_s)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+#### Collections ####
+
+_items: Dict[str, TTLCache] = {}
+_lists: Dict[str, TTLCache] = {}
+_publisher: Callable[[str, list[str]], None] | None = None
+
+def _get(caches: Dict[str, TTLCache], collection: str) -> TTLCache:
+    if (cache := caches.get(collection)) is None:
+        cache = caches[collection] = TTLCache(env.get_cache_max_size(), env.get_cache_ttl())
+    return cache
+
+def items(collection: str) -> TTLCache:
+    "Returns the cache of `collection` items by id."
+    return _get(_items, collection)
+
+def lists(collection: str) -> TTLCache:
+    "Returns the cache of `collection` list pages by query."
+    return _get(_lists, collection)
+
+def invalidate(collection: str, ids: Iterable[str] = (), broadcast: bool = True) -> None:
+    """Drops the items `ids` and all list pages of `collection`.
+
+    Unless `broadcast` is False the invalidation is also sent to the other
+    workers.
+    """
+    ids = list(ids)
+    item_cache = items(collection)
+    for id in ids:
+        item_cache.invalidate(id)
+    lists(collection).clear()
+    if broadcast and _publisher is not None:
+        _publisher(collection, ids)
+
+def invalidate_all() -> None:
+    "Drops everything without broadcasting, e.g. after missing invalidations."
+    for collection in CACHED_COLLECTIONS:
+        items(collection).clear()
+        lists(collection).clear()
+
+def set_publisher(publisher: Callable[[str, list[str]], None] | None) -> None:
+    "Sets the function that sends invalidations to the other workers."
+    global _publisher
+    _publisher = publisher
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    return {f"{collection}.{kind}": dict(cache.stats, size=len(cache))
+            for kind, caches in (('items', _items), ('lists', _lists))
+            for collection, cache in caches.items()}
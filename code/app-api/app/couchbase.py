@@ -1,15 +1,26 @@
-import json
+from functools import lru_cache
+import re
+import threading
+import time
 from datetime import timedelta
-from typing import Annotated, Any, Dict
+from typing import Annotated, Any, Callable, Dict, List, Tuple
 import logging
 
 from couchbase.auth import PasswordAuthenticator
 from couchbase.cluster import Cluster
-from couchbase.exceptions import CouchbaseException
-from couchbase.options import ClusterOptions, QueryOptions
+from couchbase.collection import Collection
+from couchbase.durability import DurabilityLevel, ServerDurability
+from couchbase.exceptions import (CasMismatchException, CouchbaseException, DocumentExistsException,
+                                  DocumentNotFoundException, RequestCanceledException,
+                                  ServiceUnavailableException, UnAmbiguousTimeoutException)
+from couchbase.options import (ClusterOptions, GetMultiOptions, GetOptions, InsertMultiOptions, InsertOptions,
+                               QueryOptions, RemoveMultiOptions, ReplaceOptions, UpsertMultiOptions)
+from couchbase.transcoder import RawBinaryTranscoder
 from pydantic import BaseModel, StringConstraints, validate_arguments
 from pydantic.networks import Url, UrlConstraints
 
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
 #### Types ####
@@ -31,6 +42,7 @@ class DocRef(BaseModel):
     scope: str = '_default'
     collection: str = '_default'
     key: str
+    binary: bool = False
 
 class DocSpec(BaseModel):
     key: str
@@ -38,6 +50,7 @@ class DocSpec(BaseModel):
     bucket: str
     scope: str = '_default'
     collection: str = '_default'
+    binary: bool = False
 
 #### Utils ####
 
@@ -45,27 +58,166 @@ class DocSpec(BaseModel):
 def get_authenticator(conf: ConnectionConf) -> PasswordAuthenticator:
     return PasswordAuthenticator(conf.username, conf.password)
 
+#### Connection pool ####
+
+# Errors that mean the connection itself is unusable and that the operation
+# was never applied, so it is safe to reconnect and retry once.
+_RECONNECT_ERRORS = (RequestCanceledException, ServiceUnavailableException, UnAmbiguousTimeoutException)
+
+_HEALTH_CHECK_INTERVAL_S = 30
+
+class _Connection:
+    def __init__(self, cluster: Cluster):
+        self.cluster = cluster
+        self.collections: Dict[Tuple[str, str, str], Collection] = {}
+        self.checked_at = time.monotonic()
+
+_connections: Dict[Tuple[str, str, str], _Connection] = {}
+_lock = threading.Lock()
+# Held by the thread connecting for each conf.
+_connect_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+_stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'health_checks': 0, 'health_check_failures': 0}
+
+def _conf_key(conf: ConnectionConf) -> Tuple[str, str, str]:
+    return (str(conf.url), conf.username, conf.password)
+
+def _connect(conf: ConnectionConf, timeout_s: int) -> _Connection:
+    cluster = Cluster(str(conf.url), ClusterOptions(get_authenticator(conf)))
+    cluster.wait_until_ready(timedelta(seconds=timeout_s))
+    _stats['connects'] += 1
+    logger.info(f"Connected to Couchbase at {conf.url}")
+    return _Connection(cluster)
+
+def _is_healthy(connection: _Connection) -> bool:
+    _stats['health_checks'] += 1
+    try:
+        connection.cluster.ping()
+        return True
+    except CouchbaseException as e:
+        _stats['health_check_failures'] += 1
+        logger.warning(f"Couchbase health check failed: {e}")
+        return False
+
+def _close(connection: _Connection) -> None:
+    try:
+        connection.cluster.close()
+    except CouchbaseException as e:
+        logger.warning(f"Failed to close Couchbase cluster: {e}")
+
+def _get_connection(conf: ConnectionConf, timeout_s: int = 5) -> _Connection:
+    # _lock only guards the pool itself. Health checks and connects run outside
+    # it, so operations on a live connection never wait for them.
+    key = _conf_key(conf)
+    with _lock:
+        connection = _connections.get(key)
+        if connection is not None:
+            now = time.monotonic()
+            if now - connection.checked_at < _HEALTH_CHECK_INTERVAL_S:
+                _stats['reuses'] += 1
+                return connection
+            # Other threads keep using the connection while this one checks it.
+            connection.checked_at = now
+    if connection is not None:
+        if _is_healthy(connection):
+            _stats['reuses'] += 1
+            return connection
+        _invalidate(conf, connection)
+    # One thread connects per conf; the others wait for it and reuse its connection.
+    with _lock:
+        connect_lock = _connect_locks.setdefault(key, threading.Lock())
+    with connect_lock:
+        with _lock:
+            if (connection := _connections.get(key)) is not None:
+                _stats['reuses'] += 1
+                return connection
+        connection = _connect(conf, timeout_s)
+        with _lock:
+            _connections[key] = connection
+        return connection
+
+def _invalidate(conf: ConnectionConf, connection: _Connection | None = None) -> None:
+    "Drops the pooled connection, or only `connection` if another has replaced it since."
+    key = _conf_key(conf)
+    with _lock:
+        if (pooled := _connections.get(key)) is None or (connection is not None and pooled is not connection):
+            return
+        del _connections[key]
+        _stats['reconnects'] += 1
+    _close(pooled)
+
+def _with_reconnect(conf: ConnectionConf, op: Callable[[_Connection], Any]) -> Any:
+    try:
+        return op(_get_connection(conf))
+    except _RECONNECT_ERRORS as e:
+        logger.warning(f"Couchbase connection error, reconnecting: {e}")
+        _invalidate(conf)
+        return op(_get_connection(conf))
+
+def get_stats() -> Dict[str, int]:
+    """Returns connection pool counters (connects, reuses, reconnects, health checks)."""
+    return dict(_stats, open_connections=len(_connections))
+
+def close_all() -> None:
+    """Closes every pooled cluster. Called on application shutdown."""
+    with _lock:
+        connections = list(_connections.values())
+        _connections.clear()
+    for connection in connections:
+        _close(connection)
+    logger.info("Closed all Couchbase connections")
+
 @validate_arguments
 def get_cluster(conf: ConnectionConf, timeout_s=5) -> Cluster:
-    cluster = Cluster(str(conf.url), ClusterOptions(get_authenticator(conf)))
-    cluster.wait_until_ready(timedelta(seconds=5))
-    return cluster
+    """Returns the pooled cluster for the connection, connecting on first use."""
+    return _get_connection(conf, timeout_s).cluster
+
+def _get_collection(connection: _Connection, bucket: str, scope: str, collection: str) -> Collection:
+    key = (bucket, scope, collection)
+    if (handle := connection.collections.get(key)) is None:
+        handle = connection.cluster.bucket(bucket).scope(scope).collection(collection)
+        connection.collections[key] = handle
+    return handle
+
+_BINARY_TRANSCODER = RawBinaryTranscoder()
+
+#### Metrics ####
+
+_op_duration = metrics.histogram('couchbase_op_duration_seconds', "Latency of Couchbase operations.",
+                                 ('op', 'collection'))
+_op_rows = metrics.counter('couchbase_op_rows_total', "Rows returned by queries and documents touched by KV operations.",
+                           ('op', 'collection'))
+_op_errors = metrics.counter('couchbase_op_errors_total', "Couchbase operations (or bulk items) that failed.",
+                             ('op', 'collection'))
+
+_KEYSPACE = re.compile(r'\._default\.(\w+)')
+
+@lru_cache(maxsize=256)
+def _query_collection(query: str) -> str:
+    return match.group(1) if (match := _KEYSPACE.search(query)) else ''
+
+def _measured(op: str, collection: str, fn: Callable[[], Any], count: Callable[[Any], int] = lambda _: 1) -> Any:
+    started = time.perf_counter()
+    try:
+        result = fn()
+    except CouchbaseException:
+        _op_errors.inc(op, collection)
+        raise
+    finally:
+        _op_duration.observe(time.perf_counter() - started, op, collection)
+    _op_rows.inc(op, collection, amount=count(result))
+    return result
 
 #### Operations ####
 
 @validate_arguments
 def exec(conf: ConnectionConf, query: str, *args, **kwargs) -> Dict[str, Any]:
-    log_str = "Running command {} ({}, {}) against {}".format(
-        query, json.dumps(args), json.dumps(kwargs), conf.url
-    )
-    logger.debug(log_str)
+    logger.debug("Running command %s (%s, %s) against %s", query, args, kwargs, conf.url)
     try:
-        cluster = get_cluster(conf)
-
-        result = cluster.query(query, QueryOptions(*args, **kwargs)).rows()
-        result_list = list(result)
+        result_list = _measured('query', _query_collection(query), lambda: _with_reconnect(
+            conf, lambda c: list(c.cluster.query(query, QueryOptions(*args, **kwargs)).rows())
+        ), len)
 
-        logger.trace(f"{log_str} – got {result_list}")
+        logger.debug("Running command %s – got %s", query, result_list)
         return result_list
 
     except CouchbaseException as e:
@@ -74,24 +226,140 @@ def exec(conf: ConnectionConf, query: str, *args, **kwargs) -> Dict[str, Any]:
 
 @validate_arguments
 def insert(config: ConnectionConf, spec: DocSpec) -> Dict[str, Any]:
-    return (get_cluster(config)
-     .bucket(spec.bucket)
-     .scope(spec.scope)
-     .collection(spec.collection)
-     .insert(spec.key, spec.data))
+    return _measured('insert', spec.collection, lambda: _with_reconnect(
+        config,
+        lambda c: _get_collection(c, spec.bucket, spec.scope, spec.collection).insert(
+            spec.key, spec.data, InsertOptions(transcoder=_BINARY_TRANSCODER) if spec.binary else InsertOptions()
+        )
+    ))
 
 @validate_arguments
 def remove(config: ConnectionConf, ref: DocRef) -> Dict[str, Any]:
-    return (get_cluster(config)
-     .bucket(ref.bucket)
-     .scope(ref.scope)
-     .collection(ref.collection)
-     .remove(ref.key))
+    return _measured('remove', ref.collection, lambda: _with_reconnect(
+        config,
+        lambda c: _get_collection(c, ref.bucket, ref.scope, ref.collection).remove(ref.key)
+    ))
 
 @validate_arguments
 def get(config: ConnectionConf, ref: DocRef) -> Dict[str, Any]:
-    return (get_cluster(config)
-     .bucket(ref.bucket)
-     .scope(ref.scope)
-     .collection(ref.collection)
-     .get(ref.key))
+    return _measured('get', ref.collection, lambda: _with_reconnect(
+        config,
+        lambda c: _get_collection(c, ref.bucket, ref.scope, ref.collection).get(
+            ref.key, GetOptions(transcoder=_BINARY_TRANSCODER) if ref.binary else GetOptions()
+        )
+    ))
+
+# Attempts at a read-modify-write before giving up on concurrent writers.
+_UPDATE_ATTEMPTS = 10
+
+@validate_arguments
+def update(config: ConnectionConf, ref: DocRef, fn: Callable[[Any], Any], expiry_s: int | None = None) -> Any:
+    """Replaces the document's value with `fn(value)`, or inserts `fn(None)` if
+    it does not exist, and returns what was written.
+
+    A concurrent write in between is detected by CAS and `fn` reapplied to the
+    new value. Nothing is written if `fn` returns None. Raises
+    CasMismatchException if the document kept changing every attempt.
+    """
+    options = {'expiry': timedelta(seconds=expiry_s)} if expiry_s else {}
+
+    def op(connection: _Connection) -> Any:
+        collection = _get_collection(connection, ref.bucket, ref.scope, ref.collection)
+        for attempt in range(_UPDATE_ATTEMPTS):
+            try:
+                current = collection.get(ref.key)
+            except DocumentNotFoundException:
+                current = None
+            if (value := fn(current.value if current else None)) is None:
+                return None
+            try:
+                if current is None:
+                    collection.insert(ref.key, value, InsertOptions(**options))
+                else:
+                    collection.replace(ref.key, value, ReplaceOptions(cas=current.cas, **options))
+                return value
+            except (CasMismatchException, DocumentExistsException, DocumentNotFoundException):
+                if attempt == _UPDATE_ATTEMPTS - 1:
+                    raise CasMismatchException(f"{ref.collection}/{ref.key} changed on every attempt")
+
+    return _measured('update', ref.collection, lambda: _with_reconnect(config, op))
+
+#### Bulk operations ####
+
+def _multi(config: ConnectionConf,
+           op_name: str,
+           refs: List[DocRef] | List[DocSpec],
+           op: Callable[[Collection, List[Any], bool], Dict[str, Any]]) -> List[Any]:
+    """Runs a bulk operation once per collection and returns results in `refs` order.
+
+    A failed item gets its exception in place of a result, so one failure does
+    not abort the rest of the batch. Items that failed with a connection error
+    are retried once on a fresh connection.
+    """
+    results: List[Any] = [None] * len(refs)
+    pending = list(range(len(refs)))
+    if not pending:
+        return results
+    for attempt in range(2):
+        groups: Dict[Tuple[str, str, str, bool], List[int]] = {}
+        for i in pending:
+            ref = refs[i]
+            groups.setdefault((ref.bucket, ref.scope, ref.collection, ref.binary), []).append(i)
+        connection = _get_connection(config)
+        for (bucket, scope, collection, binary), indexes in groups.items():
+            by_key = _measured(op_name, collection, lambda: op(
+                _get_collection(connection, bucket, scope, collection), [refs[i] for i in indexes], binary
+            ), len)
+            if failed := sum(isinstance(r, Exception) for r in by_key.values()):
+                _op_errors.inc(op_name, collection, amount=failed)
+            for i in indexes:
+                results[i] = by_key[refs[i].key]
+        pending = [i for i in pending if isinstance(results[i], _RECONNECT_ERRORS)]
+        if not pending or attempt:
+            break
+        logger.warning(f"Couchbase connection error on {len(pending)} bulk items, reconnecting")
+        _invalidate(config)
+    return results
+
+def _by_key(result: Any) -> Dict[str, Any]:
+    return {**result.results, **result.exceptions}
+
+@validate_arguments
+def insert_multi(config: ConnectionConf, specs: List[DocSpec]) -> List[Any]:
+    """Inserts every document, returning a result or exception per spec."""
+    return _multi(config, 'insert_multi', specs, lambda collection, specs, binary: _by_key(collection.insert_multi(
+        {spec.key: spec.data for spec in specs},
+        InsertMultiOptions(transcoder=_BINARY_TRANSCODER, return_exceptions=True) if binary
+        else InsertMultiOptions(return_exceptions=True)
+    )))
+
+@validate_arguments
+def upsert_multi(config: ConnectionConf, specs: List[DocSpec],
+                 durability: DurabilityLevel = DurabilityLevel.NONE) -> List[Any]:
+    """Inserts or replaces every document, returning a result or exception per spec.
+
+    With a durability level, a result means the write reached that level.
+    """
+    options = {'return_exceptions': True}
+    if durability != DurabilityLevel.NONE:
+        options['durability'] = ServerDurability(durability)
+    return _multi(config, 'upsert_multi', specs, lambda collection, specs, binary: _by_key(collection.upsert_multi(
+        {spec.key: spec.data for spec in specs},
+        UpsertMultiOptions(transcoder=_BINARY_TRANSCODER, **options) if binary else UpsertMultiOptions(**options)
+    )))
+
+@validate_arguments
+def remove_multi(config: ConnectionConf, refs: List[DocRef]) -> List[Any]:
+    """Removes every document, returning a result or exception per ref."""
+    return _multi(config, 'remove_multi', refs, lambda collection, refs, binary: _by_key(collection.remove_multi(
+        [ref.key for ref in refs], RemoveMultiOptions(return_exceptions=True)
+    )))
+
+@validate_arguments
+def get_multi(config: ConnectionConf, refs: List[DocRef]) -> List[Any]:
+    """Gets every document, returning a result or exception per ref."""
+    return _multi(config, 'get_multi', refs, lambda collection, refs, binary: _by_key(collection.get_multi(
+        [ref.key for ref in refs],
+        GetMultiOptions(transcoder=_BINARY_TRANSCODER, return_exceptions=True) if binary
+        else GetMultiOptions(return_exceptions=True)
+    )))
@@ -0,0 +1,137 @@
+from bisect import bisect_right, insort
+import re
+import threading
+import time
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List
+import logging
+
+from couchbase.exceptions import DocumentExistsException, DocumentNotFoundException
+
+from . import couchbase as cb
+
+logger = logging.getLogger(__name__)
+
+# In-memory stand-in for the functions of couchbase.py, for benchmarks. It
+# answers the N1QL statements db.py issues (id-ordered listing, USE KEYS and
+# the signature lookup by document id) and sleeps to simulate the network:
+# operations run on the async_couchbase executor, so a sleep ties up a worker
+# thread the way a real round trip does.
+
+_KEYSPACE = re.compile(r'FROM \w+\._default\.(\w+)')
+_SELECT = re.compile(r'^SELECT (.*?) FROM ')
+_LIMIT = re.compile(r'LIMIT (\d+)')
+_WHERE_EQUALS = re.compile(r'WHERE (\w+) = \$1')
+
+class CouchbaseStandin:
+    def __init__(self, kv_latency_s: float = 0.0, query_latency_s: float = 0.0):
+        self.kv_latency_s = kv_latency_s
+        self.query_latency_s = query_latency_s
+        self.ops: Dict[str, int] = {}
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def install(self, module: ModuleType = cb) -> None:
+        """Replaces the operations of couchbase.py with this stand-in's."""
+        for name in ('exec', 'insert', 'remove', 'get', 'insert_multi', 'remove_multi', 'get_multi',
+                     'get_cluster', 'close_all'):
+            setattr(module, name, getattr(self, name))
+
+    def seed(self, collection: str, docs: Dict[str, Any]) -> None:
+        """Replaces the contents of `collection` with `docs` (key -> value)."""
+        with self._lock:
+            self._docs[collection] = dict(docs)
+            self._keys[collection] = sorted(docs)
+
+    def _count(self, op: str, latency_s: float) -> None:
+        self.ops[op] = self.ops.get(op, 0) + 1
+        if latency_s:
+            time.sleep(latency_s)
+
+    #### Key-value ####
+
+    def _insert(self, spec: cb.DocSpec) -> SimpleNamespace:
+        with self._lock:
+            docs = self._docs.setdefault(spec.collection, {})
+            if spec.key in docs:
+                raise DocumentExistsException(f"{spec.collection}/{spec.key} exists")
+            docs[spec.key] = spec.data
+            insort(self._keys.setdefault(spec.collection, []), spec.key)
+        return SimpleNamespace(key=spec.key)
+
+    def _get(self, ref: cb.DocRef) -> SimpleNamespace:
+        with self._lock:
+            if (value := self._docs.get(ref.collection, {}).get(ref.key)) is None:
+                raise DocumentNotFoundException(f"{ref.collection}/{ref.key} not found")
+        return SimpleNamespace(key=ref.key, value=value)
+
+    def _remove(self, ref: cb.DocRef) -> SimpleNamespace:
+        with self._lock:
+            if self._docs.get(ref.collection, {}).pop(ref.key, None) is None:
+                raise DocumentNotFoundException(f"{ref.collection}/{ref.key} not found")
+            self._keys[ref.collection].remove(ref.key)
+        return SimpleNamespace(key=ref.key)
+
+    def insert(self, config: cb.ConnectionConf, spec: cb.DocSpec) -> Any:
+        self._count('insert', self.kv_latency_s)
+        return self._insert(spec)
+
+    def get(self, config: cb.ConnectionConf, ref: cb.DocRef) -> Any:
+        self._count('get', self.kv_latency_s)
+        return self._get(ref)
+
+    def remove(self, config: cb.ConnectionConf, ref: cb.DocRef) -> Any:
+        self._count('remove', self.kv_latency_s)
+        return self._remove(ref)
+
+    def _multi(self, op: str, fn, items: List[Any]) -> List[Any]:
+        self._count(op, self.kv_latency_s)
+        results = []
+        for item in items:
+            try:
+                results.append(fn(item))
+            except (DocumentExistsException, DocumentNotFoundException) as e:
+                results.append(e)
+        return results
+
+    def insert_multi(self, config: cb.ConnectionConf, specs: List[cb.DocSpec]) -> List[Any]:
+        return self._multi('insert_multi', self._insert, specs)
+
+    def get_multi(self, config: cb.ConnectionConf, refs: List[cb.DocRef]) -> List[Any]:
+        return self._multi('get_multi', self._get, refs)
+
+    def remove_multi(self, config: cb.ConnectionConf, refs: List[cb.DocRef]) -> List[Any]:
+        return self._multi('remove_multi', self._remove, refs)
+
+    #### Queries ####
+
+    def exec(self, conf: cb.ConnectionConf, query: str, *args, positional_parameters: List[Any] = [], **kwargs) -> List[Dict[str, Any]]:
+        self._count('query', self.query_latency_s)
+        collection = _KEYSPACE.search(query).group(1)
+        columns = [c.strip() for c in _SELECT.match(query).group(1).split(',')]
+        with self._lock:
+            docs = self._docs.get(collection, {})
+            keys = self._keys.get(collection, [])
+            if 'USE KEYS $1' in query:
+                keys = [k for k in positional_parameters[0] if k in docs]
+            elif 'META().id > $1' in query:
+                start = bisect_right(keys, positional_parameters[0])
+                limit = _LIMIT.search(query)
+                keys = keys[start:start + int(limit.group(1))] if limit else keys[start:]
+            elif where := _WHERE_EQUALS.search(query):
+                attribute = where.group(1)
+                keys = [k for k in keys if docs[k].get(attribute) == positional_parameters[0]]
+            else:
+                raise NotImplementedError(f"Unsupported query: {query}")
+            return [{('id' if c == 'META().id' else c): (k if c == 'META().id' else docs[k][c])
+                     for c in columns if c == 'META().id' or c in docs[k]}
+                    for k in keys]
+
+    #### Connections ####
+
+    def get_cluster(self, conf: cb.ConnectionConf, timeout_s: int = 5) -> None:
+        return None
+
+    def close_all(self) -> None:
+        pass
@@ -1,8 +1,15 @@
+import asyncio
+from collections import OrderedDict
+import codecs
 import datetime
 import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
 import uuid
 import strawberry
-from . import couchbase as cb, env
+from strawberry.types import Info
+from . import async_couchbase as acb, blobs, cache, couchbase as cb, env, write_behind
+
+T = TypeVar('T')
 
 @strawberry.type
 class Product:
@@ -13,21 +20,39 @@ class Product:
 class Document:
     id: str
     name: str
-    content: str
+    # Bodies live in the blob store; only documents written before it keep
+    # them inline.
+    inline_content: strawberry.Private[str | None]
     first_name: str
     last_name: str
     email: str
     checksum: str
 
+    @strawberry.field
+    async def content(self, info: Info) -> str:
+        if self.inline_content is not None:
+            return self.inline_content
+        return await info.context.blob_loader.load(self.checksum)
+
 @strawberry.type
 class Signature:
     id: str
-    document: Document
+    document_id: strawberry.Private[str]
     signed_by_email: str
-    signed_content: str
+    inline_signed_content: strawberry.Private[str | None]
     signed_checksum: str
     signed_ts: str
 
+    @strawberry.field
+    async def signed_content(self, info: Info) -> str:
+        if self.inline_signed_content is not None:
+            return self.inline_signed_content
+        return await info.context.blob_loader.load(self.signed_checksum)
+
+    @strawberry.field
+    async def document(self, info: Info) -> Document:
+        return await info.context.document_loader.load(self.document_id)
+
 @strawberry.type
 class Field:
     id: str
@@ -38,177 +63,591 @@ class Field:
 class Template:
     id: str
     name: str
-    fields: list[Field]
+    field_ids: strawberry.Private[list[str]]
     template: str
 
-def create_signature(document_id: str, signed_by_email: str, signed_content: str) -> Signature:
-    id = str(uuid.uuid1())
-    checksum = hashlib.sha256(signed_content.encode()).hexdigest()
-    ts = datetime.datetime.now().isoformat()
-    cb.insert(env.get_couchbase_conf(),
+    @strawberry.field
+    async def fields(self, info: Info) -> list[Field]:
+        return await info.context.field_loader.load_many(self.field_ids)
+
+def _document(id: str, doc: dict) -> Document:
+    return Document(id=id, name=doc['name'], inline_content=doc.get('content'), checksum=doc['checksum'], first_name=doc['first_name'], last_name=doc['last_name'], email=doc['email'])
+
+def _signature(id: str, doc: dict) -> Signature:
+    return Signature(id=id, document_id=doc['document_id'], signed_by_email=doc['signed_by_email'], inline_signed_content=doc.get('signed_content'), signed_checksum=doc['signed_checksum'], signed_ts=doc['signed_ts'])
+
+#### Listing ####
+
+# Maps each GraphQL field of a type to the stored attributes it is built from,
+# so list queries only project the attributes the client actually selected.
+# Bodies are resolved from the blob store by checksum, falling back to the
+# inline attribute for older documents.
+
+_PRODUCT_COLUMNS = {'name': ('name',)}
+_DOCUMENT_COLUMNS = {'name': ('name',), 'content': ('content', 'checksum'), 'checksum': ('checksum',),
+                     'first_name': ('first_name',), 'last_name': ('last_name',), 'email': ('email',)}
+_SIGNATURE_COLUMNS = {'document': ('document_id',), 'signed_by_email': ('signed_by_email',),
+                      'signed_content': ('signed_content', 'signed_checksum'),
+                      'signed_checksum': ('signed_checksum',), 'signed_ts': ('signed_ts',)}
+_FIELD_COLUMNS = {'name': ('name',), 'type': ('type',)}
+_TEMPLATE_COLUMNS = {'name': ('name',), 'fields': ('field_ids',), 'template': ('template',)}
+
+COLLECTION_COLUMNS = {'products': _PRODUCT_COLUMNS,
+                      'documents': _DOCUMENT_COLUMNS,
+                      'signatures': _SIGNATURE_COLUMNS,
+                      'fields': _FIELD_COLUMNS,
+                      'templates': _TEMPLATE_COLUMNS}
+
+def _keyspace(collection: str) -> str:
+    return f"{env.get_couchbase_bucket()}._default.{collection}"
+
+def _columns(columns: dict[str, tuple[str, ...]], fields: set[str] | None = None) -> list[str]:
+    "Returns the stored attributes backing `fields` (all fields if None)."
+    return list(dict.fromkeys(c for f, cs in columns.items() if fields is None or f in fields for c in cs))
+
+def _list_query(collection: str, columns: dict[str, tuple[str, ...]], fields: set[str] | None, limit: int | None) -> str:
+    # The META().id predicate is always present so the query can use the
+    # collection's id index instead of a primary scan; see schema.py.
+    selected = _columns(columns, fields)
+    query = f"SELECT {', '.join([*selected, 'META().id'])} FROM {_keyspace(collection)} WHERE META().id > $1 ORDER BY META().id"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    return query
+
+async def _list(collection: str,
+                columns: dict[str, tuple[str, ...]],
+                fields: set[str] | None = None,
+                limit: int | None = None,
+                after: str | None = None) -> list[dict]:
+    """Lists a collection in META().id order, starting after the `after` key.
+
+    Only the columns backing `fields` are fetched; the others are None.
+    """
+    result = await acb.exec(env.get_couchbase_conf(),
+                            _list_query(collection, columns, fields, limit),
+                            positional_parameters=[after or ''])
+    return [{**dict.fromkeys(_columns(columns)), **r} for r in result]
+
+#### Caching ####
+
+# Fields and templates are read through cache.py. Only complete objects go
+# into the item caches; list pages are cached whole under their query, as they
+# may hold partially fetched objects. Products are not cached: most of them
+# are written by ingest-api's consumer, which no worker hears about once the
+# write is stored.
+
+async def _read_through(collection: str, id: str, fetch: Callable[[str], Awaitable[T | None]]) -> T | None:
+    hit, value = cache.items(collection).get(id)
+    if not hit and (value := await fetch(id)) is not None:
+        cache.items(collection).put(id, value)
+    return value
+
+async def _read_through_many(collection: str, ids: list[str],
+                             fetch: Callable[[list[str]], Awaitable[list[T | None]]]) -> list[T | None]:
+    item_cache = cache.items(collection)
+    found = {}
+    for id in ids:
+        hit, value = item_cache.get(id)
+        if hit:
+            found[id] = value
+    if missing := [id for id in dict.fromkeys(ids) if id not in found]:
+        for id, value in zip(missing, await fetch(missing)):
+            if value is not None:
+                item_cache.put(id, value)
+                found[id] = value
+    return [found.get(id) for id in ids]
+
+async def _read_through_list(collection: str, list_fn: Callable[..., Awaitable[list[T]]],
+                             limit: int | None, after: str | None, fields: set[str] | None) -> list[T]:
+    key = (limit, after, frozenset(fields) if fields is not None else None)
+    hit, value = cache.lists(collection).get(key)
+    if not hit:
+        value = await list_fn(limit=limit, after=after, fields=fields)
+        cache.lists(collection).put(key, value)
+    return value
+
+#### Write-behind ####
+
+# Mutations of the collections write_behind.py handles are produced as events
+# instead of written to Couchbase, and the written objects overlaid on reads
+# until the consumer has stored them. Bodies travel inline in the event,
+# except streamed ones and those over blobs.MAX_EVENT_BODY_SIZE, which are
+# still put in the blob store first.
+
+_FROM_EVENT: dict[str, Callable[[str, dict], Any]] = {
+    'products': lambda id, e: Product(id=id, name=e['name']),
+    'documents': _document,
+    'signatures': _signature,
+    'fields': lambda id, e: Field(id=id, name=e['name'], type=e['type']),
+    'templates': lambda id, e: Template(id=id, name=e['name'], field_ids=e.get('field_ids', []), template=e['template']),
+}
+
+def from_event(collection: str, event: dict) -> tuple[str, Any]:
+    """Returns the id of a write-behind event and the object it writes, None for a removal.
+
+    Raises KeyError if the event is malformed.
+    """
+    id = str(event['id'])
+    return id, None if event.get('deleted') else _FROM_EVENT[collection](id, event)
+
+async def _write_behind(collection: str, events: list[dict]) -> list[Exception | None]:
+    results = await write_behind.produce(collection, events)
+    overlay = write_behind.overlay(collection)
+    for event, result in zip(events, results):
+        if result is None:
+            overlay.put(*from_event(collection, event))
+    return results
+
+async def _insert(collection: str, id: str, data: dict, body: dict | None = None) -> None:
+    """Stores `data` under `id`, in Couchbase or as a write-behind event.
+
+    `body` holds attributes only the event carries: a body for the consumer
+    to put in the blob store.
+    """
+    if write_behind.enabled(collection):
+        if error := (await _write_behind(collection, [{'id': id, **data, **(body or {})}]))[0]:
+            raise error
+        return
+    await acb.insert(env.get_couchbase_conf(),
               cb.DocSpec(bucket=env.get_couchbase_bucket(),
-                         collection='signatures',
+                         collection=collection,
                          key=id,
-                         data={'document_id': document_id, 'signed_by_email': signed_by_email, 'signed_content': signed_content, 'signed_checksum': checksum, 'signed_ts': ts}))
-    return Signature(id=id, document=get_document(document_id), signed_by_email=signed_by_email, signed_content=signed_content, signed_checksum=checksum, signed_ts=ts)
+                         data=data))
 
-def create_product(name: str) -> Product:
+async def _remove(collection: str, id: str) -> None:
+    if write_behind.enabled(collection):
+        if error := (await _write_behind(collection, [{'id': id, 'deleted': True}]))[0]:
+            raise error
+        return
+    await acb.remove(env.get_couchbase_conf(),
+              cb.DocRef(bucket=env.get_couchbase_bucket(),
+                        collection=collection,
+                        key=id))
+
+async def _put_body(collection: str, attribute: str, content: str) -> tuple[str, dict | None]:
+    """Returns the checksum of a body and, if `collection` is written behind
+    and the body small enough, the event attributes carrying it. Otherwise the
+    body is stored now."""
+    data = content.encode()
+    if write_behind.enabled(collection) and len(data) <= blobs.MAX_EVENT_BODY_SIZE:
+        checksum = hashlib.sha256(data).hexdigest() if len(data) <= blobs.MAX_LOOP_WORK_SIZE \
+            else await asyncio.to_thread(_sha256, content)
+        return checksum, {attribute: content}
+    return await blobs.put(data), None
+
+def _overlaid(collection: str, id: str) -> tuple[bool, Any]:
+    "Returns (found, value) from the overlay of `collection`."
+    if (overlay := write_behind.overlay(collection)) is None:
+        return False, None
+    return overlay.get(id)
+
+async def _overlay_one(collection: str, id: str, fetch: Callable[[str], Awaitable[T | None]]) -> T | None:
+    hit, value = _overlaid(collection, id)
+    return value if hit else await fetch(id)
+
+async def _overlay_many(collection: str, ids: list[str],
+                        fetch: Callable[[list[str]], Awaitable[list[T | None]]]) -> list[T | None]:
+    if not (overlay := write_behind.overlay(collection)):
+        return await fetch(ids)
+    found = {}
+    for id in ids:
+        hit, value = overlay.get(id)
+        if hit:
+            found[id] = value
+    if missing := [id for id in dict.fromkeys(ids) if id not in found]:
+        found.update(zip(missing, await fetch(missing)))
+    return [found[id] for id in ids]
+
+def _overlay_page(collection: str, items: list[T], limit: int | None, after: str | None) -> list[T]:
+    "Merges the overlaid writes that fall within a page of `limit` items after `after`."
+    if (overlay := write_behind.overlay(collection)) is None or not (entries := dict(overlay.items())):
+        return items
+    # A full page ends at its last item; later ids belong to the next pages.
+    last = items[-1].id if limit is not None and items and len(items) >= limit else None
+    merged = {item.id: item for item in items if item.id not in entries}
+    merged.update((id, value) for id, value in entries.items()
+                  if value is not None and id > (after or '') and (last is None or id <= last))
+    return [merged[id] for id in sorted(merged)][:limit]
+
+#### Mutations ####
+
+async def _put_stream(chunks: AsyncIterator[bytes]) -> str:
+    """Stores a streamed body in the blob store and returns its checksum.
+
+    Raises UnicodeDecodeError, leaving nothing behind, if the body is not UTF-8.
+    """
+    writer = blobs.BlobWriter()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        async for chunk in chunks:
+            decoder.decode(chunk)
+            await writer.write(chunk)
+        decoder.decode(b'', final=True)
+    except Exception:
+        await writer.abort()
+        raise
+    return await writer.close()
+
+async def _insert_signature(document_id: str, signed_by_email: str, checksum: str, signed_content: str | None,
+                            body: dict | None = None) -> Signature:
     id = str(uuid.uuid1())
-    cb.insert(env.get_couchbase_conf(),
-              cb.DocSpec(bucket=env.get_couchbase_bucket(),
-                         collection='products',
-                         key=id,
-                         data={'name': name}))
+    ts = datetime.datetime.now().isoformat()
+    await _insert('signatures', id,
+                  {'document_id': document_id, 'signed_by_email': signed_by_email, 'signed_checksum': checksum, 'signed_ts': ts},
+                  body)
+    return Signature(id=id, document_id=document_id, signed_by_email=signed_by_email, inline_signed_content=signed_content, signed_checksum=checksum, signed_ts=ts)
+
+async def create_signature(document_id: str, signed_by_email: str, signed_content: str) -> Signature:
+    checksum, body = await _put_body('signatures', 'signed_content', signed_content)
+    return await _insert_signature(document_id, signed_by_email, checksum, signed_content, body)
+
+async def create_signature_from_stream(document_id: str, signed_by_email: str, chunks: AsyncIterator[bytes]) -> Signature:
+    checksum = await _put_stream(chunks)
+    return await _insert_signature(document_id, signed_by_email, checksum, None)
+
+async def create_product(name: str) -> Product:
+    id = str(uuid.uuid1())
+    await _insert('products', id, {'name': name})
     return Product(id=id, name=name)
 
-def create_document(name: str, first_name: str, last_name: str, email: str, content: str) -> Document:
+async def _insert_document(name: str, first_name: str, last_name: str, email: str, checksum: str, content: str | None,
+                           body: dict | None = None) -> Document:
     id = str(uuid.uuid1())
-    checksum = hashlib.sha256(content.encode()).hexdigest()
-    cb.insert(env.get_couchbase_conf(),
-              cb.DocSpec(bucket=env.get_couchbase_bucket(),
-                         collection='documents',
-                         key=id,
-                         data={'name': name, 'content': content, 'checksum': checksum, 'first_name': first_name, 'last_name': last_name, 'email': email}))
-    return Document(id=id, name=name, content=content, checksum=checksum, first_name=first_name, last_name=last_name, email=email)
+    await _insert('documents', id,
+                  {'name': name, 'checksum': checksum, 'first_name': first_name, 'last_name': last_name, 'email': email},
+                  body)
+    return Document(id=id, name=name, inline_content=content, checksum=checksum, first_name=first_name, last_name=last_name, email=email)
+
+async def create_document(name: str, first_name: str, last_name: str, email: str, content: str) -> Document:
+    checksum, body = await _put_body('documents', 'content', content)
+    return await _insert_document(name, first_name, last_name, email, checksum, content, body)
 
-def create_field(name: str, type: str) -> Field:
+async def create_document_from_stream(name: str, first_name: str, last_name: str, email: str, chunks: AsyncIterator[bytes]) -> Document:
+    checksum = await _put_stream(chunks)
+    return await _insert_document(name, first_name, last_name, email, checksum, None)
+
+async def create_field(name: str, type: str) -> Field:
     id = str(uuid.uuid1())
-    cb.insert(env.get_couchbase_conf(),
-              cb.DocSpec(bucket=env.get_couchbase_bucket(),
-                         collection='fields',
-                         key=id,
-                         data={'name': name, 'type': type}))
+    await _insert('fields', id, {'name': name, 'type': type})
+    cache.invalidate('fields')
     return Field(id=id, name=name, type=type)
 
-def create_template(name: str, template: str, field_ids: list[str]) -> Template:
+async def create_template(name: str, template: str, field_ids: list[str]) -> Template:
     id = str(uuid.uuid1())
-    cb.insert(env.get_couchbase_conf(),
-              cb.DocSpec(bucket=env.get_couchbase_bucket(),
-                         collection='templates',
-                         key=id,
-                         data={'name': name, 'field_ids': field_ids, 'template': template}))
-    return Template(id=id, name=name, template=template, fields=[get_field(id) for id in field_ids])
+    await _insert('templates', id, {'name': name, 'field_ids': field_ids, 'template': template})
+    cache.invalidate('templates')
+    return Template(id=id, name=name, template=template, field_ids=field_ids)
 
-def list_documents() -> list[Document]:
-    result = cb.exec(
-        env.get_couchbase_conf(),
-        f"SELECT name, content, checksum, first_name, last_name, email, META().id FROM {env.get_couchbase_bucket()}._default.documents"
-    )
-    return [Document(id=r['id'], name=r['name'], content=r['content'], checksum=r['checksum'], first_name=r['first_name'], last_name=r['last_name'], email=r['email']) for r in result]
+async def list_documents(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Document]:
+    result = await _list('documents', _DOCUMENT_COLUMNS, fields, limit, after)
+    return _overlay_page('documents', [_document(r['id'], r) for r in result], limit, after)
 
-def list_signatures() -> list[Signature]:
-    result = cb.exec(
-        env.get_couchbase_conf(),
-        f"SELECT document_id, signed_by_email, signed_content, signed_checksum, signed_ts, META().id FROM {env.get_couchbase_bucket()}._default.signatures"
-    )
-    return [Signature(id=r['id'], document=get_document(r['document_id']), signed_by_email=r['signed_by_email'], signed_content=r['signed_content'], signed_checksum=r['signed_checksum'], signed_ts=r['signed_ts']) for r in result]
+async def list_signatures(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Signature]:
+    result = await _list('signatures', _SIGNATURE_COLUMNS, fields, limit, after)
+    return _overlay_page('signatures', [_signature(r['id'], r) for r in result], limit, after)
 
-def get_signature(id: str) -> Signature | None:
-    if doc := cb.get(env.get_couchbase_conf(),
+async def get_signature(id: str) -> Signature | None:
+    return await _overlay_one('signatures', id, _get_signature)
+
+async def _get_signature(id: str) -> Signature | None:
+    if doc := await acb.get(env.get_couchbase_conf(),
                      cb.DocRef(bucket=env.get_couchbase_bucket(),
                                collection='signatures',
                                key=id)):
         doc = doc.value
-        return Signature(id=id, document=get_document(doc['document_id']), signed_by_email=doc['signed_by_email'], signed_content=doc['signed_content'], signed_checksum=doc['signed_checksum'], signed_ts=doc['signed_ts'])
+        return _signature(id, doc)
+
+def _signature_by_document_id_query() -> str:
+    return f"SELECT META().id FROM {_keyspace('signatures')} WHERE document_id = $1"
 
-def get_signature_by_document_id(document_id: str) -> Signature | None:
-    result = cb.exec(
+async def get_signature_by_document_id(document_id: str) -> Signature | None:
+    if (overlay := write_behind.overlay('signatures')) and (signature := overlay.find(document_id)):
+        return signature
+    result = await acb.exec(
         env.get_couchbase_conf(),
-        f"SELECT META().id FROM {env.get_couchbase_bucket()}._default.signatures WHERE document_id = $1",
-        document_id
+        _signature_by_document_id_query(),
+        positional_parameters=[document_id]
     )
     if result:
-        return get_signature(result[0]['id'])
+        return await get_signature(result[0]['id'])
     return None
 
-def verify_signature(id: str) -> Signature | None:
-    if signature_doc := cb.get(env.get_couchbase_conf(),
-                               cb.DocRef(bucket=env.get_couchbase_bucket(),
-                                         collection='signatures',
-                                         key=id)):
-        signature_doc = signature_doc.value
-        document = get_document(signature_doc['document_id'])
-        if document and signature_doc['signed_checksum'] == hashlib.sha256(document.content.encode()).hexdigest():
-            return Signature(id=id, document=document, signed_by_email=signature_doc['signed_by_email'], signed_content=signature_doc['signed_content'], signed_checksum=signature_doc['signed_checksum'], signed_ts=signature_doc['signed_ts'])
-    return None
+#### Verification ####
+
+# Checksum of each document's actual content, keyed by document id and tagged
+# with the stored checksum it was computed for, so a changed document misses.
+_CONTENT_CHECKSUM_CACHE_SIZE = 10000
+_content_checksums: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
+def _sha256(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+async def _content_checksum(document: Document) -> str | None:
+    if (cached := _content_checksums.get(document.id)) and cached[0] == document.checksum:
+        _content_checksums.move_to_end(document.id)
+        return cached[1]
+    content = document.inline_content
+    if content is None:
+        content = await blobs.get(document.checksum)
+    if content is None:
+        return None
+    checksum = await asyncio.to_thread(_sha256, content)
+    _content_checksums[document.id] = (document.checksum, checksum)
+    _content_checksums.move_to_end(document.id)
+    while len(_content_checksums) > _CONTENT_CHECKSUM_CACHE_SIZE:
+        _content_checksums.popitem(last=False)
+    return checksum
+
+async def verify_signatures(ids: list[str]) -> list[Signature | None]:
+    """Returns each signature if it matches its document's content, else None.
+
+    Each distinct document is hashed at most once, and not at all if its
+    content checksum is already cached.
+    """
+    signatures = await load_signatures(ids)
+    document_ids = list({s.document_id for s in signatures if s})
+    documents = await load_documents(document_ids)
+    checksums = await asyncio.gather(*(_content_checksum(d) for d in documents if d))
+    checksum_by_document_id = dict(zip((d.id for d in documents if d), checksums))
+    return [s if s and checksum_by_document_id.get(s.document_id) == s.signed_checksum else None
+            for s in signatures]
 
-def get_document(id: str) -> Document | None:
-    if doc := cb.get(env.get_couchbase_conf(),
+async def verify_signature(id: str) -> Signature | None:
+    return (await verify_signatures([id]))[0]
+
+async def get_document(id: str) -> Document | None:
+    return await _overlay_one('documents', id, _get_document)
+
+async def _get_document(id: str) -> Document | None:
+    if doc := await acb.get(env.get_couchbase_conf(),
                      cb.DocRef(bucket=env.get_couchbase_bucket(),
                                collection='documents',
                                key=id)):
         doc = doc.value
-        return Document(id=id, name=doc['name'], content=doc['content'], checksum=doc['checksum'], first_name=doc['first_name'], last_name=doc['last_name'], email=doc['email'])
+        return _document(id, doc)
 
-def delete_document(id: str) -> None:
-    cb.remove(env.get_couchbase_conf(),
-              cb.DocRef(bucket=env.get_couchbase_bucket(),
-                        collection='documents',
-                        key=id))
+async def delete_document(id: str) -> None:
+    _content_checksums.pop(id, None)
+    await _remove('documents', id)
     
-def get_field(id: str) -> Field | None:
-    if doc := cb.get(env.get_couchbase_conf(),
+async def get_field(id: str) -> Field | None:
+    return await _overlay_one('fields', id, lambda id: _read_through('fields', id, _get_field))
+
+async def _get_field(id: str) -> Field | None:
+    if doc := await acb.get(env.get_couchbase_conf(),
                      cb.DocRef(bucket=env.get_couchbase_bucket(),
                                collection='fields',
                                key=id)):
         doc = doc.value
         return Field(id=id, name=doc['name'], type=doc['type'])
 
-def delete_field(id: str) -> None:
-    cb.remove(env.get_couchbase_conf(),
-              cb.DocRef(bucket=env.get_couchbase_bucket(),
-                        collection='fields',
-                        key=id))
+async def delete_field(id: str) -> None:
+    await _remove('fields', id)
+    cache.invalidate('fields', [id])
     
-def list_fields() -> list[Field]:
-    result = cb.exec(
-        env.get_couchbase_conf(),
-        f"SELECT name, type, META().id FROM {env.get_couchbase_bucket()}._default.fields"
-    )
+async def list_fields(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Field]:
+    return _overlay_page('fields', await _read_through_list('fields', _list_fields, limit, after, fields), limit, after)
+
+async def _list_fields(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Field]:
+    result = await _list('fields', _FIELD_COLUMNS, fields, limit, after)
     return [Field(**r) for r in result]
 
-def get_template(id: str) -> Template | None:
-    if doc := cb.get(env.get_couchbase_conf(),
+async def get_template(id: str) -> Template | None:
+    return await _overlay_one('templates', id, lambda id: _read_through('templates', id, _get_template))
+
+async def _get_template(id: str) -> Template | None:
+    if doc := await acb.get(env.get_couchbase_conf(),
                      cb.DocRef(bucket=env.get_couchbase_bucket(),
                                collection='templates',
                                key=id)):
         doc = doc.value
-        return Template(id=id, name=doc['name'], fields=doc['fields'])
+        return Template(id=id, name=doc['name'], field_ids=doc.get('field_ids', []), template=doc['template'])
 
-def delete_template(id: str) -> None:
-    cb.remove(env.get_couchbase_conf(),
-              cb.DocRef(bucket=env.get_couchbase_bucket(),
-                        collection='templates',
-                        key=id))
+async def delete_template(id: str) -> None:
+    await _remove('templates', id)
+    cache.invalidate('templates', [id])
 
-def list_templates() -> list[Template]:
-    result = cb.exec(
-        env.get_couchbase_conf(),
-        f"SELECT name, field_ids, template, META().id as id FROM {env.get_couchbase_bucket()}._default.templates"
-    )
-    templates = []
-    for r in result:
-        field_ids = r.get('field_ids', [])
-        fields = [get_field(field_id) for field_id in field_ids]  # Ensure this returns a list of Field objects
-        templates.append(Template(id=r['id'], name=r['name'], fields=fields, template=r['template']))
-    return templates
-
-def get_product(id: str) -> Product | None:
-    if doc := cb.get(env.get_couchbase_conf(),
+async def list_templates(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Template]:
+    return _overlay_page('templates', await _read_through_list('templates', _list_templates, limit, after, fields), limit, after)
+
+async def _list_templates(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Template]:
+    result = await _list('templates', _TEMPLATE_COLUMNS, fields, limit, after)
+    return [Template(id=r['id'], name=r['name'], field_ids=r['field_ids'] or [], template=r['template']) for r in result]
+
+async def get_product(id: str) -> Product | None:
+    return await _overlay_one('products', id, _get_product)
+
+async def _get_product(id: str) -> Product | None:
+    if doc := await acb.get(env.get_couchbase_conf(),
                      cb.DocRef(bucket=env.get_couchbase_bucket(),
                                collection='products',
                                key=id)):
+        doc = doc.value
         return Product(id=id, name=doc['name'])
 
-def delete_product(id: str) -> None:
-    cb.remove(env.get_couchbase_conf(),
-              cb.DocRef(bucket=env.get_couchbase_bucket(),
-                        collection='products',
-                        key=id))
+async def delete_product(id: str) -> None:
+    await _remove('products', id)
+
+async def list_products(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Product]:
+    return _overlay_page('products', await _list_products(limit, after, fields), limit, after)
 
-def list_products() -> list[Product]:
-    result = cb.exec(
+async def _list_products(limit: int | None = None, after: str | None = None, fields: set[str] | None = None) -> list[Product]:
+    result = await _list('products', _PRODUCT_COLUMNS, fields, limit, after)
+    return [Product(**r) for r in result]
+
+#### Bulk mutations ####
+
+# List-taking counterparts of the create/delete functions above. Each one
+# writes the whole batch with a single bulk KV operation and returns one
+# entry per input, in order: the created object, or the exception that item
+# failed with. A failed item never aborts the rest of the batch.
+
+async def _insert_many(collection: str, docs: list[dict | Exception],
+                       bodies: list[dict | None] | None = None) -> list[str | Exception]:
+    """Inserts each doc under a fresh id and returns the ids.
+
+    Exceptions in `docs` (items that already failed) are passed through.
+    `bodies` are the event-only attributes of each doc, as for _insert.
+    """
+    ids = [str(uuid.uuid1()) for _ in docs]
+    if write_behind.enabled(collection):
+        results = iter(await _write_behind(collection, [
+            {'id': id, **doc, **(body or {})}
+            for id, doc, body in zip(ids, docs, bodies or [None] * len(docs)) if not isinstance(doc, Exception)
+        ]))
+    else:
+        specs = [cb.DocSpec(bucket=env.get_couchbase_bucket(), collection=collection, key=id, data=doc)
+                 for id, doc in zip(ids, docs) if not isinstance(doc, Exception)]
+        results = iter(await acb.insert_multi(env.get_couchbase_conf(), specs))
+    return [doc if isinstance(doc, Exception) else _id_or_exception(id, next(results))
+            for id, doc in zip(ids, docs)]
+
+def _id_or_exception(id: str, result: Any) -> str | Exception:
+    return result if isinstance(result, Exception) else id
+
+async def _put_many(collection: str, attribute: str, contents: list[str]) -> list[tuple[str, dict | None] | Exception]:
+    return await asyncio.gather(*(_put_body(collection, attribute, content) for content in contents),
+                                return_exceptions=True)
+
+async def create_products(names: list[str]) -> list[Product | Exception]:
+    ids = await _insert_many('products', [{'name': name} for name in names])
+    return [id if isinstance(id, Exception) else Product(id=id, name=name)
+            for id, name in zip(ids, names)]
+
+async def create_documents(documents: list[dict[str, str]]) -> list[Document | Exception]:
+    "Takes dicts with the arguments of create_document."
+    bodies = await _put_many('documents', 'content', [d['content'] for d in documents])
+    ids = await _insert_many('documents', [
+        body if isinstance(body, Exception) else
+        {'name': d['name'], 'checksum': body[0], 'first_name': d['first_name'], 'last_name': d['last_name'], 'email': d['email']}
+        for d, body in zip(documents, bodies)
+    ], [None if isinstance(body, Exception) else body[1] for body in bodies])
+    return [id if isinstance(id, Exception) else
+            Document(id=id, name=d['name'], inline_content=d['content'], checksum=body[0],
+                     first_name=d['first_name'], last_name=d['last_name'], email=d['email'])
+            for id, d, body in zip(ids, documents, bodies)]
+
+async def create_signatures(signatures: list[dict[str, str]]) -> list[Signature | Exception]:
+    "Takes dicts with the arguments of create_signature."
+    bodies = await _put_many('signatures', 'signed_content', [s['signed_content'] for s in signatures])
+    ts = datetime.datetime.now().isoformat()
+    ids = await _insert_many('signatures', [
+        body if isinstance(body, Exception) else
+        {'document_id': s['document_id'], 'signed_by_email': s['signed_by_email'], 'signed_checksum': body[0], 'signed_ts': ts}
+        for s, body in zip(signatures, bodies)
+    ], [None if isinstance(body, Exception) else body[1] for body in bodies])
+    return [id if isinstance(id, Exception) else
+            Signature(id=id, document_id=s['document_id'], signed_by_email=s['signed_by_email'],
+                      inline_signed_content=s['signed_content'], signed_checksum=body[0], signed_ts=ts)
+            for id, s, body in zip(ids, signatures, bodies)]
+
+async def create_fields(fields: list[dict[str, str]]) -> list[Field | Exception]:
+    "Takes dicts with the arguments of create_field."
+    ids = await _insert_many('fields', [{'name': f['name'], 'type': f['type']} for f in fields])
+    cache.invalidate('fields')
+    return [id if isinstance(id, Exception) else Field(id=id, name=f['name'], type=f['type'])
+            for id, f in zip(ids, fields)]
+
+async def create_templates(templates: list[dict[str, Any]]) -> list[Template | Exception]:
+    "Takes dicts with the arguments of create_template."
+    ids = await _insert_many('templates', [
+        {'name': t['name'], 'field_ids': t['field_ids'], 'template': t['template']} for t in templates
+    ])
+    cache.invalidate('templates')
+    return [id if isinstance(id, Exception) else
+            Template(id=id, name=t['name'], template=t['template'], field_ids=t['field_ids'])
+            for id, t in zip(ids, templates)]
+
+async def delete_many(collection: str, ids: list[str]) -> list[Exception | None]:
+    """Removes the given ids from `collection`, returning None or the exception per id."""
+    if collection == 'documents':
+        for id in ids:
+            _content_checksums.pop(id, None)
+    if write_behind.enabled(collection):
+        results = await _write_behind(collection, [{'id': id, 'deleted': True} for id in ids])
+    else:
+        results = [r if isinstance(r, Exception) else None for r in await acb.remove_multi(
+            env.get_couchbase_conf(),
+            [cb.DocRef(bucket=env.get_couchbase_bucket(), collection=collection, key=id) for id in ids]
+        )]
+    # After the removes, so that no read overlapping them caches the old objects again.
+    if collection in cache.CACHED_COLLECTIONS:
+        cache.invalidate(collection, ids)
+    return results
+
+#### Batch loading ####
+
+# Batch functions for the per-request DataLoaders in graphql.Context. Each one
+# fetches all requested keys with a single USE KEYS query and returns results
+# in key order, with None for keys that do not exist.
+
+def _load_query(collection: str, columns: dict[str, tuple[str, ...]]) -> str:
+    return f"SELECT {', '.join(_columns(columns))}, META().id FROM {_keyspace(collection)} USE KEYS $1"
+
+async def _load(collection: str, columns: dict[str, tuple[str, ...]], ids: list[str]) -> dict[str, dict]:
+    result = await acb.exec(
         env.get_couchbase_conf(),
-        f"SELECT name, META().id FROM {env.get_couchbase_bucket()}._default.products"
+        _load_query(collection, columns),
+        positional_parameters=[ids]
     )
-    return [Product(**r) for r in result]
+    return {r['id']: r for r in result}
+
+async def load_documents(ids: list[str]) -> list[Document | None]:
+    return await _overlay_many('documents', ids, _load_documents)
+
+async def _load_documents(ids: list[str]) -> list[Document | None]:
+    rows = await _load('documents', _DOCUMENT_COLUMNS, ids)
+    return [_document(id, rows[id]) if id in rows else None for id in ids]
+
+async def load_signatures(ids: list[str]) -> list[Signature | None]:
+    return await _overlay_many('signatures', ids, _load_signatures)
+
+async def _load_signatures(ids: list[str]) -> list[Signature | None]:
+    rows = await _load('signatures', _SIGNATURE_COLUMNS, ids)
+    return [_signature(id, rows[id]) if id in rows else None for id in ids]
+
+async def load_fields(ids: list[str]) -> list[Field | None]:
+    return await _overlay_many('fields', ids, lambda ids: _read_through_many('fields', ids, _load_fields))
+
+async def _load_fields(ids: list[str]) -> list[Field | None]:
+    rows = await _load('fields', _FIELD_COLUMNS, ids)
+    return [Field(**rows[id]) if id in rows else None for id in ids]
+
+async def load_products(ids: list[str]) -> list[Product | None]:
+    return await _overlay_many('products', ids, _load_products)
+
+async def _load_products(ids: list[str]) -> list[Product | None]:
+    rows = await _load('products', _PRODUCT_COLUMNS, ids)
+    return [Product(**rows[id]) if id in rows else None for id in ids]
+
+#### Query plans ####
+
+def get_queries() -> list[str]:
+    "Returns every N1QL statement this module issues, for plan checks."
+    queries = []
+    for collection, columns in COLLECTION_COLUMNS.items():
+        queries.append(_list_query(collection, columns, None, 1))
+        queries.append(_list_query(collection, columns, {'name'}, 1))
+        queries.append(_load_query(collection, columns))
+    queries.append(_signature_by_document_id_query())
+    return queries
@@ -0,0 +1,129 @@
+import asyncio
+from enum import Enum
+import functools
+import threading
+import time
+from typing import Any, Dict
+import logging
+
+from confluent_kafka import KafkaError, KafkaException, Message, Producer
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+#### Types ####
+
+class Durability(str, Enum):
+    """How long produce() waits before the event counts as delivered."""
+    NONE = 'none'      # fire-and-forget, no broker ack (acks=0)
+    LEADER = 'leader'  # wait for the partition leader (acks=1)
+    ALL = 'all'        # wait for all in-sync replicas (acks=all)
+
+_ACKS = {Durability.NONE: '0', Durability.LEADER: '1', Durability.ALL: 'all'}
+
+class DeliveryError(Exception):
+    pass
+
+#### Metrics ####
+
+_produce_latency = metrics.histogram('kafka_produce_latency_seconds',
+                                     "Time from handing a message to the producer until its delivery report.",
+                                     ('topic', 'result'))
+
+#### Producer ####
+
+class AsyncProducer:
+    """Asyncio front end for a shared confluent-kafka producer.
+
+    Messages are batched by librdkafka (`linger.ms`/`batch.size`) and delivery
+    callbacks are served by a background poll thread, so produce() never
+    blocks the event loop on a broker round trip.
+    """
+
+    def __init__(self, broker: str, durability: Durability, linger_ms: int, batch_size: int,
+                 compression: str = 'none'):
+        self.durability = durability
+        self._producer = Producer({
+            'bootstrap.servers': broker,
+            'acks': _ACKS[durability],
+            'linger.ms': linger_ms,
+            'batch.size': batch_size,
+            # Batches stay compressed on the broker and all the way to consumers.
+            'compression.type': compression,
+            'enable.idempotence': durability == Durability.ALL,
+            'message.timeout.ms': 30000,
+        })
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._running = threading.Event()
+        self.stats = {'produced': 0, 'delivered': 0, 'failed': 0, 'queue_full': 0}
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._running.set()
+        self._thread = threading.Thread(target=self._poll, name='kafka-delivery', daemon=True)
+        self._thread.start()
+
+    async def connect(self, timeout_s: float = 10) -> None:
+        """Connects to the brokers ahead of the first produce().
+
+        Logs rather than raises on failure, as librdkafka keeps retrying.
+        """
+        try:
+            await asyncio.to_thread(self._producer.list_topics, timeout=timeout_s)
+        except KafkaException as e:
+            logger.warning(f"Kafka not reachable yet: {e}")
+
+    async def stop(self, timeout_s: float = 10) -> None:
+        """Flushes outstanding messages and stops the poll thread."""
+        self._running.clear()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+        if remaining := await asyncio.to_thread(self._producer.flush, timeout_s):
+            logger.warning(f"{remaining} Kafka messages were not delivered before shutdown")
+
+    def _poll(self) -> None:
+        while self._running.is_set():
+            self._producer.poll(0.1)
+
+    def _on_delivery(self, future: asyncio.Future | None, started: float,
+                     err: KafkaError | None, msg: Message) -> None:
+        _produce_latency.observe(time.perf_counter() - started, msg.topic(), 'error' if err is not None else 'ok')
+        if err is not None:
+            self.stats['failed'] += 1
+            if future is None:
+                logger.error(f"Failed to deliver message to {msg.topic()}: {err}")
+            elif not future.done():
+                future.set_exception(DeliveryError(str(err)))
+        else:
+            self.stats['delivered'] += 1
+            if future is not None and not future.done():
+                future.set_result(msg)
+
+    async def enqueue(self, topic: str, value: Any, key: str | None = None) -> asyncio.Future | None:
+        """Hands a message to the producer and returns a future for its ack.
+
+        Returns None when durability is NONE, as there is nothing to wait for.
+        """
+        future = self._loop.create_future() if self.durability != Durability.NONE else None
+        started = time.perf_counter()
+        callback = functools.partial(self._loop.call_soon_threadsafe, self._on_delivery, future, started)
+        while True:
+            try:
+                self._producer.produce(topic, value=value, key=key, on_delivery=callback)
+                break
+            except BufferError:
+                # The local queue is full; let the poll thread drain it.
+                self.stats['queue_full'] += 1
+                await asyncio.sleep(0.01)
+        self.stats['produced'] += 1
+        return future
+
+    async def produce(self, topic: str, value: Any, key: str | None = None) -> None:
+        """Enqueues a message and, unless durability is NONE, waits for its ack."""
+        if future := await self.enqueue(topic, value, key):
+            await future
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, in_flight=len(self._producer))
@@ -0,0 +1,284 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from typing import Any, AsyncGenerator, Callable, Dict
+import logging
+
+from confluent_kafka import OFFSET_END, Consumer, KafkaError, KafkaException, Producer, TopicPartition
+
+from . import cache, db, env, serialization, write_behind
+
+logger = logging.getLogger(__name__)
+
+#### Broadcaster ####
+
+_CONNECT_TIMEOUT_S = 10
+
+# Seconds between attempts to find the topic's partitions.
+_ASSIGN_RETRY_S = 1
+
+class SlowSubscriberError(Exception):
+    pass
+
+class _Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+class Broadcaster:
+    """Fans out the events of one Kafka topic to every local subscriber.
+
+    A single consumer per worker polls the topic on a background thread.
+    Each subscriber gets a bounded queue; a subscriber whose queue is full is
+    dropped rather than slowing down delivery to everyone else.
+    """
+
+    def __init__(self, broker: str, topic: str, parse: Callable[[bytes], Any], queue_size: int,
+                 purpose: str = 'subscriptions'):
+        self._topic = topic
+        self._purpose = purpose
+        self._parse = parse
+        self._queue_size = queue_size
+        # Every worker must see every event from the latest offset on, and
+        # needs no committed state, so the consumer assigns itself every
+        # partition rather than joining a group (partitions added later are
+        # picked up on restart). The group id is required by the client but
+        # never registered with the broker.
+        self._consumer_conf = {
+            'bootstrap.servers': broker,
+            'group.id': f"app-api-{purpose}",
+            'enable.auto.commit': False,
+            'enable.auto.offset.store': False,
+        }
+        self._subscribers: set[_Subscriber] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._running = threading.Event()
+        self._ready = threading.Event()
+        self.stats = {'received': 0, 'delivered': 0, 'dropped_subscribers': 0}
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._running.set()
+        self._thread = threading.Thread(target=self._poll, name=f"{self._topic}-{self._purpose}-consumer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _assign(self, consumer: Consumer) -> bool:
+        "Assigns every partition of the topic from its end. Returns False if they are not known yet."
+        try:
+            topic = consumer.list_topics(self._topic, timeout=_CONNECT_TIMEOUT_S).topics[self._topic]
+        except KafkaException as e:
+            logger.warning(f"Kafka not reachable yet for {self._topic}: {e}")
+            return False
+        if topic.error is not None or not topic.partitions:
+            logger.warning(f"Topic {self._topic} not available yet: {topic.error}")
+            return False
+        consumer.assign([TopicPartition(self._topic, partition, OFFSET_END) for partition in topic.partitions])
+        logger.info(f"Consuming {self._topic} for {self._purpose}")
+        return True
+
+    def _poll(self) -> None:
+        consumer = Consumer(self._consumer_conf)
+        assigned = self._assign(consumer)
+        self._ready.set()
+        try:
+            while self._running.is_set():
+                if not assigned:
+                    time.sleep(_ASSIGN_RETRY_S)
+                    assigned = self._assign(consumer)
+                    continue
+                msg = consumer.poll(0.5)
+                if msg is None:
+                    continue
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        logger.error(f"Kafka error on {self._topic}: {msg.error()}")
+                    continue
+                try:
+                    event = self._parse(msg.value())
+                except (ValueError, KeyError):
+                    logger.exception(f"Skipping malformed event on {self._topic}")
+                    continue
+                self._loop.call_soon_threadsafe(self._publish, event)
+        finally:
+            consumer.close()
+
+    async def wait_ready(self) -> None:
+        "Waits until the consumer has connected, or given up connecting on startup."
+        await asyncio.to_thread(self._ready.wait, _CONNECT_TIMEOUT_S)
+
+    def _publish(self, event: Any) -> None:
+        self.stats['received'] += 1
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+                self.stats['delivered'] += 1
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber: _Subscriber) -> None:
+        logger.warning(f"Dropping slow subscriber to {self._topic}")
+        self._subscribers.discard(subscriber)
+        self.stats['dropped_subscribers'] += 1
+        subscriber.dropped = True
+        # Make room for a wake-up so the subscriber notices it was dropped.
+        subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    async def subscribe(self) -> AsyncGenerator[Any, None]:
+        subscriber = _Subscriber(self._queue_size)
+        self._subscribers.add(subscriber)
+        try:
+            while True:
+                event = await subscriber.queue.get()
+                if subscriber.dropped:
+                    raise SlowSubscriberError(f"Subscription to {self._topic} fell too far behind.")
+                yield event
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, subscribers=len(self._subscribers))
+
+#### Products ####
+
+def _parse_product(value: bytes) -> db.Product | None:
+    "Returns None for removals, which share the topic."
+    data = serialization.decode(value)
+    if data.get('deleted'):
+        return None
+    return db.Product(id=data['id'], name=data['name'])
+
+_products: Broadcaster | None = None
+
+async def subscribe_products() -> AsyncGenerator[db.Product, None]:
+    async for product in _products.subscribe():
+        if product is not None:
+            yield product
+
+#### Cache invalidation ####
+
+# Each worker publishes the invalidations of its own mutations and applies
+# everyone else's. Delivery is best effort: the cache TTL bounds staleness if
+# a message is lost, and a worker that falls behind drops its whole cache.
+
+_ORIGIN = f"{socket.gethostname()}-{os.getpid()}"
+
+_invalidations: Broadcaster | None = None
+_invalidation_producer: Producer | None = None
+_invalidation_task: asyncio.Task | None = None
+
+def _publish_invalidation(topic: str, collection: str, ids: list[str]) -> None:
+    """Sends an invalidation to the other workers. Never raises: the mutation
+    it follows has already succeeded, and the TTL covers a lost message."""
+    try:
+        # Always JSON: invalidations are internal, and have no Avro schema.
+        value = serialization.encode(topic, {'origin': _ORIGIN, 'collection': collection, 'ids': ids}, 'json')
+        _invalidation_producer.produce(topic, value)
+    except BufferError:
+        logger.warning(f"Kafka queue full, not broadcasting invalidation of {collection}")
+    except Exception:
+        logger.exception(f"Failed to broadcast invalidation of {collection}")
+    _invalidation_producer.poll(0)
+
+def _parse_invalidation(value: bytes) -> tuple[str, str, list[str]]:
+    data = serialization.decode(value)
+    return data['origin'], data['collection'], list(data['ids'])
+
+async def _apply_invalidations() -> None:
+    while True:
+        try:
+            async for origin, collection, ids in _invalidations.subscribe():
+                if origin != _ORIGIN:
+                    cache.invalidate(collection, ids, broadcast=False)
+        except SlowSubscriberError:
+            logger.warning("Missed cache invalidations, clearing the cache")
+            cache.invalidate_all()
+
+def _start_invalidations(broker: str, topic: str) -> None:
+    global _invalidations, _invalidation_producer, _invalidation_task
+    _invalidation_producer = Producer({'bootstrap.servers': broker, 'linger.ms': 5})
+    _invalidations = Broadcaster(broker, topic, _parse_invalidation, env.get_subscription_queue_size())
+    _invalidations.start()
+    _invalidation_task = asyncio.create_task(_apply_invalidations())
+    cache.set_publisher(lambda collection, ids: _publish_invalidation(topic, collection, ids))
+
+def _stop_invalidations() -> None:
+    cache.set_publisher(None)
+    if _invalidation_task is not None:
+        _invalidation_task.cancel()
+    if _invalidations is not None:
+        _invalidations.stop()
+    if _invalidation_producer is not None:
+        _invalidation_producer.flush(5)
+
+#### Write-behind ####
+
+# Every worker overlays the write-behind events of all writers, not only its
+# own, so that a client reads its writes whichever worker serves the read.
+
+# Bursts of writes arrive much faster than subscription events.
+_OVERLAY_QUEUE_SIZE = 10000
+
+_overlays: Dict[str, Broadcaster] = {}
+_overlay_tasks: list[asyncio.Task] = []
+
+async def _apply_overlay(collection: str, broadcaster: Broadcaster) -> None:
+    overlay = write_behind.overlay(collection)
+    while True:
+        try:
+            async for id, value in broadcaster.subscribe():
+                overlay.put(id, value)
+        except SlowSubscriberError:
+            logger.warning(f"Missed {collection} write-behind events; reads may miss them until they are stored")
+
+def _start_overlays(broker: str) -> None:
+    for collection in env.get_write_behind():
+        _overlays[collection] = broadcaster = Broadcaster(
+            broker, collection, lambda value, collection=collection: db.from_event(collection, serialization.decode(value)),
+            _OVERLAY_QUEUE_SIZE, purpose='overlay')
+        broadcaster.start()
+        _overlay_tasks.append(asyncio.create_task(_apply_overlay(collection, broadcaster)))
+
+def _stop_overlays() -> None:
+    for task in _overlay_tasks:
+        task.cancel()
+    for broadcaster in _overlays.values():
+        broadcaster.stop()
+
+#### Lifecycle ####
+
+def start() -> None:
+    """Starts the shared consumers. Must be called from the event loop."""
+    global _products
+    _products = Broadcaster(env.get_kafka_broker(), 'products', _parse_product,
+                            env.get_subscription_queue_size())
+    _products.start()
+    if topic := env.get_cache_invalidation_topic():
+        _start_invalidations(env.get_kafka_broker(), topic)
+    _start_overlays(env.get_kafka_broker())
+
+async def wait_ready() -> None:
+    "Waits for the consumers to connect, so a worker is warm before it serves."
+    for broadcaster in (_products, _invalidations, *_overlays.values()):
+        if broadcaster is not None:
+            await broadcaster.wait_ready()
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    "Returns the counters of each running consumer, by topic role."
+    broadcasters = [('products', _products), ('invalidations', _invalidations),
+                    *((f"overlay.{collection}", broadcaster) for collection, broadcaster in _overlays.items())]
+    return {name: broadcaster.get_stats() for name, broadcaster in broadcasters if broadcaster is not None}
+
+def stop() -> None:
+    if _products is not None:
+        _products.stop()
+    _stop_invalidations()
+    _stop_overlays()
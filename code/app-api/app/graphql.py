@@ -1,15 +1,19 @@
-import asyncio
-from typing import AsyncGenerator
+import base64
+from typing import AsyncGenerator, Awaitable, Callable, Generic, TypeVar
 from functools import cached_property
 from typing import Dict
 import strawberry
-from strawberry.fastapi import BaseContext, GraphQLRouter
+from strawberry.dataloader import DataLoader
+from strawberry.extensions import QueryDepthLimiter
+from strawberry.fastapi import BaseContext
 from strawberry.permission import BasePermission
 from strawberry.types import Info as _Info
 from strawberry.types.info import RootValueType
+from strawberry.types.nodes import SelectedField, Selection
+from strawberry.utils.str_converters import to_snake_case
 import logging
 
-from . import auth, db
+from . import auth, blobs, db, env, events, metrics, persisted_queries, query_cost
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +29,26 @@ class Context(BaseContext):
                     if data := auth.verify_and_decode_jwt(token):
                         return data
 
+    @cached_property
+    def document_loader(self) -> DataLoader[str, db.Document | None]:
+        return DataLoader(load_fn=db.load_documents)
+
+    @cached_property
+    def signature_loader(self) -> DataLoader[str, db.Signature | None]:
+        return DataLoader(load_fn=db.load_signatures)
+
+    @cached_property
+    def field_loader(self) -> DataLoader[str, db.Field | None]:
+        return DataLoader(load_fn=db.load_fields)
+
+    @cached_property
+    def blob_loader(self) -> DataLoader[str, str | None]:
+        return DataLoader(load_fn=blobs.load)
+
+    @cached_property
+    def product_loader(self) -> DataLoader[str, db.Product | None]:
+        return DataLoader(load_fn=db.load_products)
+
 async def get_context() -> Context:
     return Context()
 
@@ -42,115 +66,305 @@ class IsAuthenticated(BasePermission):
 class Message:
     message: str
 
+#### Pagination ####
+
+T = TypeVar('T')
+
+@strawberry.type
+class PageInfo:
+    has_next_page: bool
+    end_cursor: str | None
+
+@strawberry.type
+class Edge(Generic[T]):
+    cursor: str
+    node: T
+
+@strawberry.type
+class Connection(Generic[T]):
+    edges: list[Edge[T]]
+    page_info: PageInfo
+
+def _encode_cursor(id: str) -> str:
+    return base64.urlsafe_b64encode(id.encode()).decode()
+
+def _decode_cursor(cursor: str) -> str:
+    return base64.urlsafe_b64decode(cursor.encode()).decode()
+
+def _flatten(selections: list[Selection]) -> list[SelectedField]:
+    fields = []
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            fields.append(selection)
+        else:
+            fields.extend(_flatten(selection.selections))
+    return fields
+
+def _selected_node_fields(info: Info) -> set[str]:
+    "Returns the snake_case names of the fields selected under `edges { node }`."
+    return {to_snake_case(node_field.name)
+            for edges in _flatten(info.selected_fields[0].selections) if edges.name == 'edges'
+            for node in _flatten(edges.selections) if node.name == 'node'
+            for node_field in _flatten(node.selections)}
+
+async def _paginate(list_fn: Callable[..., Awaitable[list[T]]],
+                    info: Info,
+                    first: int | None,
+                    after: str | None) -> Connection[T]:
+    max_page_size = env.get_http_graphql_max_page_size()
+    if first is not None and first < 0:
+        raise ValueError("`first` must not be negative.")
+    limit = max_page_size if first is None else min(first, max_page_size)
+    items = await list_fn(limit=limit + 1,
+                          after=_decode_cursor(after) if after else None,
+                          fields=_selected_node_fields(info))
+    edges = [Edge(cursor=_encode_cursor(item.id), node=item) for item in items[:limit]]
+    return Connection(edges=edges,
+                      page_info=PageInfo(has_next_page=len(items) > limit,
+                                         end_cursor=edges[-1].cursor if edges else None))
+
+#### Batches ####
+
+@strawberry.type
+class BatchItem(Generic[T]):
+    "The outcome of one input of a list-taking mutation: `item` on success, else `error`."
+    item: T | None
+    error: str | None
+
+def _batch_items(results: list[T | Exception]) -> list[BatchItem[T]]:
+    items = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Batch item failed: {result!r}")
+            items.append(BatchItem(item=None, error=type(result).__name__.removesuffix('Exception')))
+        else:
+            items.append(BatchItem(item=result, error=None))
+    return items
+
+def _removed_items(ids: list[str], results: list[Exception | None]) -> list[BatchItem[str]]:
+    return _batch_items([result or id for id, result in zip(ids, results)])
+
+@strawberry.input
+class DocumentInput:
+    name: str
+    content: str
+    first_name: str
+    last_name: str
+    email: str
+
+@strawberry.input
+class SignatureInput:
+    document_id: str
+    signed_by_email: str
+    signed_content: str
+
+@strawberry.input
+class FieldInput:
+    name: str
+    type: str
+
+@strawberry.input
+class TemplateInput:
+    name: str
+    template: str
+    field_ids: list[str]
+
 #### Mutations ####
 
 @strawberry.type
 class Mutation:
     @strawberry.field(permission_classes=[IsAuthenticated])
     async def add_product(self, name: str) -> db.Product:
-        return db.create_product(name)
+        return await db.create_product(name)
 
     @strawberry.field(permission_classes=[IsAuthenticated])
     async def remove_product(self, id: str) -> None:
-        db.delete_product(id)
+        await db.delete_product(id)
 
     @strawberry.field
     async def add_document(self, name: str, content: str, first_name: str, last_name: str, email: str) -> db.Document:
-        return db.create_document(name, first_name, last_name, email, content)
+        return await db.create_document(name, first_name, last_name, email, content)
     
     @strawberry.field
     async def remove_document(self, id: str) -> None:
-        db.delete_document(id)
+        await db.delete_document(id)
     
     @strawberry.field
     async def sign_document(self, document_id: str, signed_by_email: str, signed_content: str) -> db.Signature:
-        return db.create_signature(document_id, signed_by_email, signed_content)
+        return await db.create_signature(document_id, signed_by_email, signed_content)
 
     @strawberry.field
     async def add_field(self, name: str, type: str) -> db.Field:
-        return db.create_field(name, type)
+        return await db.create_field(name, type)
     
     @strawberry.field
     async def remove_field(self, id: str) -> None:
-        db.delete_field(id)
+        await db.delete_field(id)
     
     @strawberry.field
     async def add_template(self, name: str, template: str, field_ids: list[str]) -> db.Template:
-        return db.create_template(name, template, field_ids)
+        return await db.create_template(name, template, field_ids)
     
     @strawberry.field
     async def remove_template(self, id: str) -> None:
-        db.delete_template(id)
+        await db.delete_template(id)
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def add_products(self, names: list[str]) -> list[BatchItem[db.Product]]:
+        return _batch_items(await db.create_products(names))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def remove_products(self, ids: list[str]) -> list[BatchItem[str]]:
+        return _removed_items(ids, await db.delete_many('products', ids))
+
+    @strawberry.field
+    async def add_documents(self, documents: list[DocumentInput]) -> list[BatchItem[db.Document]]:
+        return _batch_items(await db.create_documents([vars(d) for d in documents]))
+
+    @strawberry.field
+    async def remove_documents(self, ids: list[str]) -> list[BatchItem[str]]:
+        return _removed_items(ids, await db.delete_many('documents', ids))
+
+    @strawberry.field
+    async def sign_documents(self, signatures: list[SignatureInput]) -> list[BatchItem[db.Signature]]:
+        return _batch_items(await db.create_signatures([vars(s) for s in signatures]))
+
+    @strawberry.field
+    async def add_fields(self, fields: list[FieldInput]) -> list[BatchItem[db.Field]]:
+        return _batch_items(await db.create_fields([vars(f) for f in fields]))
+
+    @strawberry.field
+    async def remove_fields(self, ids: list[str]) -> list[BatchItem[str]]:
+        return _removed_items(ids, await db.delete_many('fields', ids))
+
+    @strawberry.field
+    async def add_templates(self, templates: list[TemplateInput]) -> list[BatchItem[db.Template]]:
+        return _batch_items(await db.create_templates([vars(t) for t in templates]))
+
+    @strawberry.field
+    async def remove_templates(self, ids: list[str]) -> list[BatchItem[str]]:
+        return _removed_items(ids, await db.delete_many('templates', ids))
 #### Queries ####
 
 @strawberry.type
 class Query:
     @strawberry.field
-    def products(self) -> list[db.Product]:
-        return db.list_products()
+    async def products(self, info: Info, first: int | None = None, after: str | None = None) -> Connection[db.Product]:
+        return await _paginate(db.list_products, info, first, after)
+
+    @strawberry.field
+    async def product(self, id: str, info: Info) -> db.Product | None:
+        return await info.context.product_loader.load(id)
 
     @strawberry.field(permission_classes=[IsAuthenticated])
     def hello(self) -> Message:
         return Message(message="Hej, hej")
 
     @strawberry.field
-    def documents(self) -> list[db.Document]:
-        return db.list_documents()
+    async def documents(self, info: Info, first: int | None = None, after: str | None = None) -> Connection[db.Document]:
+        return await _paginate(db.list_documents, info, first, after)
     
     @strawberry.field
-    def document(self, id: str) -> db.Document | None:
-        return db.get_document(id)
+    async def document(self, id: str, info: Info) -> db.Document | None:
+        return await info.context.document_loader.load(id)
     
     @strawberry.field
-    def signatures(self) -> list[db.Signature]:
-        return db.list_signatures()
+    async def signatures(self, info: Info, first: int | None = None, after: str | None = None) -> Connection[db.Signature]:
+        return await _paginate(db.list_signatures, info, first, after)
     
     @strawberry.field
-    def signature(self, id: str) -> db.Signature | None:
-        return db.get_signature(id)
+    async def signature(self, id: str, info: Info) -> db.Signature | None:
+        return await info.context.signature_loader.load(id)
     
     @strawberry.field
-    def verify_signature(self, id: str) -> db.Signature | None:
-        return db.verify_signature(id)
+    async def verify_signature(self, id: str) -> db.Signature | None:
+        return await db.verify_signature(id)
+
+    @strawberry.field
+    async def verify_signatures(self, ids: list[strawberry.ID]) -> list[db.Signature | None]:
+        return await db.verify_signatures(ids)
     
     @strawberry.field
-    def get_signature_by_document(self, document_id: str) -> db.Signature | None:
-        return db.get_signature_by_document_id(document_id)
+    async def get_signature_by_document(self, document_id: str) -> db.Signature | None:
+        return await db.get_signature_by_document_id(document_id)
 
     @strawberry.field
-    def fields(self) -> list[db.Field]:
-        return db.list_fields()
+    async def fields(self, info: Info, first: int | None = None, after: str | None = None) -> Connection[db.Field]:
+        return await _paginate(db.list_fields, info, first, after)
     
     @strawberry.field
-    def field(self, id: str) -> db.Field | None:
-        return db.get_field(id)
+    async def field(self, id: str, info: Info) -> db.Field | None:
+        return await info.context.field_loader.load(id)
     
     @strawberry.field
-    def templates(self) -> list[db.Template]:
-        return db.list_templates()
+    async def templates(self, info: Info, first: int | None = None, after: str | None = None) -> Connection[db.Template]:
+        return await _paginate(db.list_templates, info, first, after)
     
     @strawberry.field
-    def template(self, id: str) -> db.Template | None:
-        return db.get_template(id)
+    async def template(self, id: str) -> db.Template | None:
+        return await db.get_template(id)
 #### Subscriptions ####
 
 @strawberry.type
 class Subscription:
     @strawberry.subscription
     async def product_added(self) -> AsyncGenerator[db.Product, None]:
-        # TODO: use a Kafka topic to avoid polling here
-        seen = set(p.id for p in db.list_products())
-        while True:
-            for p in db.list_products():
-                if p.id not in seen:
-                    seen.add(p.id)
-                    yield p
-            await asyncio.sleep(0.5)
+        async for product in events.subscribe_products():
+            yield product
+
+#### REST ####
+
+# The REST upload routes reply with the objects they create in the same shape
+# as GraphQL, by running them through the same types as the root of a query.
+
+@strawberry.type
+class _Created:
+    document: db.Document | None = None
+    signature: db.Signature | None = None
+
+_DOCUMENT_SELECTION = "id name content firstName lastName email checksum"
+
+_created_schema = strawberry.Schema(_Created)
+
+async def _created_json(query: str, created: _Created) -> dict:
+    result = await _created_schema.execute(query, root_value=created, context_value=await get_context())
+    if result.errors:
+        raise result.errors[0].original_error or Exception(result.errors[0].message)
+    return next(iter(result.data.values()))
+
+async def document_json(document: db.Document) -> dict:
+    return await _created_json(f"{{ document {{ {_DOCUMENT_SELECTION} }} }}", _Created(document=document))
+
+async def signature_json(signature: db.Signature) -> dict:
+    return await _created_json(
+        f"{{ signature {{ id signedByEmail signedContent signedChecksum signedTs document {{ {_DOCUMENT_SELECTION} }} }} }}",
+        _Created(signature=signature))
 
 #### API ####
 
+# Resolver costs above the default of 1, for fields that read or hash bodies.
+_FIELD_COSTS = {
+    'Document.content': 2,
+    'Signature.signedContent': 2,
+    'Query.verifySignature': 3,
+    'Query.verifySignatures': 3,
+    'Mutation.addDocument': 3,
+    'Mutation.addDocuments': 3,
+    'Mutation.signDocument': 3,
+    'Mutation.signDocuments': 3,
+}
+
 def get_app():
-    return GraphQLRouter(
-        strawberry.Schema(Query, mutation=Mutation, subscription=Subscription),
-        context_getter=get_context
+    allowlist = env.get_http_graphql_persisted_query_allowlist()
+    extensions = [
+        metrics.ResolverMetrics,
+        persisted_queries.document_cache(env.get_http_graphql_document_cache_size()),
+        QueryDepthLimiter(max_depth=env.get_http_graphql_max_depth()),
+        query_cost.cost_limiter(env.get_http_graphql_max_cost(), env.get_http_graphql_max_page_size(), _FIELD_COSTS),
+    ]
+    return persisted_queries.PersistedQueryRouter(
+        strawberry.Schema(Query, mutation=Mutation, subscription=Subscription, extensions=extensions),
+        context_getter=get_context,
+        store=persisted_queries.QueryStore(env.get_http_graphql_persisted_query_cache_size(),
+                                           persisted_queries.load_allowlist(allowlist) if allowlist else None)
     )
@@ -1,4 +1,5 @@
 import argparse
+import json
 import sys
 import logging
 
@@ -12,6 +13,50 @@ def handle_run(args):
         return v
     http_server.run(env.get_http_conf(), "app.routes:app")
 
+def handle_bootstrap(args):
+    """Creates collections and indexes, then checks every db query plan."""
+    # Imported here as it pulls in the Couchbase SDK and the GraphQL schema,
+    # which `run` leaves to the server workers.
+    from . import schema
+    if v := init.init():
+        return v
+    if not args.check_only:
+        schema.bootstrap()
+    if failing := schema.check_query_plans():
+        logger.error(f"{len(failing)} queries fall back to a primary scan.")
+        return 1
+
+def handle_startup_profile(args):
+    """Reports how long importing and initializing the app takes, per module."""
+    from . import startup_profile
+    profile = startup_profile.profile()
+    if args.json:
+        print(json.dumps(profile, indent=2))
+    else:
+        print(startup_profile.format_report(profile, args.top))
+
+def handle_benchmark(args):
+    """Benchmarks the app in-process against local stand-ins and reports JSON."""
+    from . import benchmark, loadgen
+    if unknown := set(args.scenario or []) - set(benchmark.SCENARIOS):
+        logger.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return 1
+    conf = benchmark.BenchmarkConf(**{name: value for name, value in vars(args).items()
+                                      if name in benchmark.BenchmarkConf.model_fields and value is not None})
+    report = benchmark.run(conf, args.scenario or list(benchmark.SCENARIOS))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if regressions := loadgen.compare(baseline, report, args.tolerance):
+            for regression in regressions:
+                logger.error(f"Regression in {regression}")
+            return 1
+
 def parse_args(args: list[str]):
     """Parses command-line arguments."""
     parser = argparse.ArgumentParser(description="Example app.")
@@ -20,6 +65,35 @@ def parse_args(args: list[str]):
     run_parser = subparsers.add_parser('run')
     run_parser.set_defaults(command=handle_run)
 
+    bootstrap_parser = subparsers.add_parser('bootstrap')
+    bootstrap_parser.add_argument('--check-only', action='store_true',
+                                  help="Only check query plans, don't create collections or indexes.")
+    bootstrap_parser.set_defaults(command=handle_bootstrap)
+
+    startup_profile_parser = subparsers.add_parser('startup-profile')
+    startup_profile_parser.add_argument('--top', type=int, default=15,
+                                        help="Number of packages and modules to list.")
+    startup_profile_parser.add_argument('--json', action='store_true',
+                                        help="Print the full profile as JSON.")
+    startup_profile_parser.set_defaults(command=handle_startup_profile)
+
+    benchmark_parser = subparsers.add_parser('benchmark')
+    benchmark_parser.add_argument('--scenario', action='append',
+                                  help="Scenario to run (repeatable). Runs all of them by default.")
+    benchmark_parser.add_argument('--requests', type=int, help="Timed requests per scenario.")
+    benchmark_parser.add_argument('--concurrency', type=int, help="Concurrent requests.")
+    benchmark_parser.add_argument('--warmup-requests', type=int, help="Untimed requests before each scenario.")
+    benchmark_parser.add_argument('--allocation-requests', type=int,
+                                  help="Sequential requests traced for allocations.")
+    benchmark_parser.add_argument('--kv-latency-ms', type=float, help="Simulated Couchbase KV latency.")
+    benchmark_parser.add_argument('--query-latency-ms', type=float, help="Simulated Couchbase query latency.")
+    benchmark_parser.add_argument('--subscribers', type=int, help="WebSocket subscribers in `subscriptions`.")
+    benchmark_parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    benchmark_parser.add_argument('--baseline', help="Report to compare against; exits 1 on a regression.")
+    benchmark_parser.add_argument('--tolerance', type=float, default=0.2,
+                                  help="Allowed p99/throughput regression against the baseline, as a fraction.")
+    benchmark_parser.set_defaults(command=handle_benchmark)
+
     args = parser.parse_args(args)
 
     if 'command' not in args:
@@ -0,0 +1,279 @@
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+import glob
+from inspect import isawaitable
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+import logging
+
+from graphql import GraphQLResolveInfo
+from strawberry.extensions import SchemaExtension
+from strawberry.schema.schema_converter import GraphQLCoreConverter
+
+logger = logging.getLogger(__name__)
+
+# In-process counters and latency histograms, rendered in the Prometheus text
+# format. Recording is a dict lookup and a few additions under a lock, so it
+# is cheap enough for every resolver and Couchbase operation.
+#
+# With several server workers a scrape reaches only one of them. When a
+# directory is configured, each worker periodically writes its samples there
+# and a scrape renders the sum over all recent worker snapshots.
+
+# Seconds, from sub-millisecond KV gets to multi-second scans.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Snapshots older than this belong to workers that are gone.
+_SNAPSHOT_MAX_AGE_S = 60
+
+LabelValues = Tuple[str, ...]
+
+#### Metrics ####
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.series: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Per series: one count per bucket plus +Inf, then sum, then count.
+        self.series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            if (data := self.series.get(label_values)) is None:
+                data = self.series[label_values] = [0] * (len(self.buckets) + 3)
+            data[bisect_left(self.buckets, value)] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+class Gauge(_Metric):
+    "Values read from `collect` at scrape time, e.g. existing stats dicts."
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, help, labels)
+        self._collect = collect
+
+    @property
+    def series(self) -> Dict[LabelValues, float]:
+        try:
+            return self._collect()
+        except Exception:
+            logger.exception(f"Failed to collect {self.name}")
+            return {}
+
+#### Registry ####
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+def _register(metric: _Metric) -> Any:
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+def counter(name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+    "Returns the counter called `name`, creating it on first use."
+    return _registry.get(name) or _register(Counter(name, help, labels))
+
+def histogram(name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    "Returns the histogram called `name`, creating it on first use."
+    return _registry.get(name) or _register(Histogram(name, help, labels, buckets))
+
+def gauge(name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[LabelValues, float]]) -> None:
+    "Registers (or replaces) a gauge whose values come from `collect`."
+    with _registry_lock:
+        _registry[name] = Gauge(name, help, labels, collect)
+
+def stats_gauge(name: str, help: str, get_stats: Callable[[], Dict[str, float]]) -> None:
+    "Registers a gauge with one `stat` label value per key of a stats dict."
+    gauge(name, help, ('stat',), lambda: {(k,): v for k, v in get_stats().items()})
+
+#### Snapshots ####
+
+def snapshot() -> Dict[str, Any]:
+    metrics = {}
+    for metric in list(_registry.values()):
+        with metric._lock:
+            series = [[list(labels), list(value) if isinstance(value, list) else value]
+                      for labels, value in metric.series.items()]
+        metrics[metric.name] = {'type': metric.type, 'help': metric.help, 'labels': list(metric.labels),
+                                'buckets': list(getattr(metric, 'buckets', ())), 'series': series}
+    return metrics
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for metrics in snapshots:
+        for name, metric in metrics.items():
+            target = merged.setdefault(name, {**metric, 'series': {}})
+            for labels, value in metric['series']:
+                key = tuple(labels)
+                if key not in target['series']:
+                    target['series'][key] = value
+                elif isinstance(value, list):
+                    target['series'][key] = [a + b for a, b in zip(target['series'][key], value)]
+                else:
+                    target['series'][key] += value
+    return merged
+
+def _snapshot_path(directory: str) -> str:
+    return os.path.join(directory, f"{os.getpid()}.json")
+
+def write_snapshot(directory: str) -> None:
+    path = _snapshot_path(directory)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+def remove_snapshot(directory: str) -> None:
+    try:
+        os.remove(_snapshot_path(directory))
+    except FileNotFoundError:
+        pass
+
+def _read_snapshots(directory: str) -> List[Dict[str, Any]]:
+    snapshots = []
+    now = time.time()
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            if now - os.path.getmtime(path) > _SNAPSHOT_MAX_AGE_S:
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Removed or half-written by its worker.
+    return snapshots
+
+async def run_snapshots(directory: str, interval_s: float = 5) -> None:
+    """Writes this worker's snapshot every `interval_s` until cancelled."""
+    os.makedirs(directory, exist_ok=True)
+    try:
+        while True:
+            await asyncio.to_thread(write_snapshot, directory)
+            await asyncio.sleep(interval_s)
+    finally:
+        remove_snapshot(directory)
+
+#### Exposition ####
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: List[str], values: List[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def render(directory: str | None = None) -> str:
+    """Returns every metric in the Prometheus text format (version 0.0.4).
+
+    With `directory`, sums this worker's samples with the other workers'.
+    """
+    if directory:
+        write_snapshot(directory)
+        metrics = _merge(_read_snapshots(directory))
+    else:
+        metrics = _merge([snapshot()])
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric['series'].items()):
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip([*metric['buckets'], math.inf], value):
+                    cumulative += count
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{name}_bucket{_format_labels(metric['labels'], labels, le)} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(metric['labels'], labels)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(metric['labels'], labels)} {_format_value(value[-1])}")
+            else:
+                lines.append(f"{name}{_format_labels(metric['labels'], labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+#### GraphQL ####
+
+_operation_duration = histogram('graphql_operation_duration_seconds', "Latency of GraphQL operations.",
+                                ('operation_type',))
+_resolver_duration = histogram('graphql_resolver_duration_seconds', "Latency of GraphQL field resolvers.",
+                               ('field',))
+
+# Whether each (type, field) has a resolver; plain attributes are not timed.
+_timed_fields: Dict[Tuple[str, str], bool] = {}
+
+def _is_timed(info: GraphQLResolveInfo) -> bool:
+    key = (info.parent_type.name, info.field_name)
+    if (timed := _timed_fields.get(key)) is None:
+        # Meta fields such as __typename are not among the type's fields.
+        field = info.parent_type.fields.get(info.field_name)
+        definition = field.extensions.get(GraphQLCoreConverter.DEFINITION_BACKREF) if field else None
+        timed = _timed_fields[key] = definition is not None and definition.base_resolver is not None
+    return timed
+
+class ResolverMetrics(SchemaExtension):
+    """Times every operation, and every field backed by a resolver."""
+
+    def on_operation(self) -> Iterator[None]:
+        started = time.perf_counter()
+        yield
+        try:
+            operation_type = self.execution_context.operation_type.value
+        except Exception:
+            operation_type = 'invalid'
+        _operation_duration.observe(time.perf_counter() - started, operation_type)
+
+    def resolve(self, _next, root, info: GraphQLResolveInfo, *args, **kwargs) -> Any:
+        if not _is_timed(info):
+            return _next(root, info, *args, **kwargs)
+        field = f"{info.parent_type.name}.{info.field_name}"
+        started = time.perf_counter()
+        result = _next(root, info, *args, **kwargs)
+        if isawaitable(result):
+            return self._observe_async(result, field, started)
+        _resolver_duration.observe(time.perf_counter() - started, field)
+        return result
+
+    async def _observe_async(self, result: Awaitable[Any], field: str, started: float) -> Any:
+        try:
+            return await result
+        finally:
+            _resolver_duration.observe(time.perf_counter() - started, field)
@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterator
+import logging
+
+from graphql import (ExecutionResult, FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError,
+                     GraphQLList, GraphQLObjectType, GraphQLSchema, InlineFragmentNode, SelectionSetNode,
+                     get_named_type, get_nullable_type)
+from graphql.execution.values import get_argument_values
+from graphql.utilities import get_operation_ast
+from strawberry.extensions import SchemaExtension
+from strawberry.schema.schema_converter import GraphQLCoreConverter
+
+logger = logging.getLogger(__name__)
+
+# Static cost estimate of an operation, computed from its AST before it runs.
+#
+# Only fields backed by a resolver do work, so they cost 1 per call (or the
+# override in `costs`) and plain attributes are free. A resolver taking a
+# list argument (ids, bulk inputs) is charged per element. The cost of a
+# field's children is multiplied by the number of times they run: the
+# `first` page size for connections, otherwise the length of the list
+# argument or DEFAULT_LIST_SIZE for lists of unknown length.
+
+DEFAULT_LIST_SIZE = 10
+
+class QueryTooExpensive(GraphQLError):
+    pass
+
+#### Estimation ####
+
+class _Estimator:
+    def __init__(self, schema: GraphQLSchema, fragments: Dict[str, FragmentDefinitionNode],
+                 variables: Dict[str, Any], costs: Dict[str, int], max_page_size: int):
+        self._schema = schema
+        self._fragments = fragments
+        self._variables = variables
+        self._costs = costs
+        self._max_page_size = max_page_size
+
+    def _fields(self, selection_set: SelectionSetNode) -> Iterator[FieldNode]:
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from self._fields(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                yield from self._fields(self._fragments[selection.name.value].selection_set)
+
+    def cost(self, selection_set: SelectionSetNode, parent: GraphQLObjectType,
+             multiplier: int, page_size: int | None = None) -> int:
+        total = 0
+        for node in self._fields(selection_set):
+            field = parent.fields.get(node.name.value)
+            if field is None:
+                continue  # __typename and introspection
+            args = get_argument_values(field, node, self._variables)
+            list_size = max((len(v) for v in args.values() if isinstance(v, list)), default=None)
+            definition = field.extensions.get(GraphQLCoreConverter.DEFINITION_BACKREF)
+            if definition is not None and definition.base_resolver is not None:
+                total += multiplier * self._costs.get(f"{parent.name}.{node.name.value}", 1) * (list_size or 1)
+            if node.selection_set is None:
+                continue
+            child_multiplier, child_page_size = multiplier, None
+            if 'first' in field.args:
+                first = args.get('first')
+                child_page_size = self._max_page_size if first is None else min(first, self._max_page_size)
+            elif isinstance(get_nullable_type(field.type), GraphQLList):
+                child_multiplier *= page_size if page_size is not None else list_size or DEFAULT_LIST_SIZE
+            total += self.cost(node.selection_set, get_named_type(field.type), child_multiplier, child_page_size)
+        return total
+
+#### Extension ####
+
+def cost_limiter(max_cost: int, max_page_size: int, costs: Dict[str, int] | None = None) -> type[SchemaExtension]:
+    """Returns a schema extension that rejects operations costing more than `max_cost`.
+
+    The estimate is reported under `cost` in the response extensions.
+    """
+    costs = costs or {}
+
+    class CostLimiter(SchemaExtension):
+        cost: int | None = None
+
+        def on_execute(self) -> Iterator[None]:
+            context = self.execution_context
+            operation = get_operation_ast(context.graphql_document, context.operation_name)
+            if operation is not None:
+                schema = context.schema._schema
+                fragments = {d.name.value: d for d in context.graphql_document.definitions
+                             if isinstance(d, FragmentDefinitionNode)}
+                estimator = _Estimator(schema, fragments, context.variables or {}, costs, max_page_size)
+                try:
+                    self.cost = estimator.cost(operation.selection_set,
+                                               schema.get_root_type(operation.operation),
+                                               multiplier=1)
+                except GraphQLError:
+                    pass  # Invalid variables; execution reports them.
+                if self.cost is not None and self.cost > max_cost:
+                    logger.warning(f"Rejecting operation {context.operation_name} costing {self.cost}")
+                    context.result = ExecutionResult(data=None, errors=[QueryTooExpensive(
+                        f"Query cost {self.cost} exceeds the limit of {max_cost}.",
+                        extensions={'code': 'QUERY_TOO_EXPENSIVE'}
+                    )])
+            yield
+
+        def get_results(self) -> Dict[str, Any]:
+            if self.cost is None:
+                return {}
+            return {'cost': {'requested': self.cost, 'limit': max_cost}}
+
+    return CostLimiter
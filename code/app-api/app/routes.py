@@ -1,7 +1,10 @@
-from fastapi import FastAPI
+import asyncio
+from couchbase.exceptions import CouchbaseException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 import logging
 
-from . import graphql, init
+from . import admission, async_couchbase, auth, cache, couchbase, db, env, events, graphql, init, metrics, write_behind
 
 logger = logging.getLogger(__name__)
 
@@ -9,8 +12,91 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+def _identify(token: str) -> str | None:
+    "The user a bearer token stands for, for per-user rate limits."
+    return (auth.verify_and_decode_jwt(token) or {}).get('sub')
+
+app.add_middleware(admission.AdmissionMiddleware, conf=env.get_admission_conf(), identify=_identify)
+
 @app.on_event("startup")
 async def reinit():
     init.init()
+    app.state.loop_lag_monitor = admission.start_loop_lag_monitor()
+    async_couchbase.configure(env.get_couchbase_max_workers())
+    app.state.key_refresh = await auth.start_key_refresh()
+    # Before events, which applies write-behind events to its overlays.
+    await write_behind.start()
+    events.start()
+    _register_stats()
+    if metrics_dir := env.get_metrics_dir():
+        app.state.metrics_snapshots = asyncio.create_task(metrics.run_snapshots(metrics_dir))
+    await warm_up()
+
+async def warm_up():
+    """Opens the Couchbase and Kafka connections before the worker serves traffic.
+
+    Failures are logged rather than fatal: the connections are retried on use.
+    """
+    try:
+        await asyncio.to_thread(couchbase.get_cluster, env.get_couchbase_conf())
+    except CouchbaseException as e:
+        logger.warning(f"Couchbase not reachable during warmup: {e}")
+    await events.wait_ready()
+
+@app.on_event("shutdown")
+async def close_connections():
+    app.state.key_refresh.cancel()
+    app.state.loop_lag_monitor.cancel()
+    if snapshots := getattr(app.state, 'metrics_snapshots', None):
+        snapshots.cancel()
+    events.stop()
+    await write_behind.stop()
+    async_couchbase.shutdown()
+    couchbase.close_all()
 
 app.include_router(graphql.get_app(), prefix="/api")
+
+#### Metrics ####
+
+def _register_stats():
+    "Exposes the existing stats counters as gauges."
+    metrics.stats_gauge('couchbase_pool', "Couchbase connection pool counters.", couchbase.get_stats)
+    metrics.stats_gauge('auth_key_store', "JWKS key store counters.", auth.get_key_store_stats)
+    metrics.stats_gauge('auth_token_cache', "Verified token cache counters.", auth.get_token_cache_stats)
+    metrics.stats_gauge('admission', "Admission control and rate limit counters.", admission.get_stats)
+    metrics.gauge('subscription_consumer', "Subscription consumer counters.", ('consumer', 'stat'),
+                  lambda: {(name, stat): value for name, stats in events.get_stats().items()
+                           for stat, value in stats.items()})
+    metrics.gauge('write_behind', "Write-behind producer and overlay counters.", ('component', 'stat'),
+                  lambda: {(name, stat): value for name, stats in write_behind.get_stats().items()
+                           for stat, value in stats.items()})
+    metrics.gauge('reference_cache', "Reference data cache counters.", ('cache', 'stat'),
+                  lambda: {(name, stat): value for name, stats in cache.get_stats().items()
+                           for stat, value in stats.items()})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(env.get_metrics_dir()), media_type="text/plain; version=0.0.4")
+
+#### Uploads ####
+
+# The request body is the raw document content (plain or chunked transfer
+# encoding). It is hashed and stored as it streams in, so large documents
+# never have to fit in memory. The reply is the created object in the shape
+# GraphQL returns it in.
+
+@app.post("/api/documents")
+async def upload_document(request: Request, name: str, first_name: str, last_name: str, email: str):
+    try:
+        document = await db.create_document_from_stream(name, first_name, last_name, email, request.stream())
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Document content must be UTF-8")
+    return await graphql.document_json(document)
+
+@app.post("/api/documents/{document_id}/signatures")
+async def upload_signature(request: Request, document_id: str, signed_by_email: str):
+    try:
+        signature = await db.create_signature_from_stream(document_id, signed_by_email, request.stream())
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Signed content must be UTF-8")
+    return await graphql.signature_json(signature)
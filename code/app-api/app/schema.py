@@ -0,0 +1,90 @@
+import time
+from typing import Any, Iterator
+import logging
+
+from . import admission, blobs, couchbase as cb, db, env
+
+logger = logging.getLogger(__name__)
+
+#### Indexes ####
+
+# Secondary indexes per collection. The `*_by_id` indexes lead with META().id
+# to serve the keyset-paginated list queries and include the small attributes
+# so name-only listings are covered; large bodies are left out on purpose.
+INDEXES = {
+    'products': {
+        'idx_products_by_id': ['META().id', 'name'],
+    },
+    'documents': {
+        'idx_documents_by_id': ['META().id', 'name', 'checksum', 'first_name', 'last_name', 'email'],
+    },
+    'signatures': {
+        'idx_signatures_by_id': ['META().id', 'document_id', 'signed_by_email', 'signed_checksum', 'signed_ts'],
+        'idx_signatures_by_document_id': ['document_id'],
+    },
+    'fields': {
+        'idx_fields_by_id': ['META().id', 'name', 'type'],
+    },
+    'templates': {
+        'idx_templates_by_id': ['META().id', 'name', 'field_ids'],
+    },
+}
+
+_PRIMARY_SCAN_OPERATORS = ('PrimaryScan', 'PrimaryScan3')
+
+_INDEX_ONLINE_TIMEOUT_S = 120
+
+#### Bootstrap ####
+
+def _wait_for_indexes(conf: cb.ConnectionConf, bucket: str, names: list[str]) -> None:
+    deadline = time.monotonic() + _INDEX_ONLINE_TIMEOUT_S
+    while True:
+        pending = [r['name'] for r in cb.exec(
+            conf,
+            "SELECT name FROM system:indexes WHERE bucket_id = $1 AND name IN $2 AND state != 'online'",
+            positional_parameters=[bucket, names]
+        )]
+        if not pending:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Indexes not online after {_INDEX_ONLINE_TIMEOUT_S}s: {pending}")
+        logger.info(f"Waiting for indexes to come online: {pending}")
+        time.sleep(1)
+
+def bootstrap() -> None:
+    """Creates the collections and secondary indexes db.py and admission.py rely on."""
+    conf = env.get_couchbase_conf()
+    bucket = env.get_couchbase_bucket()
+    for collection in [*db.COLLECTION_COLUMNS, blobs.COLLECTION, admission.COLLECTION]:
+        logger.info(f"Creating collection {bucket}._default.{collection}")
+        cb.exec(conf, f"CREATE COLLECTION {bucket}._default.{collection} IF NOT EXISTS")
+    for collection, indexes in INDEXES.items():
+        for name, keys in indexes.items():
+            logger.info(f"Creating index {name} on {bucket}._default.{collection}")
+            cb.exec(conf, f"CREATE INDEX {name} IF NOT EXISTS ON {bucket}._default.{collection}({', '.join(keys)})")
+    _wait_for_indexes(conf, bucket, [name for indexes in INDEXES.values() for name in indexes])
+
+#### Plan checks ####
+
+def _operators(plan: Any) -> Iterator[str]:
+    if isinstance(plan, dict):
+        if operator := plan.get('#operator'):
+            yield operator
+        for value in plan.values():
+            yield from _operators(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _operators(value)
+
+def check_query_plans() -> list[str]:
+    """Runs EXPLAIN on every db.py query and returns those using a primary scan."""
+    conf = env.get_couchbase_conf()
+    failing = []
+    for query in db.get_queries():
+        plan = cb.exec(conf, f"EXPLAIN {query}")
+        if any(op in _PRIMARY_SCAN_OPERATORS for op in _operators(plan)):
+            logger.error(f"Query falls back to a primary scan: {query}")
+            failing.append(query)
+        else:
+            logger.info(f"Query plan OK: {query}")
+    return failing
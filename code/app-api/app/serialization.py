@@ -0,0 +1,199 @@
+import hashlib
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, List
+import logging
+
+from pydantic import BaseModel
+
+from . import env
+
+logger = logging.getLogger(__name__)
+
+# Encodes the Kafka events this service produces and decodes those it
+# consumes. The format is chosen per topic, but only for producing: each
+# format can be told from its first byte, so consumers decode whatever they
+# are given and a topic can change format without a coordinated deploy.
+#
+#   json     '{' followed by the object
+#   msgpack  a map, so 0x80-0x8f, 0xde or 0xdf
+#   avro     0x00, a 4-byte schema id, then the record (Confluent's framing)
+#
+# Avro schemas are read from a directory standing in for a schema registry,
+# holding <topic>-value.avsc per topic, or <topic>-value.<version>.avsc when
+# there are several versions. A schema's id is derived from its canonical
+# form, so every service agrees on ids without a registry to ask. Events are
+# written with the latest version and read with the one they were written
+# with, resolved to the latest.
+
+FORMATS = ('json', 'msgpack', 'avro')
+
+_AVRO_MAGIC = b'\x00'
+_MSGPACK_MAPS = frozenset([*range(0x80, 0x90), 0xde, 0xdf])
+
+class SerializerConf(BaseModel):
+    default: str = 'json'
+    topics: Dict[str, str] = {}
+    schema_dir: str
+
+#### Schemas ####
+
+def _schema_id(schema: dict) -> int:
+    from fastavro.schema import to_parsing_canonical_form
+    digest = hashlib.sha256(to_parsing_canonical_form(schema).encode()).digest()
+    return int.from_bytes(digest[:4], 'big') & 0x7fffffff
+
+class SchemaRegistry:
+    """Avro schemas by id and latest version by subject, from `path`."""
+
+    def __init__(self, path: str):
+        import fastavro
+        self._schemas: Dict[int, tuple[str, Any]] = {}
+        self._latest: Dict[str, tuple[int, int]] = {}
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.avsc'):
+                continue
+            subject, _, version = name[:-len('.avsc')].partition('.')
+            with open(os.path.join(path, name)) as f:
+                schema = json.load(f)
+            id = _schema_id(schema)
+            self._schemas[id] = (subject, fastavro.parse_schema(schema))
+            if subject not in self._latest or int(version or 1) > self._latest[subject][0]:
+                self._latest[subject] = (int(version or 1), id)
+
+    def subjects(self) -> List[str]:
+        return list(self._latest)
+
+    def latest(self, subject: str) -> tuple[int, Any]:
+        "Returns the id and schema of the latest version. Raises KeyError for unknown subjects."
+        id = self._latest[subject][1]
+        return id, self._schemas[id][1]
+
+    def get(self, id: int) -> tuple[str, Any]:
+        "Returns the subject and schema of `id`. Raises KeyError for unknown ids."
+        return self._schemas[id]
+
+#### Formats ####
+
+def _encode_json(data: Any) -> bytes:
+    return json.dumps(data, separators=(',', ':')).encode()
+
+def _encode_msgpack(data: Any) -> bytes:
+    import msgpack
+    return msgpack.packb(data, use_bin_type=True)
+
+def _decode_msgpack(value: bytes) -> Any:
+    import msgpack
+    try:
+        return msgpack.unpackb(value, raw=False)
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack: {e}") from e
+
+class Serializers:
+    def __init__(self, conf: SerializerConf):
+        self._conf = conf
+        self._registry: SchemaRegistry | None = None
+        # Attributes left out of decoded Avro records, by schema id: those
+        # holding their default, so the events look as they would in JSON.
+        self._defaults: Dict[int, Dict[str, Any]] = {}
+
+    @property
+    def registry(self) -> SchemaRegistry:
+        if self._registry is None:
+            self._registry = SchemaRegistry(self._conf.schema_dir)
+        return self._registry
+
+    def format(self, topic: str) -> str:
+        return self._conf.topics.get(topic, self._conf.default)
+
+    def encode(self, topic: str, data: Any, format: str | None = None) -> bytes:
+        """Encodes `data` in the format of `topic`, or in `format` if given.
+
+        Raises KeyError if the format is avro and `topic` has no schema.
+        """
+        format = format or self.format(topic)
+        if format == 'msgpack':
+            return _encode_msgpack(data)
+        if format == 'avro':
+            return self._encode_avro(topic, data)
+        return _encode_json(data)
+
+    def decode(self, value: bytes) -> Any:
+        """Decodes a value in any of the formats. Raises ValueError if it is malformed."""
+        if value[:1] == _AVRO_MAGIC:
+            return self._decode_avro(value)
+        if value[:1] and value[0] in _MSGPACK_MAPS:
+            return _decode_msgpack(value)
+        return json.loads(value)
+
+    def _encode_avro(self, topic: str, data: Any) -> bytes:
+        import fastavro
+        id, schema = self.registry.latest(f"{topic}-value")
+        buffer = io.BytesIO()
+        buffer.write(_AVRO_MAGIC + id.to_bytes(4, 'big'))
+        fastavro.schemaless_writer(buffer, schema, data)
+        return buffer.getvalue()
+
+    def _decode_avro(self, value: bytes) -> Any:
+        import fastavro
+        id = int.from_bytes(value[1:5], 'big')
+        try:
+            subject, writer_schema = self.registry.get(id)
+            latest_id, reader_schema = self.registry.latest(subject)
+            record = fastavro.schemaless_reader(io.BytesIO(value[5:]), writer_schema,
+                                               reader_schema if latest_id != id else None)
+        except KeyError as e:
+            raise ValueError(f"Unknown Avro schema id {id}") from e
+        except Exception as e:
+            raise ValueError(f"Invalid Avro record: {e}") from e
+        if (defaults := self._defaults.get(latest_id)) is None:
+            defaults = self._defaults[latest_id] = {f['name']: f['default'] for f in reader_schema['fields']
+                                                    if 'default' in f}
+        return {k: v for k, v in record.items() if k not in defaults or v != defaults[k]}
+
+    def check(self, produced: Iterable[str] = ()) -> List[str]:
+        """Returns the problems that would make encoding fail: unknown formats,
+        missing libraries and topics without an Avro schema.
+
+        `produced` are the topics the service produces with their configured
+        format, all of which need a schema when avro is the default.
+        """
+        problems = []
+        formats = {self._conf.default, *self._conf.topics.values()}
+        if unknown := formats - set(FORMATS):
+            problems.append(f"unknown formats {', '.join(sorted(unknown))}, must be among {', '.join(FORMATS)}")
+        for format, module in (('msgpack', 'msgpack'), ('avro', 'fastavro')):
+            if format in formats:
+                try:
+                    __import__(module)
+                except ImportError:
+                    problems.append(f"{format} needs the {module} package")
+        avro_topics = [topic for topic in dict.fromkeys([*self._conf.topics, *produced])
+                       if self.format(topic) == 'avro']
+        if avro_topics or self._conf.default == 'avro':
+            try:
+                subjects = self.registry.subjects()
+            except (OSError, ValueError, ImportError) as e:
+                problems.append(f"cannot load Avro schemas from {self._conf.schema_dir}: {e}")
+            else:
+                if missing := [t for t in avro_topics if f"{t}-value" not in subjects]:
+                    problems.append(f"no Avro schema in {self._conf.schema_dir} for {', '.join(missing)}")
+        return problems
+
+#### Shared instance ####
+
+_serializers: Serializers | None = None
+
+def get() -> Serializers:
+    "Returns the serializers configured by the environment."
+    global _serializers
+    if _serializers is None:
+        _serializers = Serializers(env.get_kafka_serializer_conf())
+    return _serializers
+
+def encode(topic: str, data: Any, format: str | None = None) -> bytes:
+    return get().encode(topic, data, format)
+
+def decode(value: bytes) -> Any:
+    return get().decode(value)
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Measures what a fresh worker pays before it can serve: importing the app
+# (attributed per module with `python -X importtime`) and initialization. It
+# runs in a child interpreter, as nothing must be imported beforehand.
+
+_PROBE = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+phases = {}
+t = time.perf_counter()
+import app.routes
+phases['import app.routes'] = time.perf_counter() - t
+from app import graphql, init
+t = time.perf_counter()
+init.init()
+phases['init.init()'] = time.perf_counter() - t
+t = time.perf_counter()
+init.init()
+phases['init.init() again'] = time.perf_counter() - t
+t = time.perf_counter()
+graphql.get_app()
+phases['graphql.get_app()'] = time.perf_counter() - t
+print(json.dumps(phases))
+'''
+
+#### Parsing ####
+
+def _parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    "Parses `-X importtime` output into one entry per imported module."
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({'module': name.strip(),
+                        'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+                        'self_ms': int(self_us) / 1000,
+                        'cumulative_ms': int(cumulative_us) / 1000})
+    return modules
+
+def _by_package(modules: List[Dict[str, Any]]) -> Dict[str, float]:
+    packages: Dict[str, float] = {}
+    for m in modules:
+        package = m['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + m['self_ms']
+    return dict(sorted(packages.items(), key=lambda p: -p[1]))
+
+#### Profiling ####
+
+def profile() -> Dict[str, Any]:
+    """Imports and initializes the app in a child interpreter and returns timings.
+
+    Raises RuntimeError if the child fails.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE, root],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = _parse_importtime(result.stderr)
+    return {
+        'phases_ms': {name: seconds * 1000 for name, seconds in phases.items()},
+        'packages_ms': _by_package(modules),
+        'modules': sorted(modules, key=lambda m: -m['self_ms']),
+    }
+
+def format_report(profile: Dict[str, Any], top: int) -> str:
+    lines = ['Phases:']
+    lines += [f"  {ms:9.1f} ms  {name}" for name, ms in profile['phases_ms'].items()]
+    lines.append(f"Import time by package (self, top {top}):")
+    lines += [f"  {ms:9.1f} ms  {name}" for name, ms in list(profile['packages_ms'].items())[:top]]
+    lines.append(f"Slowest modules (self / cumulative, top {top}):")
+    lines += [f"  {m['self_ms']:9.1f} / {m['cumulative_ms']:9.1f} ms  {m['module']}"
+              for m in profile['modules'][:top]]
+    return '\n'.join(lines)
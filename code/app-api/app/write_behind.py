@@ -0,0 +1,152 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Any, Callable, Dict, Hashable
+import logging
+
+from . import delivery, env, serialization
+
+logger = logging.getLogger(__name__)
+
+# Write-behind for the collections listed in WRITE_BEHIND. Their mutations
+# are produced as events to the topic named after the collection, keyed by
+# id, and return once Kafka has acknowledged them; ingest-api's consumer
+# writes them to Couchbase afterwards. The events are the ones ingest-api
+# produces, see its entities.py.
+#
+# Until the consumer has caught up, Couchbase does not have these writes yet,
+# so db.py overlays them on what it reads: each worker's own writes as soon
+# as they are acknowledged, everyone else's as events.py consumes them. An
+# entry expires WRITE_BEHIND_OVERLAY_TTL seconds after the write, by which
+# time the consumer is expected to have written it. At most
+# WRITE_BEHIND_OVERLAY_MAX_SIZE entries are kept per collection, bounding the
+# memory the bodies inlined in the events take in every worker.
+
+#### Overlay ####
+
+class Overlay:
+    """Recent writes to one collection, by id: the object, or None if removed.
+
+    Holds at most `max_size` entries, dropping the oldest beyond that; reads
+    miss a dropped write until the consumer has stored it. `index` maps
+    objects to a secondary key for find(). Only used from the event loop.
+    """
+
+    def __init__(self, ttl_s: float, max_size: int, index: Callable[[Any], Hashable] | None = None):
+        self._ttl_s = ttl_s
+        self._max_size = max_size
+        self._index = index
+        # Insertion order is expiry order, as every entry lives for the same time.
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        # Index key -> ids of the entries with that key, oldest first.
+        self._ids_by_key: Dict[Hashable, Dict[str, None]] = {}
+        self.stats = {'writes': 0, 'hits': 0, 'expired': 0, 'evicted': 0}
+
+    def _unindex(self, id: str, value: Any) -> None:
+        if self._index is None or value is None:
+            return
+        key = self._index(value)
+        if (ids := self._ids_by_key.get(key)) is not None:
+            ids.pop(id, None)
+            if not ids:
+                del self._ids_by_key[key]
+
+    def _drop_oldest(self, stat: str) -> None:
+        id, (value, _) = self._entries.popitem(last=False)
+        self._unindex(id, value)
+        self.stats[stat] += 1
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries and next(iter(self._entries.values()))[1] <= now:
+            self._drop_oldest('expired')
+
+    def put(self, id: str, value: Any) -> None:
+        if (previous := self._entries.pop(id, None)) is not None:
+            self._unindex(id, previous[0])
+        self._entries[id] = (value, time.monotonic() + self._ttl_s)
+        if self._index is not None and value is not None:
+            self._ids_by_key.setdefault(self._index(value), {})[id] = None
+        while len(self._entries) > self._max_size:
+            self._drop_oldest('evicted')
+        self.stats['writes'] += 1
+
+    def get(self, id: str) -> tuple[bool, Any]:
+        "Returns (found, value)."
+        self._expire()
+        if (entry := self._entries.get(id)) is None:
+            return False, None
+        self.stats['hits'] += 1
+        return True, entry[0]
+
+    def find(self, key: Hashable) -> Any:
+        "Returns the latest object whose index key is `key`, or None."
+        self._expire()
+        if not (ids := self._ids_by_key.get(key)):
+            return None
+        self.stats['hits'] += 1
+        return self._entries[next(reversed(ids))][0]
+
+    def items(self) -> list[tuple[str, Any]]:
+        self._expire()
+        return [(id, value) for id, (value, _) in self._entries.items()]
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._entries)
+
+# Secondary keys db.py looks objects up by, per collection.
+_INDEXES: Dict[str, Callable[[Any], Hashable]] = {
+    'signatures': lambda signature: signature.document_id,
+}
+
+#### Producer ####
+
+_overlays: Dict[str, Overlay] = {}
+_producer: delivery.AsyncProducer | None = None
+
+def enabled(collection: str) -> bool:
+    return collection in _overlays
+
+def overlay(collection: str) -> Overlay | None:
+    "Returns the overlay of `collection`, or None if it is written synchronously."
+    return _overlays.get(collection)
+
+async def produce(collection: str, events: list[dict]) -> list[Exception | None]:
+    """Produces the events and returns None or the DeliveryError per event.
+
+    Events are all handed to the producer before waiting for any ack, so a
+    batch goes out in as few requests as librdkafka can manage.
+    """
+    futures = [await _producer.enqueue(collection, serialization.encode(collection, event), key=event['id'])
+               for event in events]
+    acks = await asyncio.gather(*futures, return_exceptions=True)
+    return [ack if isinstance(ack, Exception) else None for ack in acks]
+
+async def start() -> None:
+    """Starts the producer if any collection is written behind. Must be called from the event loop."""
+    global _producer
+    for collection in env.get_write_behind():
+        _overlays[collection] = Overlay(env.get_write_behind_overlay_ttl(), env.get_write_behind_overlay_max_size(),
+                                        _INDEXES.get(collection))
+    if not _overlays:
+        return
+    # The event is the only copy of the write until the consumer has stored
+    # it, so it must be on every in-sync replica before the mutation returns.
+    _producer = delivery.AsyncProducer(env.get_kafka_broker(), delivery.Durability.ALL,
+                                       env.get_kafka_linger_ms(), env.get_kafka_batch_size(),
+                                       env.get_kafka_compression())
+    _producer.start()
+    await _producer.connect()
+    logger.info(f"Writing {', '.join(_overlays)} behind through Kafka")
+
+async def stop() -> None:
+    if _producer is not None:
+        await _producer.stop()
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    stats = {f"overlay.{collection}": dict(overlay.stats, size=len(overlay))
+             for collection, overlay in _overlays.items()}
+    if _producer is not None:
+        stats['producer'] = _producer.get_stats()
+    return stats
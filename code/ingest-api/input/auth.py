@@ -1,10 +1,15 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
 import jwt
-from jwt import PyJWKClient
+from jwt import PyJWK, PyJWKClient
 import logging
 from ssl import SSLContext, CERT_NONE, PROTOCOL_TLS_CLIENT
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional
 
-from . import env
+from . import env, metrics
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +17,21 @@ logger = logging.getLogger(__name__)
 
 _SUPPORTED_JWT_ALGORITHMS = ['RS256', 'ES256', 'EdDSA']
 
-#### Decoding ####
+# Minimum time between JWKS fetches made on the request path, e.g. for tokens
+# with an unknown `kid` or while the JWKS endpoint is unreachable.
+_MIN_REFRESH_INTERVAL_S = 10
+
+# Upper bound on how long verified claims are cached for tokens without `exp`.
+_MAX_TOKEN_CACHE_TTL_S = 300
+
+#### Metrics ####
+
+_jwks_fetch_duration = metrics.histogram('auth_jwks_fetch_duration_seconds', "Time to fetch the JWKS, by outcome.",
+                                         ('result',))
+_jwt_verify_duration = metrics.histogram('auth_jwt_verify_duration_seconds',
+                                         "Time to verify a JWT, by outcome (cached, valid or invalid).", ('result',))
+
+#### Key store ####
 
 def get_jwk_client():
     "Builds a JWK client."
@@ -20,13 +39,172 @@ def get_jwk_client():
     ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
     ssl_context.check_hostname = False
     ssl_context.verify_mode = CERT_NONE
-    return PyJWKClient(env.get_auth_oidc_jwk_url(), ssl_context=ssl_context)
+    return PyJWKClient(env.get_auth_oidc_jwk_url(), cache_jwk_set=False, ssl_context=ssl_context)
 
-def decode_jwt(token: str) -> Optional[dict]:
-    "Decodes a JWT using the configures JWKS URL and audience."
+class _KeysRefreshing(Exception):
+    "The token's `kid` is unknown, but the JWKS is being fetched and may have it."
+
+class KeyStore:
+    """Process-wide cache of JWKS signing keys by `kid`.
+
+    Keys are fetched once and kept for `ttl_s`, refreshed by a background task,
+    and re-fetched on demand (rate limited) once they expire or a token names
+    an unknown `kid`. Lookups run on the event loop, so on-demand fetches run
+    in a thread of their own and lookups never wait for them: expired keys are
+    served until the fetch completes.
+    """
+
+    def __init__(self, client: PyJWKClient, ttl_s: int):
+        self._client = client
+        self._ttl_s = ttl_s
+        self._keys: Dict[str, PyJWK] = {}
+        self._fetched_at: float | None = None
+        self._last_attempt_at: float | None = None
+        self._refreshing = False
+        # Guards the keys and the on-demand fetch state; never held while fetching.
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'fetch_failures': 0}
+
+    def refresh(self) -> None:
+        """Fetches the JWKS, keeping the previous keys if the fetch fails."""
+        keys = self._fetch()
+        with self._lock:
+            self._store(keys)
+
+    def _fetch(self) -> Dict[str, PyJWK] | None:
+        self.stats['fetches'] += 1
+        started = time.perf_counter()
+        try:
+            keys = {key.key_id: key for key in self._client.get_signing_keys(refresh=True)}
+            _jwks_fetch_duration.observe(time.perf_counter() - started, 'ok')
+            return keys
+        except jwt.PyJWKClientError:
+            _jwks_fetch_duration.observe(time.perf_counter() - started, 'error')
+            self.stats['fetch_failures'] += 1
+            logger.exception("Failed to fetch JWKS")
+
+    def _store(self, keys: Dict[str, PyJWK] | None) -> None:
+        if keys is not None:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _start_refresh(self, now: float) -> None:
+        "Starts an on-demand fetch, unless one is running or started recently. Called with the lock held."
+        if self._refreshing or (self._last_attempt_at is not None
+                                and now - self._last_attempt_at < _MIN_REFRESH_INTERVAL_S):
+            return
+        self._refreshing = True
+        self._last_attempt_at = now
+        threading.Thread(target=self._refresh_in_background, name='jwks-refresh', daemon=True).start()
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        with self._lock:
+            now = time.monotonic()
+            if self._fetched_at is None or now - self._fetched_at > self._ttl_s:
+                self._start_refresh(now)
+            if key := self._keys.get(kid):
+                self.stats['hits'] += 1
+                return key
+            self.stats['misses'] += 1
+            self._start_refresh(now)
+            if self._refreshing:
+                raise _KeysRefreshing(kid)
+        raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+
+    def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        return self.get_signing_key(jwt.get_unverified_header(token).get('kid'))
+
+    async def run_refresher(self) -> None:
+        """Refreshes the keys in the background, halfway through each TTL."""
+        while True:
+            await asyncio.sleep(self._ttl_s / 2)
+            await asyncio.to_thread(self.refresh)
+
+_key_store: KeyStore | None = None
+
+def get_key_store() -> KeyStore:
+    "Returns the process-wide key store, creating it on first use."
+    global _key_store
+    if _key_store is None:
+        _key_store = KeyStore(get_jwk_client(), env.get_auth_oidc_jwks_ttl())
+    return _key_store
+
+def get_key_store_stats() -> Dict[str, int]:
+    return dict(get_key_store().stats)
+
+async def start_key_refresh() -> asyncio.Task:
+    "Fetches the JWKS and starts refreshing it in the background."
+    key_store = get_key_store()
+    await asyncio.to_thread(key_store.refresh)
+    return asyncio.create_task(key_store.run_refresher())
+
+#### Token cache ####
+
+class TokenCache:
+    """Bounded LRU of verification results keyed by token hash.
+
+    Verified claims are kept until the token's `exp` (capped at five minutes);
+    failed verifications are kept for `negative_ttl_s` so repeated bad tokens
+    are rejected cheaply.
+    """
+
+    def __init__(self, max_size: int, negative_ttl_s: int):
+        self._max_size = max_size
+        self._negative_ttl_s = negative_ttl_s
+        self._entries: OrderedDict[bytes, tuple[dict | None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: bytes) -> tuple[bool, dict | None]:
+        "Returns (found, claims); claims is None for a cached failure."
+        with self._lock:
+            if entry := self._entries.get(key):
+                claims, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return True, claims
+                del self._entries[key]
+            self.stats['misses'] += 1
+            return False, None
+
+    def put(self, key: bytes, claims: dict | None) -> None:
+        now = time.time()
+        if claims is None:
+            expires_at = now + self._negative_ttl_s
+        else:
+            expires_at = min(claims.get('exp', now + _MAX_TOKEN_CACHE_TTL_S), now + _MAX_TOKEN_CACHE_TTL_S)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+_token_cache: TokenCache | None = None
+
+def get_token_cache() -> TokenCache:
+    "Returns the process-wide token cache, creating it on first use."
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(env.get_auth_token_cache_size(), env.get_auth_token_cache_negative_ttl())
+    return _token_cache
+
+def get_token_cache_stats() -> Dict[str, int]:
+    return dict(get_token_cache().stats)
+
+#### Decoding ####
+
+def _decode_jwt(token: str) -> Optional[dict]:
     try:
-        client = get_jwk_client()
-        signing_key = client.get_signing_key_from_jwt(token)
+        signing_key = get_key_store().get_signing_key_from_jwt(token)
         result = jwt.decode(token,
                             signing_key.key,
                             algorithms=_SUPPORTED_JWT_ALGORITHMS,
@@ -36,3 +214,21 @@ def decode_jwt(token: str) -> Optional[dict]:
     except jwt.PyJWTError:
         logger.exception("Failed to decode JWT")
         pass
+
+def decode_jwt(token: str) -> Optional[dict]:
+    "Decodes a JWT using the configures JWKS URL and audience."
+    started = time.perf_counter()
+    key = hashlib.sha256(token.encode()).digest()
+    cache = get_token_cache()
+    found, claims = cache.get(key)
+    if not found:
+        try:
+            claims = _decode_jwt(token)
+            cache.put(key, claims)
+        except _KeysRefreshing:
+            # Rejected but not cached, so the token passes once the keys are in.
+            logger.warning("Rejected a JWT whose key is still being fetched")
+            claims = None
+    result = 'cached' if found else 'valid' if claims is not None else 'invalid'
+    _jwt_verify_duration.observe(time.perf_counter() - started, result)
+    return claims
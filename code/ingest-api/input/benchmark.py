@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+import logging
+
+from pydantic import BaseModel, Field
+import zstandard
+
+from . import delivery, entities, env, loadgen, serialization, standins
+
+logger = logging.getLogger(__name__)
+
+# Benchmarks the real app in-process against local stand-ins for the JWKS
+# endpoint and Kafka (see standins.py). Each scenario warms up, then runs a
+# timed pass at the configured concurrency and a sequential allocation pass.
+# The serialize_* scenarios instead time serialization.py on its own.
+
+class BenchmarkConf(BaseModel):
+    requests: int = Field(1000, gt=0)
+    concurrency: int = Field(32, gt=0)
+    warmup_requests: int = Field(20, ge=0)
+    allocation_requests: int = Field(50, ge=0)
+    ack_latency_ms: float = Field(2.0, ge=0)
+    bursts: int = Field(5, gt=0)
+
+class BenchmarkError(Exception):
+    pass
+
+_AUDIENCE = 'benchmark'
+
+# Size of the body chunks a burst is streamed in.
+_CHUNK_SIZE = 64 * 1024
+
+class _Harness:
+    def __init__(self, conf: BenchmarkConf, client: loadgen.AsgiClient, kafka: standins.Kafka,
+                 jwks: standins.JwksServer):
+        self.conf = conf
+        self.client = client
+        self.kafka = kafka
+        self.jwks = jwks
+
+    async def post(self, path: str, body: Any, headers: Dict[str, str]) -> Any:
+        status, data = await self.client.post_json(path, body, headers)
+        if status != 200:
+            raise BenchmarkError(f"POST {path} failed with {status}: {data}")
+        return data
+
+    async def measure(self, request: Callable[[int], Awaitable[Any]], requests: int | None = None,
+                      concurrency: int | None = None, warmup_requests: int | None = None,
+                      allocation_requests: int | None = None) -> Dict[str, Any]:
+        for index in range(self.conf.warmup_requests if warmup_requests is None else warmup_requests):
+            await request(index)
+        result = await loadgen.run_load(request, requests or self.conf.requests,
+                                        concurrency or self.conf.concurrency)
+        result['allocations'] = await loadgen.measure_allocations(
+            request, self.conf.allocation_requests if allocation_requests is None else allocation_requests)
+        return result
+
+#### Scenarios ####
+
+async def _add_product(h: _Harness) -> Dict[str, Any]:
+    """Single products, each waiting for its ack, all with the same token."""
+    headers = {'authorization': f"Bearer {h.jwks.issue_token('benchmark-user')}"}
+
+    async def request(index: int) -> None:
+        await h.post('/input/add_product', {'name': f"Product {index}"}, headers)
+
+    return await h.measure(request)
+
+async def _auth_distinct(h: _Harness) -> Dict[str, Any]:
+    """Single products, each carrying a token the app has not seen."""
+    count = h.conf.warmup_requests + h.conf.requests + h.conf.allocation_requests
+    tokens = iter([h.jwks.issue_token(f"benchmark-user-{i}") for i in range(count)])
+
+    async def request(index: int) -> None:
+        await h.post('/input/add_product', {'name': f"Product {index}"}, {'authorization': f"Bearer {next(tokens)}"})
+
+    return await h.measure(request)
+
+def _burst(records: int) -> Callable[[_Harness], Awaitable[Dict[str, Any]]]:
+    """`bursts` NDJSON bulk requests of `records` products each, one at a time."""
+    async def scenario(h: _Harness) -> Dict[str, Any]:
+        headers = {'authorization': f"Bearer {h.jwks.issue_token('benchmark-user')}",
+                   'content-type': 'application/x-ndjson'}
+        body = b''.join(json.dumps({'name': f"Product {i}"}).encode() + b'\n' for i in range(records))
+
+        async def chunks() -> AsyncIterator[bytes]:
+            for start in range(0, len(body), _CHUNK_SIZE):
+                yield body[start:start + _CHUNK_SIZE]
+
+        async def request(index: int) -> None:
+            status, response = await h.client.request('POST', '/input/add_products', chunks(), headers)
+            summary = json.loads(response).get('summary', {})
+            if status != 200 or summary.get('accepted') != records:
+                raise BenchmarkError(f"Burst failed with {status}: {summary}")
+
+        result = await h.measure(request, requests=h.conf.bursts, concurrency=1, warmup_requests=1,
+                                 allocation_requests=1)
+        return {**result, 'records_per_request': records,
+                'records_per_s': round((result['requests'] - result['errors']) * records / result['duration_s'], 1)}
+    return scenario
+
+# Passes over the sample events per timing, to get above timer noise.
+_SERIALIZATION_ROUNDS = 20
+
+def _sample_events(count: int) -> List[tuple[str, Dict[str, Any]]]:
+    """`count` events cycling through the entity topics, with bodies of about 1 KiB."""
+    def inputs(i: int) -> List[tuple[str, Any]]:
+        body = f"Clause {i}: the parties agree to the terms set out in schedule {i % 7}. " * 14
+        return [
+            ('products', entities.ProductInput(name=f"Product {i}")),
+            ('documents', entities.DocumentInput(name=f"Document {i}", content=body, first_name='Ada',
+                                                 last_name='Lovelace', email='ada@example.com')),
+            ('signatures', entities.SignatureInput(document_id=f"document-{i}", signed_by_email='ada@example.com',
+                                                   signed_content=f"Signed: {body[:200]}")),
+            ('fields', entities.FieldInput(name=f"Field {i}", type='text')),
+            ('templates', entities.TemplateInput(name=f"Template {i}", template=f"Dear {{name}}, {i}",
+                                                 field_ids=[f"field-{i}", f"field-{i + 1}"])),
+        ]
+    return [(topic, entities.event(topic, input))
+            for i in range(count) for topic, input in [inputs(i)[i % len(entities.TOPICS)]]]
+
+def _serialize(format: str) -> Callable[[_Harness], Awaitable[Dict[str, Any]]]:
+    """Encodes and decodes `requests` events in `format`.
+
+    Reports bytes per event, by topic and overall, and after zstd
+    compression of the whole set as a stand-in for batch compression.
+    """
+    async def scenario(h: _Harness) -> Dict[str, Any]:
+        events = _sample_events(h.conf.requests)
+        serializers = serialization.Serializers(
+            serialization.SerializerConf(default=format, schema_dir=env.get_kafka_schema_dir()))
+        encoded = [serializers.encode(topic, event) for topic, event in events]
+        if any(serializers.decode(value) != event for value, (_, event) in zip(encoded, events)):
+            raise BenchmarkError(f"{format} does not round-trip events")
+
+        started = time.perf_counter()
+        for _ in range(_SERIALIZATION_ROUNDS):
+            for topic, event in events:
+                serializers.encode(topic, event)
+        encode_s = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(_SERIALIZATION_ROUNDS):
+            for value in encoded:
+                serializers.decode(value)
+        decode_s = time.perf_counter() - started
+
+        count = len(events) * _SERIALIZATION_ROUNDS
+        sizes: Dict[str, List[int]] = {}
+        for (topic, _), value in zip(events, encoded):
+            sizes.setdefault(topic, []).append(len(value))
+        total = sum(len(value) for value in encoded)
+        return {'format': format, 'events': len(events),
+                'bytes_per_event': {**{topic: round(sum(s) / len(s), 1) for topic, s in sizes.items()},
+                                    'all': round(total / len(events), 1)},
+                'zstd_bytes_per_event': round(len(zstandard.ZstdCompressor().compress(b''.join(encoded))) / len(events), 1),
+                'encode_events_per_s': round(count / encode_s),
+                'decode_events_per_s': round(count / decode_s),
+                'throughput_rps': round(count / (encode_s + decode_s), 3)}
+    return scenario
+
+SCENARIOS: Dict[str, Callable[[_Harness], Awaitable[Dict[str, Any]]]] = {
+    'add_product': _add_product,
+    'auth_distinct': _auth_distinct,
+    'bulk_burst_1k': _burst(1000),
+    'bulk_burst_100k': _burst(100000),
+    **{f"serialize_{format}": _serialize(format) for format in serialization.FORMATS},
+}
+
+#### Running ####
+
+def _configure_environment(jwks: standins.JwksServer) -> None:
+    os.environ.update({
+        'AUTH_OIDC_AUDIENCE': _AUDIENCE,
+        'AUTH_OIDC_JWK_URL': jwks.url,
+        'HTTP_PORT': os.environ.get('HTTP_PORT') or '8080',
+        'KAFKA_BROKER': 'standin:9092',
+        'COUCHBASE_USERNAME': 'benchmark',
+        'COUCHBASE_PASSWORD': 'benchmark',
+    })
+    # Features that need real infrastructure or would skew the numbers.
+    for name in ('METRICS_DIR', 'HTTP_GRAPHQL_PERSISTED_QUERY_ALLOWLIST',
+                 'RATE_LIMIT_USER_RATE', 'RATE_LIMIT_IP_RATE', 'ADMISSION_MAX_IN_FLIGHT', 'ADMISSION_MAX_LOOP_LAG'):
+        os.environ.pop(name, None)
+
+async def _run(conf: BenchmarkConf, scenarios: List[str]) -> Dict[str, Any]:
+    jwks = standins.JwksServer(_AUDIENCE)
+    jwks.start()
+    try:
+        _configure_environment(jwks)
+        kafka = standins.Kafka(conf.ack_latency_ms / 1000)
+        kafka.install(delivery)
+        # Imported last: building the app reads the environment set above.
+        from . import routes
+        results = {}
+        async with loadgen.lifespan(routes.app):
+            harness = _Harness(conf, loadgen.AsgiClient(routes.app), kafka, jwks)
+            for name in scenarios:
+                logger.info(f"Running benchmark {name}")
+                results[name] = await SCENARIOS[name](harness)
+        return loadgen.report('ingest-api', conf.model_dump(), results)
+    finally:
+        jwks.stop()
+
+def run(conf: BenchmarkConf, scenarios: List[str]) -> Dict[str, Any]:
+    """Runs the named scenarios and returns the report.
+
+    Replaces the Kafka client for the rest of the process, so it must run in
+    a process of its own.
+    """
+    return asyncio.run(_run(conf, scenarios))
@@ -0,0 +1,116 @@
+import codecs
+import json
+from typing import Any, AsyncIterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+#### Types ####
+
+class ParseError(Exception):
+    "A record that could not be parsed. Parsing continues after it when possible."
+    pass
+
+class StreamError(Exception):
+    "A malformed stream that cannot be parsed any further."
+    pass
+
+#### Parsing ####
+
+_WHITESPACE = ' \t\r\n'
+
+# Upper bound on a single record, so a malformed stream can't grow the buffer
+# without limit.
+MAX_RECORD_SIZE = 1 << 20
+
+# Longest text at the end of the buffer that more data may still turn into a
+# valid token, e.g. a truncated `-Infinity`, `1e-` or `\uXXXX` escape.
+_MAX_PARTIAL_TOKEN = 16
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Yields one value per non-empty line, or a ParseError for a bad line."""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+        if len(buffer) > MAX_RECORD_SIZE:
+            raise StreamError(f"Record exceeds {MAX_RECORD_SIZE} bytes.")
+    if buffer.strip():
+        yield _parse_line(buffer)
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ParseError(str(e))
+
+def _incomplete(error: json.JSONDecodeError, buffer: str) -> bool:
+    "Whether the value that failed to parse may just not have fully arrived."
+    return error.msg.startswith('Unterminated string') or len(buffer) - error.pos <= _MAX_PARTIAL_TOKEN
+
+def _partial_number(value: Any, buffer: str, end: int) -> bool:
+    "Whether a number parsed at the end of the buffer may continue, e.g. `1.` before `5`."
+    return isinstance(value, (int, float)) and len(buffer) - end <= _MAX_PARTIAL_TOKEN \
+        and not buffer[end:].lstrip(_WHITESPACE).startswith((',', ']'))
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Yields the elements of a top-level JSON array as they arrive.
+
+    Only the unparsed tail of the body is kept in memory. Raises StreamError
+    as soon as the body is not a well-formed array, naming the element.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    state = 'start'  # start -> value -> separator -> value ... -> end
+    index = 0
+    async for chunk in chunks:
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+            if state == 'start':
+                if buffer[pos] != '[':
+                    raise StreamError("Expected a JSON array.")
+                pos += 1
+                state = 'first'
+            elif state in ('first', 'value'):
+                if state == 'first' and buffer[pos] == ']':
+                    pos += 1
+                    state = 'end'
+                    continue
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if not _incomplete(e, buffer):
+                        raise StreamError(f"Record {index} is malformed: {e}")
+                    value, end = None, len(buffer)
+                if end == len(buffer) or _partial_number(value, buffer, end):
+                    # The value may continue in the next chunk (a valid array
+                    # always has a `,` or `]` after it), so wait for more.
+                    if len(buffer) - pos > MAX_RECORD_SIZE:
+                        raise StreamError(f"Record {index} exceeds {MAX_RECORD_SIZE} bytes.")
+                    break
+                pos = end
+                state = 'separator'
+                index += 1
+                yield value
+            elif state == 'separator':
+                if buffer[pos] == ',':
+                    state = 'value'
+                elif buffer[pos] == ']':
+                    state = 'end'
+                else:
+                    raise StreamError(f"Unexpected {buffer[pos]!r} after record {index - 1}.")
+                pos += 1
+            else:
+                raise StreamError("Unexpected data after the end of the array.")
+    if state != 'end':
+        raise StreamError(f"Truncated or malformed JSON array at record {index}.")
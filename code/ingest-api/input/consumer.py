@@ -0,0 +1,231 @@
+import threading
+import time
+from typing import Any, Dict, List, Literal
+import logging
+
+from confluent_kafka import Consumer, KafkaError, KafkaException, Message, TopicPartition
+from couchbase.durability import DurabilityLevel
+from couchbase.exceptions import CouchbaseException, DocumentNotFoundException
+from pydantic import BaseModel, Field
+import zstandard
+
+from . import couchbase as cb, entities, serialization
+
+logger = logging.getLogger(__name__)
+
+# Materializes the entity topics (see entities.py) into the Couchbase
+# collections of the same names. Messages are read in batches, written with
+# one bulk KV operation per collection and kind of write, and their offsets
+# committed only once every write in the batch has succeeded, so a crash
+# replays a batch rather than losing it. Entities are keyed by id and bodies
+# by checksum, which makes the replay idempotent. Instances sharing a
+# consumer group split the topics' partitions between them.
+
+# Bodies sent inline are stored the way blobs.py stores a body that fits in
+# one chunk, which every body up to blobs.MAX_EVENT_BODY_SIZE does. Larger
+# bodies are stored before their event is produced, which then carries only
+# the checksum.
+BLOBS = 'blobs'
+_BLOB_INLINE = b'z'
+_BLOB_COMPRESSION_LEVEL = 3
+
+# Stored attributes every entity must have, as app-api's db.py reads them.
+_ATTRIBUTES = {
+    'products': ('name',),
+    'documents': ('name', 'checksum', 'first_name', 'last_name', 'email'),
+    'signatures': ('document_id', 'signed_by_email', 'signed_checksum', 'signed_ts'),
+    'fields': ('name', 'type'),
+    'templates': ('name', 'template', 'field_ids'),
+}
+
+# A batch that still has failed writes after this many attempts stops the
+# consumer with its offsets uncommitted, as the Kafka Connect sink did.
+_MAX_WRITE_ATTEMPTS = 5
+_RETRY_BACKOFF_S = 0.5
+
+class ConsumerConf(BaseModel):
+    broker: str
+    group: str
+    bucket: str
+    topics: List[str] = list(entities.TOPICS)
+    batch_size: int = Field(1000, gt=0)
+    batch_timeout_s: float = Field(0.5, gt=0)
+    durability: Literal['none', 'majority', 'majority_and_persist_to_active', 'persist_to_majority'] = 'none'
+
+class WriteError(Exception):
+    pass
+
+# (collection, key) -> value to upsert, or None to remove.
+Writes = Dict[tuple[str, str], Any]
+
+#### Batches ####
+
+def _blob(content: str) -> tuple[str, bytes]:
+    "Returns the checksum and blob store value of a body."
+    return (entities.checksum(content),
+            _BLOB_INLINE + zstandard.ZstdCompressor(level=_BLOB_COMPRESSION_LEVEL).compress(content.encode()))
+
+def _writes(topic: str, event: Dict[str, Any]) -> Writes:
+    """Returns the writes an event stands for.
+
+    Raises KeyError or TypeError if the event is malformed.
+    """
+    id = str(event['id'])
+    if event.get('deleted'):
+        return {(topic, id): None}
+    writes = {}
+    doc = {k: v for k, v in event.items() if k != 'id'}
+    if (body := entities.BODIES.get(topic)) and body[0] in doc:
+        checksum, value = _blob(doc.pop(body[0]))
+        doc[body[1]] = checksum
+        writes[(BLOBS, checksum)] = value
+    if missing := [a for a in _ATTRIBUTES[topic] if a not in doc]:
+        raise KeyError(', '.join(missing))
+    writes[(topic, id)] = doc
+    return writes
+
+def _parse(message: Message) -> Writes | None:
+    try:
+        return _writes(message.topic(), serialization.decode(message.value()))
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error("Skipping malformed event at %s[%d]@%d: %r",
+                     message.topic(), message.partition(), message.offset(), e)
+        return None
+
+def _offsets(messages: List[Message]) -> List[TopicPartition]:
+    "Offsets to commit: one past the last message of each partition."
+    last: Dict[tuple[str, int], int] = {}
+    for message in messages:
+        key = (message.topic(), message.partition())
+        last[key] = max(last.get(key, -1), message.offset())
+    return [TopicPartition(topic, partition, offset + 1) for (topic, partition), offset in last.items()]
+
+#### Sink ####
+
+class EntitySink:
+    def __init__(self, conf: ConsumerConf, couchbase_conf: cb.ConnectionConf):
+        self._conf = conf
+        self._couchbase_conf = couchbase_conf
+        self._durability = DurabilityLevel[conf.durability.upper()]
+        self._consumer = Consumer({
+            'bootstrap.servers': conf.broker,
+            'group.id': conf.group,
+            'enable.auto.commit': False,
+            # A new group materializes the whole topics, as the connector did.
+            'auto.offset.reset': 'earliest',
+            # Only moved partitions pause on a rebalance, not the whole group.
+            'partition.assignment.strategy': 'cooperative-sticky',
+        })
+        self._running = threading.Event()
+        self.stats = {'batches': 0, 'messages': 0, 'written': 0, 'removed': 0, 'skipped': 0, 'retries': 0}
+
+    def _failed(self, op: str, keys: List[tuple[str, str]], results: List[Any],
+                ignore: tuple[type, ...] = ()) -> List[tuple[str, str]]:
+        failed = [(key, r) for key, r in zip(keys, results) if isinstance(r, Exception) and not isinstance(r, ignore)]
+        if failed:
+            logger.warning(f"{len(failed)} of {len(keys)} {op}s failed, e.g. {failed[0][0]}: {failed[0][1]!r}")
+        return [key for key, _ in failed]
+
+    def _upsert(self, writes: Writes) -> Writes:
+        "Upserts the writes and returns those that failed."
+        if not writes:
+            return {}
+        specs = [cb.DocSpec(bucket=self._conf.bucket, collection=collection, key=key, data=value,
+                            binary=collection == BLOBS)
+                 for (collection, key), value in writes.items()]
+        try:
+            results = cb.upsert_multi(self._couchbase_conf, specs, self._durability)
+        except CouchbaseException as e:
+            logger.warning(f"Bulk upsert failed: {e}")
+            return writes
+        return {key: writes[key] for key in self._failed('upsert', list(writes), results)}
+
+    def _remove(self, keys: List[tuple[str, str]]) -> Writes:
+        "Removes the keys and returns those that failed. Already missing keys count as removed."
+        if not keys:
+            return {}
+        refs = [cb.DocRef(bucket=self._conf.bucket, collection=collection, key=key) for collection, key in keys]
+        try:
+            results = cb.remove_multi(self._couchbase_conf, refs)
+        except CouchbaseException as e:
+            logger.warning(f"Bulk remove failed: {e}")
+            return dict.fromkeys(keys)
+        return dict.fromkeys(self._failed('remove', keys, results, (DocumentNotFoundException,)))
+
+    def _apply(self, writes: Writes) -> Writes:
+        """Applies the writes and returns those that failed.
+
+        Bodies go first, so that no stored entity points at a missing one.
+        """
+        blobs = {key: value for key, value in writes.items() if key[0] == BLOBS}
+        if failed := self._upsert(blobs):
+            return {key: value for key, value in writes.items() if key[0] != BLOBS or key in failed}
+        return {**self._upsert({key: value for key, value in writes.items() if key[0] != BLOBS and value is not None}),
+                **self._remove([key for key, value in writes.items() if value is None])}
+
+    def _write(self, writes: Writes) -> None:
+        """Applies the writes, retrying failed ones with backoff.
+
+        Raises WriteError if some are still failing after the last attempt.
+        """
+        for attempt in range(_MAX_WRITE_ATTEMPTS):
+            if attempt:
+                self.stats['retries'] += 1
+                time.sleep(_RETRY_BACKOFF_S * 2 ** (attempt - 1))
+            if not (writes := self._apply(writes)):
+                return
+        raise WriteError(f"{len(writes)} writes could not be applied")
+
+    def _process(self, messages: List[Message]) -> None:
+        consumed = []
+        writes: Writes = {}
+        for message in messages:
+            if message.error():
+                if message.error().code() != KafkaError._PARTITION_EOF:
+                    logger.error(f"Kafka error on {message.topic()}: {message.error()}")
+                continue
+            consumed.append(message)
+            if (parsed := _parse(message)) is not None:
+                # A later event for the same entity supersedes an earlier one.
+                writes.update(parsed)
+            else:
+                self.stats['skipped'] += 1
+        if writes:
+            self._write(writes)
+        if consumed:
+            try:
+                self._consumer.commit(offsets=_offsets(consumed), asynchronous=False)
+            except KafkaException as e:
+                # Typically a rebalance; the new owner rewrites the batch.
+                logger.warning(f"Failed to commit offsets: {e}")
+        removed = sum(1 for value in writes.values() if value is None)
+        self.stats['batches'] += 1
+        self.stats['messages'] += len(consumed)
+        self.stats['written'] += len(writes) - removed
+        self.stats['removed'] += removed
+        logger.debug("Applied %d writes from %d messages", len(writes), len(consumed))
+
+    def run(self) -> None:
+        """Consumes until stop() is called.
+
+        Raises WriteError, leaving the batch's offsets uncommitted, if a batch
+        cannot be written.
+        """
+        self._running.set()
+        self._consumer.subscribe(
+            self._conf.topics,
+            on_assign=lambda consumer, partitions: logger.info(f"Assigned {[(p.topic, p.partition) for p in partitions]}"),
+            on_revoke=lambda consumer, partitions: logger.info(f"Revoked {[(p.topic, p.partition) for p in partitions]}"),
+        )
+        logger.info(f"Consuming {', '.join(self._conf.topics)} into {self._conf.bucket} as {self._conf.group}")
+        try:
+            while self._running.is_set():
+                if messages := self._consumer.consume(self._conf.batch_size, self._conf.batch_timeout_s):
+                    self._process(messages)
+        finally:
+            self._consumer.close()
+            logger.info(f"Stopped consuming: {self.stats}")
+
+    def stop(self) -> None:
+        """Makes run() return after the batch in progress. Safe to call from a signal handler."""
+        self._running.clear()
@@ -0,0 +1,87 @@
+import datetime
+import hashlib
+from typing import Any, Dict, List
+import uuid
+
+from pydantic import BaseModel
+
+# The events written for each entity of app-api's db.py, by this service and
+# by app-api in write-behind mode, and materialized by consumer.py. Each
+# entity has a topic named after its collection, keyed by id so that all
+# events for one id land on one partition, in order. Values are JSON objects
+# holding the entity's `id` and stored attributes; a removal is
+# {"id": ..., "deleted": true}. Documents and signatures carry their body
+# inline along with its checksum, or only the checksum when the body is
+# already in the blob store, as bodies over blobs.MAX_EVENT_BODY_SIZE are.
+
+TOPICS = ('products', 'documents', 'signatures', 'fields', 'templates')
+
+# Entities that can be removed; app-api never removes signatures.
+REMOVABLE = ('products', 'documents', 'fields', 'templates')
+
+# Inline body attribute -> checksum attribute, per topic.
+BODIES = {'documents': ('content', 'checksum'), 'signatures': ('signed_content', 'signed_checksum')}
+
+#### Inputs ####
+
+class ProductInput(BaseModel):
+    name: str
+
+class DocumentInput(BaseModel):
+    name: str
+    content: str
+    first_name: str
+    last_name: str
+    email: str
+
+class SignatureInput(BaseModel):
+    document_id: str
+    signed_by_email: str
+    signed_content: str
+
+class FieldInput(BaseModel):
+    name: str
+    type: str
+
+class TemplateInput(BaseModel):
+    name: str
+    template: str
+    field_ids: List[str] = []
+
+INPUTS: Dict[str, type[BaseModel]] = {
+    'products': ProductInput,
+    'documents': DocumentInput,
+    'signatures': SignatureInput,
+    'fields': FieldInput,
+    'templates': TemplateInput,
+}
+
+#### Events ####
+
+def checksum(content: str) -> str:
+    "The blob store's key for a body: the hex SHA-256 of its UTF-8 encoding."
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def event(topic: str, input: BaseModel) -> Dict[str, Any]:
+    """Returns the event creating an entity from `input`, under a fresh id."""
+    data = input.model_dump()
+    if topic == 'documents':
+        data['checksum'] = checksum(data['content'])
+    elif topic == 'signatures':
+        data['signed_checksum'] = checksum(data['signed_content'])
+        data['signed_ts'] = datetime.datetime.now().isoformat()
+    return {'id': str(uuid.uuid1()), **data}
+
+def removal(id: str) -> Dict[str, Any]:
+    return {'id': id, 'deleted': True}
+
+async def store_large_body(topic: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    """Puts a body too large to send inline in the blob store and returns the
+    event without it. Other events are returned as they are."""
+    # Imported here as env, which blobs.py needs, imports this module.
+    from . import blobs
+    if (body := BODIES.get(topic)) and body[0] in event:
+        if len(data := event[body[0]].encode()) > blobs.MAX_EVENT_BODY_SIZE:
+            await blobs.put(data)
+            return {k: v for k, v in event.items() if k != body[0]}
+    return event
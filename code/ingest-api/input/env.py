@@ -1,7 +1,11 @@
 import os
+from typing import TYPE_CHECKING
 import logging
 
-from . import http_server
+from . import entities, http_server
+
+if TYPE_CHECKING:
+    from . import admission, consumer, couchbase, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +17,15 @@ def get_auth_oidc_audience() -> str | None:
 def get_auth_oidc_jwk_url() -> str | None:
     return os.environ.get('AUTH_OIDC_JWK_URL')
 
+def get_auth_oidc_jwks_ttl() -> int:
+    return int(os.environ.get('AUTH_OIDC_JWKS_TTL', '300'))
+
+def get_auth_token_cache_size() -> int:
+    return int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', '10000'))
+
+def get_auth_token_cache_negative_ttl() -> int:
+    return int(os.environ.get('AUTH_TOKEN_CACHE_NEGATIVE_TTL', '5'))
+
 ## HTTP ##
 
 def get_http_port() -> int | None:
@@ -34,12 +47,141 @@ def get_http_autoreload() -> bool:
 def get_http_graphql_ui() -> bool:
     return os.environ.get('HTTP_GRAPHQL_UI', 'false').lower() == 'true'
 
+def get_http_graphql_document_cache_size() -> int:
+    return int(os.environ.get('HTTP_GRAPHQL_DOCUMENT_CACHE_SIZE', '1000'))
+
+def get_http_graphql_persisted_query_cache_size() -> int:
+    return int(os.environ.get('HTTP_GRAPHQL_PERSISTED_QUERY_CACHE_SIZE', '10000'))
+
+def get_http_graphql_persisted_query_allowlist() -> str | None:
+    "Path to a JSON object of query hash -> query; when set, only those queries run."
+    return os.environ.get('HTTP_GRAPHQL_PERSISTED_QUERY_ALLOWLIST') or None
+
+def get_http_workers() -> int:
+    "Defaults to one worker per available CPU."
+    return int(os.environ.get('HTTP_WORKERS') or http_server.default_workers())
+
+def get_http_loop() -> str:
+    return os.environ.get('HTTP_LOOP', 'auto')
+
+def get_http_parser() -> str:
+    return os.environ.get('HTTP_PARSER', 'auto')
+
+def get_http_keep_alive() -> int:
+    "Seconds; longer than the gateway's upstream idle timeout so it closes first."
+    return int(os.environ.get('HTTP_KEEP_ALIVE', '75'))
+
+def get_http_backlog() -> int:
+    return int(os.environ.get('HTTP_BACKLOG', '2048'))
+
+def get_http_graceful_timeout() -> int:
+    return int(os.environ.get('HTTP_GRACEFUL_TIMEOUT', '30'))
+
 def get_http_conf() -> http_server.ServerConf:
     return http_server.ServerConf(
         port=int(get_http_port()),
         host=get_http_host(),
         debug=get_http_debug(),
-        autoreload=get_http_autoreload()
+        autoreload=get_http_autoreload(),
+        workers=get_http_workers(),
+        loop=get_http_loop(),
+        http=get_http_parser(),
+        keep_alive_s=get_http_keep_alive(),
+        backlog=get_http_backlog(),
+        graceful_timeout_s=get_http_graceful_timeout()
+    )
+
+## Admission ##
+
+def get_rate_limit_backend() -> str:
+    "Where token buckets live: local (per worker) or couchbase (shared)."
+    return os.environ.get('RATE_LIMIT_BACKEND', 'local').lower()
+
+def get_rate_limit_user_rate() -> float:
+    "Requests per second per user (JWT `sub`); 0 disables the limit."
+    return float(os.environ.get('RATE_LIMIT_USER_RATE', '0'))
+
+def get_rate_limit_user_burst() -> int:
+    return int(os.environ.get('RATE_LIMIT_USER_BURST', '20'))
+
+def get_rate_limit_ip_rate() -> float:
+    "Requests per second per client IP address; 0 disables the limit."
+    return float(os.environ.get('RATE_LIMIT_IP_RATE', '0'))
+
+def get_rate_limit_ip_burst() -> int:
+    return int(os.environ.get('RATE_LIMIT_IP_BURST', '50'))
+
+def get_rate_limit_costs() -> dict[str, int]:
+    "Tokens taken by requests to a path, e.g. /input/add_products=10,/api=2; 1 for other paths."
+    costs = {}
+    for entry in os.environ.get('RATE_LIMIT_COSTS', '').split(','):
+        if entry.strip():
+            path, _, cost = entry.partition('=')
+            costs[path.strip()] = int(cost)
+    return costs
+
+def get_rate_limit_trusted_proxies() -> int:
+    "Proxies in front of the service, e.g. 1 behind the gateway, whose X-Forwarded-For entries are trusted."
+    return int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+
+def get_rate_limit_max_keys() -> int:
+    return int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+
+def get_admission_max_in_flight() -> int:
+    "Requests a worker handles at once before shedding new ones with 503; 0 disables the check."
+    return int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '0'))
+
+def get_admission_max_loop_lag() -> float:
+    "Seconds the event loop may run behind before new requests are shed with 503; 0 disables the check."
+    return float(os.environ.get('ADMISSION_MAX_LOOP_LAG', '0'))
+
+def get_admission_exempt_paths() -> list[str]:
+    return [p.strip() for p in os.environ.get('ADMISSION_EXEMPT_PATHS', '/metrics').split(',') if p.strip()]
+
+def get_admission_conf() -> 'admission.AdmissionConf':
+    from . import admission
+    return admission.AdmissionConf(
+        backend=get_rate_limit_backend(),
+        user_rate=get_rate_limit_user_rate(),
+        user_burst=get_rate_limit_user_burst(),
+        ip_rate=get_rate_limit_ip_rate(),
+        ip_burst=get_rate_limit_ip_burst(),
+        costs=get_rate_limit_costs(),
+        trusted_proxies=get_rate_limit_trusted_proxies(),
+        max_keys=get_rate_limit_max_keys(),
+        max_in_flight=get_admission_max_in_flight(),
+        max_loop_lag_s=get_admission_max_loop_lag(),
+        exempt_paths=get_admission_exempt_paths()
+    )
+
+## Couchbase ##
+
+def get_couchbase_bucket() -> str:
+    return os.environ.get('COUCHBASE_BUCKET', 'cillers')
+
+def get_couchbase_url() -> str:
+    return os.environ.get('COUCHBASE_URL', 'couchbase://couchbase')
+
+def get_couchbase_username() -> str | None:
+    return os.environ.get('COUCHBASE_USERNAME')
+
+def get_couchbase_password() -> str | None:
+    return os.environ.get('COUCHBASE_PASSWORD')
+
+def get_couchbase_max_workers() -> int:
+    return int(os.environ.get('COUCHBASE_MAX_WORKERS', '16'))
+
+def get_couchbase_durability() -> str:
+    "Durability level of the consumer's writes: none, majority, majority_and_persist_to_active or persist_to_majority."
+    return os.environ.get('COUCHBASE_DURABILITY', 'none').lower()
+
+def get_couchbase_conf() -> 'couchbase.ConnectionConf':
+    # Imported here so commands that never touch Couchbase skip loading the SDK.
+    from . import couchbase
+    return couchbase.ConnectionConf(
+        url=get_couchbase_url(),
+        username=get_couchbase_username(),
+        password=get_couchbase_password()
     )
 
 ## Kafka ##
@@ -47,6 +189,81 @@ def get_http_conf() -> http_server.ServerConf:
 def get_kafka_broker() -> str | None:
     return os.environ.get('KAFKA_BROKER')
 
+def get_kafka_durability() -> str:
+    return os.environ.get('KAFKA_DURABILITY', 'all').lower()
+
+def get_kafka_linger_ms() -> int:
+    return int(os.environ.get('KAFKA_LINGER_MS', '5'))
+
+def get_kafka_batch_size() -> int:
+    return int(os.environ.get('KAFKA_BATCH_SIZE', '131072'))
+
+def get_kafka_compression() -> str:
+    "Compression of produced batches: none, gzip, snappy, lz4 or zstd."
+    return os.environ.get('KAFKA_COMPRESSION', 'lz4').lower()
+
+def get_kafka_serializer() -> str:
+    "Format of produced events: json, msgpack or avro."
+    return os.environ.get('KAFKA_SERIALIZER', 'json').lower()
+
+def get_kafka_serializers() -> dict[str, str]:
+    "Per-topic formats overriding KAFKA_SERIALIZER, e.g. products=msgpack,documents=avro."
+    formats = {}
+    for entry in os.environ.get('KAFKA_SERIALIZERS', '').split(','):
+        if entry.strip():
+            topic, _, format = entry.partition('=')
+            formats[topic.strip()] = format.strip().lower()
+    return formats
+
+def get_kafka_schema_dir() -> str:
+    "Directory of the Avro schemas; see serialization.py."
+    return os.environ.get('KAFKA_SCHEMA_DIR') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schemas')
+
+def get_kafka_serializer_conf() -> 'serialization.SerializerConf':
+    from . import serialization
+    return serialization.SerializerConf(
+        default=get_kafka_serializer(),
+        topics=get_kafka_serializers(),
+        schema_dir=get_kafka_schema_dir()
+    )
+
+## Consumer ##
+
+def get_consumer_group() -> str:
+    "Instances sharing a group split the topic's partitions between them."
+    return os.environ.get('CONSUMER_GROUP', 'entity-sink')
+
+def get_consumer_topics() -> list[str]:
+    "Comma-separated entity topics to write to Couchbase; all of them by default."
+    if topics := os.environ.get('CONSUMER_TOPICS'):
+        return [t.strip() for t in topics.split(',') if t.strip()]
+    return list(entities.TOPICS)
+
+def get_consumer_batch_size() -> int:
+    return int(os.environ.get('CONSUMER_BATCH_SIZE', '1000'))
+
+def get_consumer_batch_timeout() -> float:
+    "Seconds to wait for a batch to fill before writing what has arrived."
+    return float(os.environ.get('CONSUMER_BATCH_TIMEOUT', '0.5'))
+
+def get_consumer_conf() -> 'consumer.ConsumerConf':
+    from . import consumer
+    return consumer.ConsumerConf(
+        broker=get_kafka_broker(),
+        group=get_consumer_group(),
+        bucket=get_couchbase_bucket(),
+        topics=get_consumer_topics(),
+        batch_size=get_consumer_batch_size(),
+        batch_timeout_s=get_consumer_batch_timeout(),
+        durability=get_couchbase_durability()
+    )
+
+## Metrics ##
+
+def get_metrics_dir() -> str | None:
+    "Directory where workers share metric snapshots; unset with a single worker."
+    return os.environ.get('METRICS_DIR') or None
+
 ## Validation
 
 def validate():
@@ -60,7 +277,54 @@ def validate():
     if not get_http_port():
         logger.error('HTTP_PORT is not set')
         ok = False
+    if (allowlist := get_http_graphql_persisted_query_allowlist()) and not os.path.isfile(allowlist):
+        logger.error(f"HTTP_GRAPHQL_PERSISTED_QUERY_ALLOWLIST {allowlist} does not exist")
+        ok = False
+    if not get_kafka_broker():
+        logger.error('KAFKA_BROKER is not set')
+        ok = False
+    if get_kafka_durability() not in ('none', 'leader', 'all'):
+        logger.error('KAFKA_DURABILITY must be one of none, leader, all')
+        ok = False
+    if get_kafka_compression() not in ('none', 'gzip', 'snappy', 'lz4', 'zstd'):
+        logger.error('KAFKA_COMPRESSION must be one of none, gzip, snappy, lz4, zstd')
+        ok = False
+    # Bodies too large for an event are written to the blob store.
+    if not get_couchbase_username():
+        logger.error('COUCHBASE_USERNAME is not set')
+        ok = False
+    if not get_couchbase_password():
+        logger.error('COUCHBASE_PASSWORD is not set')
+        ok = False
+    from . import serialization
+    for problem in serialization.Serializers(get_kafka_serializer_conf()).check(entities.TOPICS):
+        logger.error(f"Kafka serializers: {problem}")
+        ok = False
+    try:
+        get_admission_conf()
+    except ValueError as e:
+        logger.error(f"Rate limit and admission settings are invalid: {e}")
+        ok = False
+    return ok
+
+def validate_consumer():
+    ok = True
     if not get_kafka_broker():
         logger.error('KAFKA_BROKER is not set')
         ok = False
+    if not get_couchbase_username():
+        logger.error('COUCHBASE_USERNAME is not set')
+        ok = False
+    if not get_couchbase_password():
+        logger.error('COUCHBASE_PASSWORD is not set')
+        ok = False
+    if get_couchbase_durability() not in ('none', 'majority', 'majority_and_persist_to_active', 'persist_to_majority'):
+        logger.error('COUCHBASE_DURABILITY must be one of none, majority, majority_and_persist_to_active, persist_to_majority')
+        ok = False
+    if unknown := set(get_consumer_topics()) - set(entities.TOPICS):
+        logger.error(f"CONSUMER_TOPICS has unknown topics {', '.join(sorted(unknown))}, must be among {', '.join(entities.TOPICS)}")
+        ok = False
+    if get_consumer_batch_size() <= 0:
+        logger.error('CONSUMER_BATCH_SIZE must be positive')
+        ok = False
     return ok
@@ -1,15 +1,12 @@
 from functools import cached_property
-import json
 import strawberry
-from strawberry.fastapi import BaseContext, GraphQLRouter
+from strawberry.fastapi import BaseContext
 from strawberry.permission import BasePermission
 from strawberry.types import Info as _Info
 from strawberry.types.info import RootValueType
 import logging
-import uuid
-from confluent_kafka import Producer
 
-from . import auth
+from . import auth, delivery, entities, env, metrics, persisted_queries, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +23,7 @@ class Context(BaseContext):
                         return data
 
     @cached_property
-    def producer(self) -> Producer:
+    def producer(self) -> delivery.AsyncProducer:
         return self.request.app.state.producer
 
 async def get_context() -> Context:
@@ -52,17 +49,67 @@ class Query:
 
 #### Mutations ####
 
+# Each mutation produces an event to the entity's topic (see entities.py)
+# and returns the id of the entity it adds or removes.
+
+async def _produce(info: Info, topic: str, event: dict) -> str:
+    event = await entities.store_large_body(topic, event)
+    await info.context.producer.produce(topic, value=serialization.encode(topic, event), key=event['id'])
+    return event['id']
+
 @strawberry.type
 class Mutation:
     @strawberry.field(permission_classes=[IsAuthenticated])
-    async def add_product(self, name: str, info: Info) -> None:
-        id = str(uuid.uuid1())
-        producer = info.context.producer
-        producer.produce("products", value=json.dumps({'id': id, 'name': name}))
-        producer.flush()
+    async def add_product(self, name: str, info: Info) -> str:
+        return await _produce(info, 'products', entities.event('products', entities.ProductInput(name=name)))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def remove_product(self, id: str, info: Info) -> str:
+        return await _produce(info, 'products', entities.removal(id))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def add_document(self, name: str, content: str, first_name: str, last_name: str, email: str,
+                           info: Info) -> str:
+        document = entities.DocumentInput(name=name, content=content, first_name=first_name,
+                                          last_name=last_name, email=email)
+        return await _produce(info, 'documents', entities.event('documents', document))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def remove_document(self, id: str, info: Info) -> str:
+        return await _produce(info, 'documents', entities.removal(id))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def sign_document(self, document_id: str, signed_by_email: str, signed_content: str, info: Info) -> str:
+        signature = entities.SignatureInput(document_id=document_id, signed_by_email=signed_by_email,
+                                            signed_content=signed_content)
+        return await _produce(info, 'signatures', entities.event('signatures', signature))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def add_field(self, name: str, type: str, info: Info) -> str:
+        return await _produce(info, 'fields', entities.event('fields', entities.FieldInput(name=name, type=type)))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def remove_field(self, id: str, info: Info) -> str:
+        return await _produce(info, 'fields', entities.removal(id))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def add_template(self, name: str, template: str, field_ids: list[str], info: Info) -> str:
+        template_input = entities.TemplateInput(name=name, template=template, field_ids=field_ids)
+        return await _produce(info, 'templates', entities.event('templates', template_input))
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def remove_template(self, id: str, info: Info) -> str:
+        return await _produce(info, 'templates', entities.removal(id))
 
 #### API ####
 
 def get_app():
-    return GraphQLRouter(strawberry.Schema(query=Query, mutation=Mutation),
-                         context_getter=get_context)
+    allowlist = env.get_http_graphql_persisted_query_allowlist()
+    return persisted_queries.PersistedQueryRouter(
+        strawberry.Schema(query=Query, mutation=Mutation,
+                          extensions=[metrics.ResolverMetrics,
+                                      persisted_queries.document_cache(env.get_http_graphql_document_cache_size())]),
+        context_getter=get_context,
+        store=persisted_queries.QueryStore(env.get_http_graphql_persisted_query_cache_size(),
+                                           persisted_queries.load_allowlist(allowlist) if allowlist else None)
+    )
@@ -1,4 +1,5 @@
-from typing import Annotated
+import os
+from typing import Annotated, Literal
 from pydantic import BaseModel, Field
 import logging
 import uvicorn
@@ -10,14 +11,46 @@ class ServerConf(BaseModel):
     host: str
     debug: bool = False
     autoreload: bool = False
+    workers: Annotated[int, Field(gt=0)] = 1
+    loop: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    http: Literal['auto', 'h11', 'httptools'] = 'auto'
+    keep_alive_s: Annotated[int, Field(gt=0)] = 5
+    backlog: Annotated[int, Field(gt=0)] = 2048
+    graceful_timeout_s: Annotated[int, Field(ge=0)] = 30
+
+#### Utils ####
+
+def default_workers() -> int:
+    """Returns the number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 #### Actions ####
 
 def run(conf: ServerConf, app_ref: str):
-    """Runs the server."""
-    logger.info(f"Starting server on {conf.host}:{conf.port}")
+    """Runs the server.
+
+    With more than one worker, uvicorn supervises one process per worker on a
+    shared socket. Each worker runs the app's startup hooks before it starts
+    accepting connections, and on SIGTERM stops accepting, finishes in-flight
+    requests for up to `graceful_timeout_s`, then runs the shutdown hooks.
+    """
+    workers = conf.workers
+    if conf.autoreload and workers > 1:
+        # Reload mode runs one process under a file watcher; for development only.
+        logger.warning(f"Autoreload is on, running 1 worker instead of {workers}")
+        workers = 1
+    logger.info(f"Starting server on {conf.host}:{conf.port} with {workers} worker(s)")
     uvicorn.run(app_ref,
                 host=conf.host,
                 port=conf.port,
                 log_level="debug" if conf.debug else "info",
-                reload=conf.autoreload)
+                reload=conf.autoreload,
+                workers=workers,
+                loop=conf.loop,
+                http=conf.http,
+                timeout_keep_alive=conf.keep_alive_s,
+                backlog=conf.backlog,
+                timeout_graceful_shutdown=conf.graceful_timeout_s)
@@ -1,15 +1,32 @@
-import rich.traceback
+from typing import Callable
 import logging
 
 from . import env
 
 logger = logging.getLogger(__name__)
 
-def init():
-    """Initializes the application."""
+_initialized = False
+_result: int | None = None
+
+def init(validate: Callable[[], bool] | None = None):
+    """Initializes the application.
+
+    `validate` checks the environment, env.validate by default. Only the
+    first call does any work; later calls (e.g. from the server's startup
+    hook in the same process) return its result.
+    """
+    global _initialized, _result
+    if _initialized:
+        return _result
+    _initialized = True
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    rich.traceback.install(show_locals=True)
-    if not env.validate():
+    if env.get_http_debug():
+        # rich takes longer to import than the rest of init, so only load it
+        # when its tracebacks are wanted.
+        import rich.traceback
+        rich.traceback.install(show_locals=True)
+    if not (validate or env.validate)():
         logger.error("Environment variables are not set correctly – aborting.")
-        return 1
+        _result = 1
+    return _result
@@ -0,0 +1,221 @@
+import asyncio
+from contextlib import asynccontextmanager
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Drives an ASGI app in-process, without sockets or an HTTP client library,
+# and summarizes latency, throughput and allocations as JSON-friendly dicts.
+#
+# Latencies cover the whole app, from the ASGI call to the last body chunk.
+# Allocations are measured in a separate sequential pass under tracemalloc,
+# which slows everything down too much to share a pass with the timings.
+
+#### ASGI client ####
+
+def _headers(headers: Dict[str, str]) -> List[tuple[bytes, bytes]]:
+    return [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+
+async def _body_messages(body: bytes | AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    if isinstance(body, bytes):
+        yield {'type': 'http.request', 'body': body, 'more_body': False}
+        return
+    async for chunk in body:
+        yield {'type': 'http.request', 'body': chunk, 'more_body': True}
+    yield {'type': 'http.request', 'body': b'', 'more_body': False}
+
+class WebSocket:
+    def __init__(self, app: Callable, scope: Dict[str, Any]):
+        self._app = app
+        self._scope = scope
+        self._inbound: asyncio.Queue = asyncio.Queue()
+        self._outbound: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        """Opens the connection. Raises ConnectionError if the app rejects it."""
+        self._inbound.put_nowait({'type': 'websocket.connect'})
+        self._task = asyncio.create_task(self._app(self._scope, self._inbound.get, self._outbound.put))
+        if (message := await self._outbound.get())['type'] != 'websocket.accept':
+            raise ConnectionError(f"WebSocket rejected: {message}")
+
+    async def send_json(self, data: Any) -> None:
+        self._inbound.put_nowait({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self) -> Any:
+        message = await self._outbound.get()
+        if message['type'] == 'websocket.close':
+            raise ConnectionError(f"WebSocket closed: {message}")
+        return json.loads(message.get('text') or message['bytes'])
+
+    async def close(self) -> None:
+        self._inbound.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, 5)
+            except asyncio.TimeoutError:
+                logger.warning("WebSocket handler did not finish after disconnect")
+
+class AsgiClient:
+    def __init__(self, app: Callable, headers: Dict[str, str] | None = None):
+        self._app = app
+        self._headers = headers or {}
+
+    def _scope(self, type: str, path: str, headers: Dict[str, str] | None) -> Dict[str, Any]:
+        path, _, query = path.partition('?')
+        return {'type': type, 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+                'headers': _headers({'host': 'benchmark', **self._headers, **(headers or {})}),
+                'client': ('127.0.0.1', 50000), 'server': ('benchmark', 80)}
+
+    async def request(self, method: str, path: str, body: bytes | AsyncIterator[bytes] = b'',
+                      headers: Dict[str, str] | None = None) -> tuple[int, bytes]:
+        """Sends a request and returns the status and full response body."""
+        scope = {**self._scope('http', path, headers), 'method': method}
+        messages = _body_messages(body)
+        complete = asyncio.Event()
+        status = 0
+        parts = []
+
+        async def receive() -> Dict[str, Any]:
+            try:
+                return await messages.__anext__()
+            except StopAsyncIteration:
+                await complete.wait()
+                return {'type': 'http.disconnect'}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                parts.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    complete.set()
+
+        await self._app(scope, receive, send)
+        return status, b''.join(parts)
+
+    async def post_json(self, path: str, data: Any, headers: Dict[str, str] | None = None) -> tuple[int, Any]:
+        status, body = await self.request('POST', path, json.dumps(data).encode(),
+                                          {'content-type': 'application/json', **(headers or {})})
+        return status, json.loads(body) if body else None
+
+    def websocket(self, path: str, subprotocols: List[str] = [], headers: Dict[str, str] | None = None) -> WebSocket:
+        return WebSocket(self._app, {**self._scope('websocket', path, headers), 'subprotocols': subprotocols})
+
+@asynccontextmanager
+async def lifespan(app: Callable) -> AsyncIterator[None]:
+    """Runs the app's startup hooks, then its shutdown hooks on exit."""
+    inbound: asyncio.Queue = asyncio.Queue()
+    outbound: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, inbound.get, outbound.put))
+    inbound.put_nowait({'type': 'lifespan.startup'})
+    if (message := await outbound.get())['type'] != 'lifespan.startup.complete':
+        raise RuntimeError(f"App failed to start: {message.get('message')}")
+    try:
+        yield
+    finally:
+        inbound.put_nowait({'type': 'lifespan.shutdown'})
+        await outbound.get()
+        await task
+
+#### Measurement ####
+
+def summarize_latencies(latencies_s: List[float]) -> Dict[str, float]:
+    """Returns nearest-rank percentiles, mean and max, in milliseconds."""
+    if not latencies_s:
+        return {}
+    ordered = sorted(latencies_s)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+    return {name: round(value * 1000, 3) for name, value in (
+        ('p50', percentile(50)), ('p90', percentile(90)), ('p99', percentile(99)),
+        ('max', ordered[-1]), ('mean', sum(ordered) / len(ordered)),
+    )}
+
+async def run_load(request: Callable[[int], Awaitable[Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Calls `request(i)` for i in range(requests) from `concurrency` tasks.
+
+    Failed calls (those raising) are counted and left out of the latencies.
+    """
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal next_index, errors
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                await request(index)
+            except Exception:
+                if not errors:
+                    logger.exception("Benchmark request failed")
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration_s = time.perf_counter() - started
+    return {'requests': requests, 'errors': errors, 'concurrency': concurrency,
+            'duration_s': round(duration_s, 3),
+            'throughput_rps': round(len(latencies) / duration_s, 3) if duration_s else 0.0,
+            'latency_ms': summarize_latencies(latencies)}
+
+async def measure_allocations(request: Callable[[int], Awaitable[Any]], requests: int) -> Dict[str, Any]:
+    """Runs `requests` calls one at a time under tracemalloc.
+
+    Reports the peak traced memory above the starting point, which for
+    sequential calls approximates one request's working set, and the memory
+    still held afterwards per request.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for index in range(requests):
+            await request(index)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'requests': requests,
+            'peak_bytes': peak - baseline,
+            'retained_bytes_per_request': round((current - baseline) / requests) if requests else 0}
+
+#### Reports ####
+
+def report(service: str, config: Dict[str, Any], scenarios: Dict[str, Any]) -> Dict[str, Any]:
+    return {'service': service,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': config,
+            'scenarios': scenarios}
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns a message per scenario whose p99 latency or throughput is worse
+    than the baseline's by more than `tolerance` (a fraction)."""
+    regressions = []
+    for name, result in current['scenarios'].items():
+        if (base := baseline.get('scenarios', {}).get(name)) is None:
+            continue
+        base_p99, p99 = base.get('latency_ms', {}).get('p99'), result.get('latency_ms', {}).get('p99')
+        if base_p99 and p99 and p99 > base_p99 * (1 + tolerance):
+            regressions.append(f"{name}: p99 {p99} ms vs {base_p99} ms")
+        base_rps, rps = base.get('throughput_rps'), result.get('throughput_rps')
+        if base_rps and rps is not None and rps < base_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {rps}/s vs {base_rps}/s")
+    return regressions
@@ -1,4 +1,6 @@
 import argparse
+import json
+import signal
 import sys
 import logging
 
@@ -12,6 +14,43 @@ def handle_run(args):
         return v
     http_server.run(env.get_http_conf(), "input.routes:app")
 
+def handle_consume(args):
+    """Writes the entity topics to Couchbase until interrupted."""
+    # Imported here as it pulls in the Couchbase SDK, which `run` never needs.
+    from . import consumer
+    if v := init.init(env.validate_consumer):
+        return v
+    sink = consumer.EntitySink(env.get_consumer_conf(), env.get_couchbase_conf())
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: sink.stop())
+    try:
+        sink.run()
+    except consumer.WriteError as e:
+        logger.error(f"Stopping: {e}")
+        return 1
+
+def handle_benchmark(args):
+    """Benchmarks the app in-process against local stand-ins and reports JSON."""
+    from . import benchmark, loadgen
+    if unknown := set(args.scenario or []) - set(benchmark.SCENARIOS):
+        logger.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return 1
+    conf = benchmark.BenchmarkConf(**{name: value for name, value in vars(args).items()
+                                      if name in benchmark.BenchmarkConf.model_fields and value is not None})
+    report = benchmark.run(conf, args.scenario or list(benchmark.SCENARIOS))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if regressions := loadgen.compare(baseline, report, args.tolerance):
+            for regression in regressions:
+                logger.error(f"Regression in {regression}")
+            return 1
+
 def parse_args(args: list[str]):
     """Parses command-line arguments."""
     parser = argparse.ArgumentParser(description="Example app.")
@@ -20,6 +59,25 @@ def parse_args(args: list[str]):
     run_parser = subparsers.add_parser('run')
     run_parser.set_defaults(command=handle_run)
 
+    consume_parser = subparsers.add_parser('consume')
+    consume_parser.set_defaults(command=handle_consume)
+
+    benchmark_parser = subparsers.add_parser('benchmark')
+    benchmark_parser.add_argument('--scenario', action='append',
+                                  help="Scenario to run (repeatable). Runs all of them by default.")
+    benchmark_parser.add_argument('--requests', type=int, help="Timed requests per scenario.")
+    benchmark_parser.add_argument('--concurrency', type=int, help="Concurrent requests.")
+    benchmark_parser.add_argument('--warmup-requests', type=int, help="Untimed requests before each scenario.")
+    benchmark_parser.add_argument('--allocation-requests', type=int,
+                                  help="Sequential requests traced for allocations.")
+    benchmark_parser.add_argument('--ack-latency-ms', type=float, help="Simulated Kafka ack latency.")
+    benchmark_parser.add_argument('--bursts', type=int, help="Timed bulk requests in the burst scenarios.")
+    benchmark_parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    benchmark_parser.add_argument('--baseline', help="Report to compare against; exits 1 on a regression.")
+    benchmark_parser.add_argument('--tolerance', type=float, default=0.2,
+                                  help="Allowed p99/throughput regression against the baseline, as a fraction.")
+    benchmark_parser.set_defaults(command=handle_benchmark)
+
     args = parser.parse_args(args)
 
     if 'command' not in args:
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Hashable, Iterator
+
+from graphql import GraphQLError
+from strawberry.extensions import SchemaExtension
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.http.exceptions import HTTPException
+from strawberry.schema.execute import parse_document, validate_document
+from strawberry.types import ExecutionResult
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Automatic persisted queries (the Apollo protocol): a client sends only the
+# SHA-256 of its query in `extensions.persistedQuery` and falls back to
+# sending the full text once if the server answers PersistedQueryNotFound.
+# Independently, parsed and validated documents are cached by query text, so
+# repeated queries skip both steps whether they arrive persisted or not.
+
+#### LRU ####
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            if (value := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+#### Document cache ####
+
+_documents: _LRU | None = None
+
+def document_cache(max_size: int) -> type[SchemaExtension]:
+    """Returns a schema extension caching parsed and validated documents.
+
+    Validation results are keyed by the rule set too, as other extensions may
+    add rules per operation.
+    """
+    global _documents
+    _documents = _LRU(max_size)
+
+    class DocumentCache(SchemaExtension):
+        def on_parse(self) -> Iterator[None]:
+            context = self.execution_context
+            if (document := _documents.get(('parse', context.query))) is None:
+                try:
+                    document = parse_document(context.query, **context.parse_options)
+                except GraphQLError:
+                    # Not cached: strawberry parses it again and replies with the errors.
+                    yield
+                    return
+                _documents.put(('parse', context.query), document)
+            context.graphql_document = document
+            yield
+
+        def on_validate(self) -> Iterator[None]:
+            context = self.execution_context
+            key = ('validate', context.query, tuple(context.validation_rules))
+            if (errors := _documents.get(key)) is None:
+                errors = validate_document(context.schema._schema, context.graphql_document, context.validation_rules)
+                _documents.put(key, errors)
+            context.errors = errors
+            yield
+
+    return DocumentCache
+
+#### Persisted queries ####
+
+class PersistedQueryNotFound(Exception):
+    pass
+
+class PersistedQueryNotAllowed(Exception):
+    pass
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+def load_allowlist(path: str) -> Dict[str, str]:
+    """Reads a JSON object mapping SHA-256 hashes to query text.
+
+    Raises ValueError if a hash does not match its query.
+    """
+    with open(path) as f:
+        allowlist = json.load(f)
+    for hash_, query in allowlist.items():
+        if query_hash(query) != hash_:
+            raise ValueError(f"Hash {hash_} in {path} does not match its query")
+    return allowlist
+
+class QueryStore:
+    """Maps query hashes to query text.
+
+    Without an allow-list, any query a client sends is registered in a bounded
+    LRU. With one, only the allow-listed queries can be run, by hash or text.
+    """
+
+    def __init__(self, max_size: int, allowlist: Dict[str, str] | None = None):
+        self._queries = _LRU(max_size)
+        self._allowlist = allowlist
+
+    def resolve(self, query: str | None, hash_: str | None) -> str:
+        if self._allowlist is not None:
+            hash_ = hash_ or query_hash(query or '')
+            if hash_ not in self._allowlist:
+                raise PersistedQueryNotAllowed()
+            return self._allowlist[hash_]
+        if hash_ is None:
+            return query
+        if query is None:
+            if (query := self._queries.get(hash_)) is None:
+                raise PersistedQueryNotFound()
+            return query
+        if query_hash(query) != hash_:
+            raise HTTPException(400, "provided sha does not match query")
+        self._queries.put(hash_, query)
+        return query
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self._queries.stats, size=len(self._queries))
+
+def get_document_cache_stats() -> Dict[str, int]:
+    return dict(_documents.stats, size=len(_documents)) if _documents else {}
+
+def _error(message: str, code: str) -> ExecutionResult:
+    return ExecutionResult(data=None, errors=[GraphQLError(message, extensions={'code': code})])
+
+class PersistedQueryRouter(GraphQLRouter):
+    "GraphQLRouter that resolves `extensions.persistedQuery` through a QueryStore."
+
+    def __init__(self, *args, store: QueryStore, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+
+    async def parse_http_body(self, request) -> GraphQLRequestData:
+        # Mirrors the base implementation, which drops `extensions`.
+        content_type = request.content_type or ""
+        if "application/json" in content_type:
+            data = self.parse_json(await request.get_body())
+        elif content_type.startswith("multipart/form-data"):
+            data = await self.parse_multipart(request)
+        elif request.method == "GET":
+            data = self.parse_query_params(request.query_params)
+            if isinstance(data.get("extensions"), str):
+                data["extensions"] = json.loads(data["extensions"])
+        else:
+            raise HTTPException(400, "Unsupported content type")
+        persisted = (data.get("extensions") or {}).get("persistedQuery") or {}
+        return GraphQLRequestData(
+            query=self.store.resolve(data.get("query"), persisted.get("sha256Hash")),
+            variables=data.get("variables"),
+            operation_name=data.get("operationName"),
+        )
+
+    async def execute_operation(self, request, context, root_value) -> ExecutionResult:
+        try:
+            return await super().execute_operation(request, context, root_value)
+        except PersistedQueryNotFound:
+            return _error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+        except PersistedQueryNotAllowed:
+            return _error("PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED")
@@ -1,13 +1,13 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from couchbase.exceptions import CouchbaseException
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
+import asyncio
 import logging
-from confluent_kafka import Producer
-import json
-import uuid
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from . import env, init, auth
+from . import env, init, admission, async_couchbase, auth, bulk, couchbase, delivery, entities, graphql, metrics, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +15,14 @@ app = FastAPI()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+def _identify(token: str) -> str | None:
+    "The user a bearer token stands for, for per-user rate limits."
+    return (auth.decode_jwt(token) or {}).get('sub')
+
+app.add_middleware(admission.AdmissionMiddleware, conf=env.get_admission_conf(), identify=_identify)
+
 async def get_user(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
-    logger.info(f"TOKEN: {token}")
+    logger.debug("Token: %s", token)
     if token:
         if user_data := auth.decode_jwt(token):
             return user_data
@@ -24,22 +30,203 @@ async def get_user(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
                         detail="Invalid authentication credentials",
                         headers={"WWW-Authenticate": "Bearer"})
 
-class ProductInput(BaseModel):
-    name: str
-
 @app.on_event("startup")
 async def startup_event():
     init.init()
+    async_couchbase.configure(env.get_couchbase_max_workers())
+    app.state.key_refresh = await auth.start_key_refresh()
+    app.state.loop_lag_monitor = admission.start_loop_lag_monitor()
     logger.info("Connecting to Kafka")
-    app.state.producer = Producer({'bootstrap.servers': env.get_kafka_broker()})
+    app.state.producer = delivery.AsyncProducer(env.get_kafka_broker(),
+                                                delivery.Durability(env.get_kafka_durability()),
+                                                env.get_kafka_linger_ms(),
+                                                env.get_kafka_batch_size(),
+                                                env.get_kafka_compression())
+    app.state.producer.start()
+    await app.state.producer.connect()
     logger.info("Connected to Kafka")
+    metrics.stats_gauge('kafka_producer', "Kafka producer counters.", app.state.producer.get_stats)
+    metrics.stats_gauge('auth_key_store', "JWKS key store counters.", auth.get_key_store_stats)
+    metrics.stats_gauge('auth_token_cache', "Verified token cache counters.", auth.get_token_cache_stats)
+    metrics.stats_gauge('admission', "Admission control and rate limit counters.", admission.get_stats)
+    if metrics_dir := env.get_metrics_dir():
+        app.state.metrics_snapshots = asyncio.create_task(metrics.run_snapshots(metrics_dir))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.key_refresh.cancel()
+    app.state.loop_lag_monitor.cancel()
+    if snapshots := getattr(app.state, 'metrics_snapshots', None):
+        snapshots.cancel()
+    await app.state.producer.stop()
+    async_couchbase.shutdown()
+    couchbase.close_all()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(env.get_metrics_dir()), media_type="text/plain; version=0.0.4")
+
+app.include_router(graphql.get_app(), prefix="/input/graphql")
+
+#### Writes ####
+
+# Each endpoint produces one event per entity to the entity's topic (see
+# entities.py) and returns the id the entity will have once consumer.py has
+# written it to Couchbase.
+
+async def _produce(topic: str, event: dict) -> None:
+    producer: delivery.AsyncProducer = app.state.producer
+    try:
+        await producer.produce(topic, value=serialization.encode(topic, event), key=event['id'])
+    except delivery.DeliveryError as e:
+        logger.error(f"Failed to deliver {topic} event: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to deliver {topic} event")
+
+async def _store_large_body(topic: str, event: dict) -> dict:
+    try:
+        return await entities.store_large_body(topic, event)
+    except CouchbaseException as e:
+        logger.error(f"Failed to store {topic} body: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to store {topic} body")
+
+async def _add(topic: str, input: BaseModel) -> dict:
+    event = await _store_large_body(topic, entities.event(topic, input))
+    await _produce(topic, event)
+    return {'id': event['id']}
 
 @app.post("/input/add_product")
-async def add_product(product: ProductInput, user: dict = Depends(get_user)):
+async def add_product(product: entities.ProductInput, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add('products', product)
+
+@app.post("/input/add_document")
+async def add_document(document: entities.DocumentInput, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add('documents', document)
+
+@app.post("/input/sign_document")
+async def sign_document(signature: entities.SignatureInput, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add('signatures', signature)
+
+@app.post("/input/add_field")
+async def add_field(field: entities.FieldInput, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add('fields', field)
+
+@app.post("/input/add_template")
+async def add_template(template: entities.TemplateInput, user: dict = Depends(get_user)):
     if not user:
         raise HTTPException(status_code=400, detail="User not authenticated")
-    product = {'id': str(uuid.uuid1()), 'name': product.name}
-    producer: Producer = app.state.producer
-    producer.produce("products", value=json.dumps(product))
-    producer.flush()
+    return await _add('templates', template)
+
+@app.delete("/input/{topic}/{id}")
+async def remove(topic: str, id: str, user: dict = Depends(get_user)):
+    """Removes a product, document, field or template, e.g. DELETE /input/products/<id>."""
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    if topic not in entities.REMOVABLE:
+        raise HTTPException(status_code=404, detail=f"Cannot remove {topic}")
+    await _produce(topic, entities.removal(id))
     return None
+
+#### Bulk writes ####
+
+# Number of records produced before waiting for their acks in a bulk request.
+_BULK_ACK_WINDOW = 10000
+
+async def _await_acks(pending: list[tuple[dict, asyncio.Future]], summary: dict) -> None:
+    acks = await asyncio.gather(*(future for _, future in pending), return_exceptions=True)
+    for (result, _), ack in zip(pending, acks):
+        if isinstance(ack, delivery.DeliveryError):
+            result['error'] = str(ack)
+            summary['accepted'] -= 1
+            summary['failed'] += 1
+    pending.clear()
+
+async def _add_many(request: Request, topic: str):
+    """Produces an entity for every record in a streamed NDJSON or JSON-array body.
+
+    Records are validated as they arrive and produced without waiting for
+    each ack, so librdkafka can batch them. Returns one result per record.
+    A malformed stream is answered with 400 as soon as it is detected; the
+    records before the error were already accepted and produced, and are
+    listed in the reply's results.
+    """
+    if 'ndjson' in request.headers.get('content-type', ''):
+        records = bulk.iter_ndjson(request.stream())
+    else:
+        records = bulk.iter_json_array(request.stream())
+    producer: delivery.AsyncProducer = app.state.producer
+    input_type = entities.INPUTS[topic]
+    results = []
+    pending = []
+    summary = {'received': 0, 'accepted': 0, 'rejected': 0, 'failed': 0}
+    error = None
+    try:
+        async for record in records:
+            result = {'index': summary['received']}
+            results.append(result)
+            summary['received'] += 1
+            try:
+                if isinstance(record, bulk.ParseError):
+                    raise record
+                event = entities.event(topic, input_type.model_validate(record))
+            except (bulk.ParseError, ValidationError) as e:
+                result['error'] = str(e)
+                summary['rejected'] += 1
+                continue
+            try:
+                event = await entities.store_large_body(topic, event)
+            except CouchbaseException as e:
+                result['error'] = f"Failed to store body: {e}"
+                summary['failed'] += 1
+                continue
+            result['id'] = event['id']
+            summary['accepted'] += 1
+            if future := await producer.enqueue(topic, value=serialization.encode(topic, event), key=event['id']):
+                pending.append((result, future))
+            if len(pending) >= _BULK_ACK_WINDOW:
+                await _await_acks(pending, summary)
+    except bulk.StreamError as e:
+        error = str(e)
+    await _await_acks(pending, summary)
+    body = {'results': results, 'summary': summary}
+    if error:
+        body['error'] = error
+        return JSONResponse(body, status_code=400)
+    return body
+
+@app.post("/input/add_products")
+async def add_products(request: Request, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add_many(request, 'products')
+
+@app.post("/input/add_documents")
+async def add_documents(request: Request, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add_many(request, 'documents')
+
+@app.post("/input/sign_documents")
+async def sign_documents(request: Request, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add_many(request, 'signatures')
+
+@app.post("/input/add_fields")
+async def add_fields(request: Request, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add_many(request, 'fields')
+
+@app.post("/input/add_templates")
+async def add_templates(request: Request, user: dict = Depends(get_user)):
+    if not user:
+        raise HTTPException(status_code=400, detail="User not authenticated")
+    return await _add_many(request, 'templates')
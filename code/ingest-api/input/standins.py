@@ -0,0 +1,207 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+from types import ModuleType, SimpleNamespace
+from typing import Any, Callable, Dict, List
+import logging
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+import jwt
+from jwt.algorithms import RSAAlgorithm
+
+logger = logging.getLogger(__name__)
+
+# Local replacements for the services the app talks to, for benchmarks: a
+# JWKS endpoint serving a generated key, and an in-memory Kafka broker whose
+# producers and consumers implement the subset of the confluent-kafka API the
+# app uses. Neither is meant for anything but load generation.
+
+#### JWKS ####
+
+_KID = 'standin'
+
+class JwksServer:
+    """Serves a JWKS with one RSA key on localhost and issues tokens signed with it."""
+
+    def __init__(self, audience: str):
+        self.audience = audience
+        self.requests = 0
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(self._key.public_key()))
+        body = json.dumps({'keys': [{**jwk, 'kid': _KID, 'use': 'sig', 'alg': 'RS256'}]}).encode()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/jwks"
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='jwks-standin', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def issue_token(self, subject: str, ttl_s: int = 3600) -> str:
+        now = int(time.time())
+        return jwt.encode({'sub': subject, 'aud': self.audience, 'iat': now, 'exp': now + ttl_s},
+                          self._key, algorithm='RS256', headers={'kid': _KID})
+
+#### Kafka ####
+
+class Message:
+    __slots__ = ('_topic', '_value', '_key')
+
+    def __init__(self, topic: str, value: Any, key: Any):
+        self._topic = topic
+        self._value = value.encode() if isinstance(value, str) else value
+        self._key = key.encode() if isinstance(key, str) else key
+
+    def topic(self) -> str:
+        return self._topic
+
+    def value(self) -> bytes | None:
+        return self._value
+
+    def key(self) -> bytes | None:
+        return self._key
+
+    def error(self) -> None:
+        return None
+
+class Producer:
+    """Acknowledges each message `ack_latency_s` after it was produced.
+
+    Delivery callbacks run from poll() and flush(), as with librdkafka.
+    """
+
+    def __init__(self, broker: 'Kafka', conf: Dict[str, Any]):
+        self._broker = broker
+        self._pending: deque[tuple[float, Message, Callable | None]] = deque()
+        self._cond = threading.Condition()
+
+    def produce(self, topic: str, value: Any = None, key: Any = None, on_delivery: Callable | None = None, **kwargs) -> None:
+        message = Message(topic, value, key)
+        with self._cond:
+            self._pending.append((time.monotonic() + self._broker.ack_latency_s, message, on_delivery))
+            self._cond.notify()
+        self._broker.publish(message)
+
+    def poll(self, timeout: float | None = None) -> int:
+        deadline = time.monotonic() + (timeout or 0)
+        due = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._pending and self._pending[0][0] <= now:
+                    due.append(self._pending.popleft())
+                if due or now >= deadline:
+                    break
+                self._cond.wait(min(deadline, self._pending[0][0]) - now if self._pending else deadline - now)
+        for _, message, on_delivery in due:
+            if on_delivery is not None:
+                on_delivery(None, message)
+        return len(due)
+
+    def flush(self, timeout: float | None = None) -> int:
+        deadline = time.monotonic() + (timeout if timeout is not None else 3600)
+        while len(self) and time.monotonic() < deadline:
+            self.poll(0.1)
+        return len(self)
+
+    def list_topics(self, topic: str | None = None, timeout: float | None = None) -> None:
+        return None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+class Consumer:
+    """Receives the messages produced after it subscribed or was assigned its
+    partitions (`latest` offsets). Every topic has a single partition."""
+
+    def __init__(self, broker: 'Kafka', conf: Dict[str, Any]):
+        self._broker = broker
+        self._queue: queue.Queue[Message] = queue.Queue()
+        self.topics: List[str] = []
+
+    def subscribe(self, topics: List[str]) -> None:
+        self.topics = list(topics)
+        self._broker.attach(self)
+
+    def assign(self, partitions: List[Any]) -> None:
+        self.topics = list({partition.topic for partition in partitions})
+        self._broker.attach(self)
+
+    def deliver(self, message: Message) -> None:
+        self._queue.put(message)
+
+    def poll(self, timeout: float | None = None) -> Message | None:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def list_topics(self, topic: str | None = None, timeout: float | None = None) -> SimpleNamespace:
+        return SimpleNamespace(topics={topic: SimpleNamespace(partitions={0: None}, error=None)} if topic else {})
+
+    def close(self) -> None:
+        self._broker.detach(self)
+
+class Kafka:
+    """In-memory broker shared by the producers and consumers it creates."""
+
+    def __init__(self, ack_latency_s: float = 0.0):
+        self.ack_latency_s = ack_latency_s
+        self.produced: Dict[str, int] = {}
+        self._consumers: List[Consumer] = []
+        self._lock = threading.Lock()
+
+    def producer(self, conf: Dict[str, Any]) -> Producer:
+        return Producer(self, conf)
+
+    def consumer(self, conf: Dict[str, Any]) -> Consumer:
+        return Consumer(self, conf)
+
+    def attach(self, consumer: Consumer) -> None:
+        with self._lock:
+            self._consumers.append(consumer)
+
+    def detach(self, consumer: Consumer) -> None:
+        with self._lock:
+            if consumer in self._consumers:
+                self._consumers.remove(consumer)
+
+    def publish(self, message: Message) -> None:
+        with self._lock:
+            self.produced[message.topic()] = self.produced.get(message.topic(), 0) + 1
+            consumers = [c for c in self._consumers if message.topic() in c.topics]
+        for consumer in consumers:
+            consumer.deliver(message)
+
+    def install(self, *modules: ModuleType) -> None:
+        """Replaces the confluent-kafka Producer and Consumer imported by `modules`."""
+        for module in modules:
+            if hasattr(module, 'Producer'):
+                module.Producer = self.producer
+            if hasattr(module, 'Consumer'):
+                module.Consumer = self.consumer
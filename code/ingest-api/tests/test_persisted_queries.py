@@ -0,0 +1,23 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from input import graphql
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.include_router(graphql.get_app(), prefix="/input/graphql")
+    return TestClient(app)
+
+def test_syntax_error_is_a_graphql_error():
+    client = _client()
+    for _ in range(2):
+        response = client.post("/input/graphql", json={'query': "{ _unused"})
+        assert response.status_code == 200
+        errors = response.json()['errors']
+        assert errors and errors[0]['message'].startswith("Syntax Error")
+
+def test_valid_query_after_syntax_error():
+    client = _client()
+    client.post("/input/graphql", json={'query': "{ _unused"})
+    response = client.post("/input/graphql", json={'query': "{ __typename }"})
+    assert response.json()['data'] == {'__typename': 'Query'}
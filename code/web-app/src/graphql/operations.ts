@@ -8,7 +8,7 @@ export const GET_HELLO = gql`
 
 export const GET_PRODUCTS = gql`
   query GetProducts {
-    products { name, id }
+    products { edges { node { name, id } } }
   }
 `;
 
@@ -32,7 +32,7 @@ export const GET_DOCUMENT = gql`
 
 export const GET_DOCUMENTS = gql`
   query GetDocuments {
-    documents { name, id, content, firstName, lastName, email }
+    documents { edges { node { name, id, content, firstName, lastName, email } } }
   }
 `;
 
@@ -72,20 +72,24 @@ export const SIGN_DOCUMENT = gql`
 export const GET_SIGNATURES = gql`
   query GetSignatures {
     signatures {
-      id
-      document {
-        id
-        name
-        content
-        firstName
-        lastName
-        email
-        checksum
+      edges {
+        node {
+          id
+          document {
+            id
+            name
+            content
+            firstName
+            lastName
+            email
+            checksum
+          }
+          signedByEmail
+          signedContent
+          signedChecksum
+          signedTs
+        }
       }
-      signedByEmail
-      signedContent
-      signedChecksum
-      signedTs
     }
   }
 `;
@@ -143,14 +147,18 @@ export const GET_TEMPLATE = gql`
 export const GET_TEMPLATES = gql`
   query Templates {
     templates {
-        id
-        name
-        template
-        fields {
+      edges {
+        node {
+          id
+          name
+          template
+          fields {
             id
             name
             type
+          }
         }
+      }
     }
   }
 `;
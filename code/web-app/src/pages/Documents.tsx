@@ -30,7 +30,7 @@ const Documents: React.FC = () => {
       console.error('Error fetching templates:', error);
     } else if (data) {
       console.log(data);
-      setTemplate(data.templates[0]);
+      setTemplate(data.templates.edges[0]?.node ?? null);
     }
   }, [data, loading, error]);
 
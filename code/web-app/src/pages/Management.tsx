@@ -44,7 +44,7 @@ const Management: React.FC = () => {
         } else if (error) {
             console.error('Error fetching signatures:', error);
         } else if (data) {
-            setSignatures(data.signatures);
+            setSignatures(data.signatures.edges.map((edge: { node: Signature }) => edge.node));
         }
     }, [data, loading, error]);
 
@@ -55,7 +55,7 @@ const Management: React.FC = () => {
             console.error('Error fetching templates:', templateError);
         } else if (templateData) {
             console.log("Template data:", templateData);
-            setTemplates(templateData.templates);
+            setTemplates(templateData.templates.edges.map((edge: { node: Template }) => edge.node));
         }
     }, [templateData, templateLoading, templateError]);
 